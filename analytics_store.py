@@ -0,0 +1,245 @@
+"""Sales rollups maintained as each bill is recorded.
+
+The rollup tables live in the sales ledger database and are updated inside
+the same transaction as the bill itself, so dashboard queries scan one row
+per day and key instead of every bill ever generated.
+"""
+from datetime import datetime
+
+import profiling
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_sales (
+    date TEXT PRIMARY KEY,
+    bills INTEGER NOT NULL,
+    revenue REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hourly_sales (
+    date TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    bills INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (date, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS payment_sales (
+    date TEXT NOT NULL,
+    payment_mode TEXT NOT NULL,
+    bills INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (date, payment_mode)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS category_sales (
+    date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (date, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS item_sales (
+    date TEXT NOT NULL,
+    item TEXT NOT NULL,
+    item_type TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (date, item)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS item_hourly_sales (
+    date TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    category TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (date, hour, item)
+) WITHOUT ROWID;
+"""
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+class ExternalChanges:
+    """What other connections (other app processes) have committed to the ledger database.
+
+    For caches built from the ledger in one process. ``PRAGMA data_version``
+    only moves when another connection commits, so ``poll`` costs one pragma
+    until one has.
+    """
+
+    def __init__(self, conn, lock):
+        self._conn = conn
+        self._lock = lock
+        with self._lock:
+            self._version = self._data_version()
+            self._last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM bills").fetchone()[0]
+
+    def _data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def poll(self):
+        """``None`` if no other connection has committed since the last poll.
+
+        Otherwise ``(id, date, phone)`` rows for the bills recorded since the
+        last poll that found changes, by any connection; empty when another
+        process only changed something else, such as stock.
+        """
+        with self._lock:
+            version = self._data_version()
+            if version == self._version:
+                return None
+            self._version = version
+            rows = self._conn.execute(
+                "SELECT id, date, phone FROM bills WHERE id > ? ORDER BY id", (self._last_id,)
+            ).fetchall()
+            if rows:
+                self._last_id = rows[-1][0]
+            return rows
+
+
+class AnalyticsStore:
+    """Per-day rollups by hour, payment mode, category and item, and item by hour.
+
+    Shares the ledger's connection and lock; ``record`` must be called from
+    inside the ledger's write transaction.
+    """
+
+    def __init__(self, conn, lock):
+        self._conn = conn
+        self._lock = lock
+        self._conn.executescript(ROLLUP_SCHEMA)
+
+    def external_changes(self):
+        return ExternalChanges(self._conn, self._lock)
+
+    def record(self, bill_data):
+        day = bill_data["date"]
+        hour = int(bill_data["time"][:2])
+        revenue = bill_data["total_amount"]
+        payment_mode = bill_data.get("payment_mode") or "Unknown"
+
+        execute = self._conn.execute
+        execute(
+            "INSERT INTO daily_sales VALUES (?, 1, ?) ON CONFLICT (date)"
+            " DO UPDATE SET bills = bills + 1, revenue = revenue + excluded.revenue",
+            (day, revenue),
+        )
+        execute(
+            "INSERT INTO hourly_sales VALUES (?, ?, 1, ?) ON CONFLICT (date, hour)"
+            " DO UPDATE SET bills = bills + 1, revenue = revenue + excluded.revenue",
+            (day, hour, revenue),
+        )
+        execute(
+            "INSERT INTO payment_sales VALUES (?, ?, 1, ?) ON CONFLICT (date, payment_mode)"
+            " DO UPDATE SET bills = bills + 1, revenue = revenue + excluded.revenue",
+            (day, payment_mode, revenue),
+        )
+
+        categories = {}
+        items = {}
+        for line in bill_data["orders"]:
+            total = line["price"] * line["quantity"]
+            quantity, amount = categories.get(line["category"], (0, 0))
+            categories[line["category"]] = (quantity + line["quantity"], amount + total)
+            quantity, amount, item_type = items.get(line["item"], (0, 0, line.get("item_type", "veg")))
+            items[line["item"]] = (quantity + line["quantity"], amount + total, item_type)
+
+        self._conn.executemany(
+            "INSERT INTO category_sales VALUES (?, ?, ?, ?) ON CONFLICT (date, category)"
+            " DO UPDATE SET quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue",
+            [(day, name, quantity, amount) for name, (quantity, amount) in categories.items()],
+        )
+        self._conn.executemany(
+            "INSERT INTO item_sales VALUES (?, ?, ?, ?, ?) ON CONFLICT (date, item)"
+            " DO UPDATE SET quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue",
+            [(day, name, item_type, quantity, amount) for name, (quantity, amount, item_type) in items.items()],
+        )
+        self.record_item_hours(bill_data)
+
+    def record_item_hours(self, bill_data):
+        # Bucketed by when each line was ordered, which is when the kitchen had to make it
+        item_hours = {}
+        for line in bill_data["orders"]:
+            hour = int((line.get("timestamp") or bill_data["time"])[:2])
+            key = (hour, line["item"], line["category"])
+            item_hours[key] = item_hours.get(key, 0) + line["quantity"]
+        self._conn.executemany(
+            "INSERT INTO item_hourly_sales VALUES (?, ?, ?, ?, ?) ON CONFLICT (date, hour, item)"
+            " DO UPDATE SET quantity = quantity + excluded.quantity",
+            [(bill_data["date"], hour, item, category, quantity)
+             for (hour, item, category), quantity in item_hours.items()],
+        )
+
+    def is_empty(self, table="daily_sales"):
+        return self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+
+    # Queries; ``start`` and ``end`` are inclusive dates
+
+    def _query(self, sql, start, end, *params):
+        # Deferred so the order screen can come up before pandas is loaded
+        import pandas as pd
+
+        profiling.count("dataframe")
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=(str(start), str(end), *params))
+
+    def daily_revenue(self, start, end):
+        return self._query(
+            "SELECT date, bills, revenue FROM daily_sales WHERE date BETWEEN ? AND ? ORDER BY date",
+            start, end,
+        )
+
+    def payment_modes(self, start, end):
+        return self._query(
+            "SELECT payment_mode, SUM(bills) AS bills, SUM(revenue) AS revenue FROM payment_sales"
+            " WHERE date BETWEEN ? AND ? GROUP BY payment_mode ORDER BY revenue DESC",
+            start, end,
+        )
+
+    def categories(self, start, end):
+        return self._query(
+            "SELECT category, SUM(quantity) AS quantity, SUM(revenue) AS revenue FROM category_sales"
+            " WHERE date BETWEEN ? AND ? GROUP BY category ORDER BY revenue DESC",
+            start, end,
+        )
+
+    def top_items(self, start, end, limit=10):
+        return self._query(
+            "SELECT item, SUM(quantity) AS quantity, SUM(revenue) AS revenue FROM item_sales"
+            " WHERE date BETWEEN ? AND ? GROUP BY item ORDER BY quantity DESC, revenue DESC LIMIT ?",
+            start, end, limit,
+        )
+
+    def veg_split(self, start, end):
+        return self._query(
+            "SELECT item_type, SUM(quantity) AS quantity, SUM(revenue) AS revenue FROM item_sales"
+            " WHERE date BETWEEN ? AND ? GROUP BY item_type",
+            start, end,
+        )
+
+    def trading_days(self, weekday, before, limit):
+        """The latest ``limit`` dates before ``before`` that fell on ``weekday`` (Monday is 0) and had sales."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date FROM daily_sales WHERE date < ? AND strftime('%w', date) = ?"
+                " ORDER BY date DESC LIMIT ?",
+                # strftime counts weekdays from Sunday
+                (str(before), str((weekday + 1) % 7), limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def item_hours(self, day):
+        """``(hour, item, category, quantity)`` rows sold on ``day``, and the id of the newest bill they include."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT hour, item, category, quantity FROM item_hourly_sales WHERE date = ?", (str(day),)
+            ).fetchall()
+            # Read under the same lock, so no bill from this process can land in between
+            latest = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM bills").fetchone()[0]
+        return rows, latest
+
+    def hourly_heatmap(self, start, end):
+        """Revenue by weekday (rows) and hour of day (columns)."""
+        hourly = self._query(
+            "SELECT date, hour, revenue FROM hourly_sales WHERE date BETWEEN ? AND ?", start, end
+        )
+        hourly["weekday"] = [WEEKDAYS[datetime.strptime(d, "%Y-%m-%d").weekday()] for d in hourly["date"]]
+        heatmap = hourly.pivot_table(index="weekday", columns="hour", values="revenue", aggfunc="sum", fill_value=0)
+        return heatmap.reindex([day for day in WEEKDAYS if day in heatmap.index])
@@ -0,0 +1,473 @@
+"""Headless benchmarks for the billing flow.
+
+Scenarios:
+
+- ``billing``: the extracted Bill model at 10 to 10,000 order lines.
+- ``tables``: N threads acting as waiters, each adding lines to its own
+  table and generating bills through the shared TableStore and SalesLedger.
+- ``workers``: 1 to N separate processes sharing one SqliteTableStore and
+  SalesLedger, as several app servers behind a load balancer would: first
+  each on its own tables, then all on the same tables so edits conflict.
+  Checks that every line added was either billed once or is still open.
+  Bills and tab edits do not get faster with more processes: SQLite admits
+  one writer per database and every bill is synced to sales.db, so writes
+  are serialized whatever the process count. Extra processes add capacity
+  for page reruns; expect bills/s to stay flat or dip as workers are added.
+- ``history``: seeds 1k to 1M historical bills, then times the dashboard
+  rollup queries and a streamed export over that history.
+- ``app``: drives restaurant_management.py through Streamlit's AppTest, one
+  session per table: add items, generate a bill, open analytics. A bill is
+  timed until its number is shown, not just until it is queued.
+
+Results are written as JSON so releases can be compared, e.g.::
+
+    python benchmark.py --lines 10,1000,10000 --history 1000,100000 --tables 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# Every scenario writes to a scratch data directory, never to the real ledger
+SCRATCH_DIR = tempfile.mkdtemp(prefix="restaurant-bench-")
+os.environ["RESTAURANT_DATA_DIR"] = SCRATCH_DIR
+
+from billing import PAYMENT_MODES, Bill  # noqa: E402
+from catalog import load_catalog  # noqa: E402
+from pricing import quote_lines, to_rupees  # noqa: E402
+from profiling import percentile, session_state_bytes  # noqa: E402
+from sales_ledger import SalesLedger  # noqa: E402
+from table_store import SqliteTableStore, TableStore  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "restaurant_management.py")
+
+
+def latency_stats(samples):
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def random_bill_data(rng, menu, day, hour, lines, table=1):
+    orders = []
+    for _ in range(lines):
+        item = rng.choice(menu)
+        quantity = rng.randint(1, 4)
+        orders.append({
+            "timestamp": f"{hour:02d}:{rng.randint(0, 59):02d}:00",
+            "category": item.category,
+            "item": item.name,
+            "price": item.price,
+            "quantity": quantity,
+            "total": item.price * quantity,
+            "instructions": "",
+            "item_type": item.item_type,
+            "spicy": item.spicy,
+        })
+    discount = {"percentage": 0, "fixed": 0}
+    totals = quote_lines(orders, discount)
+    return {
+        "date": day.isoformat(),
+        "time": f"{hour:02d}:{rng.randint(0, 59):02d}:00",
+        "customer": {"name": "", "table": table, "phone": ""},
+        "orders": orders,
+        "payment_mode": rng.choice(PAYMENT_MODES),
+        "subtotal": to_rupees(totals.subtotal),
+        "total_amount": to_rupees(totals.total),
+        "discount": discount,
+        "notes": "",
+    }
+
+
+def tab_bill_data(table, bill, opened_at, key, payment_mode):
+    now = datetime.now()
+    return {
+        "date": now.strftime("%Y-%m-%d"),
+        "time": now.strftime("%H:%M:%S"),
+        "customer": {"name": "", "table": table, "phone": ""},
+        "orders": bill.line_dicts(),
+        "payment_mode": payment_mode,
+        "subtotal": to_rupees(bill.subtotal),
+        "total_amount": to_rupees(bill.totals({}).total),
+        "discount": {"percentage": 0, "fixed": 0},
+        "opened_at": opened_at,
+        "bill_key": key,
+    }
+
+
+# Scenarios
+
+
+def bench_billing(sizes, catalog):
+    menu = catalog.filter()
+    results = []
+    for size in sizes:
+        bill = Bill(catalog)
+        add_times = []
+        for i in range(size):
+            elapsed, _ = timed(bill.add, menu[i % len(menu)], 1 + i % 3)
+            add_times.append(elapsed)
+        totals_time, _ = timed(bill.totals, {"percentage": 10, "fixed": 50})
+        table_time, _ = timed(bill.to_dataframe)
+        pop_time, _ = timed(lambda: [bill.pop() for _ in range(len(bill))])
+        results.append({
+            "lines": size,
+            "add": latency_stats(add_times),
+            "totals_ms": totals_time * 1000,
+            "to_dataframe_ms": table_time * 1000,
+            "pop_all_ms": pop_time * 1000,
+        })
+    return results
+
+
+def bench_tables(tables, lines, bills_per_table, catalog):
+    menu = catalog.filter()
+    store = TableStore(catalog)
+    ledger = SalesLedger(os.path.join(SCRATCH_DIR, "tables.db"))
+    add_times, bill_times = [], []
+    lock = threading.Lock()
+
+    def waiter(table):
+        rng = random.Random(table)
+        local_adds, local_bills = [], []
+        for _ in range(bills_per_table):
+            for _ in range(lines):
+                started = time.perf_counter()
+                with store.edit(table) as tab:
+                    tab.bill.add(rng.choice(menu), rng.randint(1, 3))
+                local_adds.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            bill, _, opened_at, _ = store.snapshot(table)
+            key = bill.content_key(table, opened_at)
+            bill_data = tab_bill_data(table, bill, opened_at, key, rng.choice(PAYMENT_MODES))
+            store.close(table, key, lambda: ledger.append(bill_data))
+            local_bills.append(time.perf_counter() - started)
+        with lock:
+            add_times.extend(local_adds)
+            bill_times.extend(local_bills)
+
+    threads = [threading.Thread(target=waiter, args=(table,)) for table in range(1, tables + 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    ledger.close()
+    return {
+        "tables": tables,
+        "lines_per_bill": lines,
+        "bills": len(bill_times),
+        "wall_s": wall,
+        "bills_per_s": len(bill_times) / wall,
+        "add_line": latency_stats(add_times),
+        "generate_bill": latency_stats(bill_times),
+    }
+
+
+def _worker_process(worker, tables, lines, rounds, tables_path, ledger_path, start, results):
+    # One app server process: its own catalog, table store connection and ledger connection
+    catalog = load_catalog()
+    store = SqliteTableStore(catalog, tables_path)
+    ledger = SalesLedger(ledger_path)
+    menu = catalog.filter()
+    rng = random.Random(worker)
+    add_times, bill_times = [], []
+    added = bills = missed = 0
+    start.wait()
+    began = time.time()
+    for _ in range(rounds):
+        for table in tables:
+            for _ in range(lines):
+                started = time.perf_counter()
+                store.update(table, lambda tab: tab.bill.add(rng.choice(menu), rng.randint(1, 3)))
+                add_times.append(time.perf_counter() - started)
+                added += 1
+        for table in tables:
+            started = time.perf_counter()
+            bill, _, opened_at, _ = store.snapshot(table)
+            if not bill:
+                continue
+            key = bill.content_key(table, opened_at)
+            bill_data = tab_bill_data(table, bill, opened_at, key, rng.choice(PAYMENT_MODES))
+            if store.close(table, key, lambda: ledger.append(bill_data)) is None:
+                # Changed or billed by another process in the meantime
+                missed += 1
+            else:
+                bills += 1
+            bill_times.append(time.perf_counter() - started)
+    ended = time.time()
+    ledger.close()
+    results.put({"began": began, "ended": ended, "added": added, "bills": bills, "missed": missed,
+                 "conflicts": store.conflicts, "add_times": add_times, "bill_times": bill_times})
+
+
+WORKERS_NOTE = ("bill and tab writes are serialized by SQLite's single writer and the per-bill sync of sales.db;"
+                " more processes add capacity for page reruns, not for bills/s")
+
+
+def bench_workers(worker_counts, tables_per_worker, lines, rounds, catalog, shared=False):
+    context = multiprocessing.get_context("fork")
+    results = []
+    for workers in worker_counts:
+        run_dir = os.path.join(SCRATCH_DIR, f"workers_{workers}_{'shared' if shared else 'own'}")
+        os.makedirs(run_dir)
+        tables_path, ledger_path = os.path.join(run_dir, "tables.db"), os.path.join(run_dir, "sales.db")
+        # Create both schemas up front rather than have the workers race to
+        SqliteTableStore(catalog, tables_path)
+        SalesLedger(ledger_path).close()
+
+        start, queue = context.Event(), context.Queue()
+        processes = []
+        for worker in range(workers):
+            first = 1 if shared else worker * tables_per_worker + 1
+            tables = list(range(first, first + tables_per_worker))
+            processes.append(context.Process(
+                target=_worker_process,
+                args=(worker, tables, lines, rounds, tables_path, ledger_path, start, queue),
+            ))
+        for process in processes:
+            process.start()
+        start.set()
+        outcomes = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        wall = max(outcome["ended"] for outcome in outcomes) - min(outcome["began"] for outcome in outcomes)
+        added = sum(outcome["added"] for outcome in outcomes)
+        bills = sum(outcome["bills"] for outcome in outcomes)
+        ledger = SalesLedger(ledger_path)
+        with ledger._lock:
+            billed_lines = ledger._conn.execute("SELECT COUNT(*) FROM bill_lines").fetchone()[0]
+            recorded = ledger._conn.execute("SELECT COUNT(*) FROM bills").fetchone()[0]
+        ledger.close()
+        store = SqliteTableStore(catalog, tables_path)
+        open_lines = sum(len(tab.bill) for tab in store.open_tables())
+        results.append({
+            "workers": workers,
+            "shared_tables": shared,
+            "lines_added": added,
+            "bills": bills,
+            "bills_recorded": recorded,
+            "closes_missed": sum(outcome["missed"] for outcome in outcomes),
+            "conflicts_retried": sum(outcome["conflicts"] for outcome in outcomes),
+            "wall_s": wall,
+            "lines_per_s": added / wall,
+            "bills_per_s": bills / wall,
+            # Every line is on exactly one recorded bill or still on an open tab
+            "consistent": recorded == bills and billed_lines + open_lines == added,
+            "add_line": latency_stats([t for outcome in outcomes for t in outcome["add_times"]]),
+            "generate_bill": latency_stats([t for outcome in outcomes for t in outcome["bill_times"]]),
+        })
+    return results
+
+
+def bench_history(sizes, catalog, days=365):
+    menu = catalog.filter()
+    results = []
+    for size in sizes:
+        path = os.path.join(SCRATCH_DIR, f"history_{size}.db")
+        # Seeding uses large unsynced batches; the numbers below are about reading history
+        ledger = SalesLedger(path, batch_size=5000, max_delay=60, synchronous="OFF")
+        rng = random.Random(size)
+        today = date.today()
+        started = time.perf_counter()
+        for n in range(size):
+            day = today - timedelta(days=days - 1 - n * days // size)
+            ledger.append(random_bill_data(rng, menu, day, rng.randint(11, 22), rng.randint(1, 8)))
+        ledger.flush()
+        seed_time = time.perf_counter() - started
+
+        week = (today - timedelta(days=6), today)
+        year = (today - timedelta(days=days - 1), today)
+        analytics = ledger.analytics
+        queries = {}
+        for label, (start, end) in (("week", week), ("year", year)):
+            for name in ("daily_revenue", "payment_modes", "top_items", "veg_split", "hourly_heatmap"):
+                samples = [timed(getattr(analytics, name), start, end)[0] for _ in range(5)]
+                queries[f"{name}_{label}"] = latency_stats(samples)
+
+        export_time, exported = timed(lambda: sum(1 for _ in ledger.iter_bills(*week)))
+        ledger.close()
+        results.append({
+            "bills": size,
+            "seed_s": seed_time,
+            "seed_bills_per_s": size / seed_time,
+            "db_bytes": os.path.getsize(path),
+            "queries": queries,
+            "export_week": {"bills": exported, "seconds": export_time,
+                            "bills_per_s": exported / export_time if export_time else 0.0},
+        })
+        os.remove(path)
+    return results
+
+
+def bench_app(tables, items_per_table):
+    from streamlit.testing.v1 import AppTest
+
+    def button(app, label):
+        for candidate in list(app.sidebar.button) + list(app.button):
+            if label in candidate.label:
+                return candidate
+        raise LookupError(f"No button labelled {label!r}")
+
+    def generate_bill(app, timeout=60):
+        # The click only queues the bill on the task runner; rerun as the page's poller would
+        # until the table is closed and the bill number is shown
+        button(app, "Generate Bill").click().run()
+        deadline = time.perf_counter() + timeout
+        while not any("generated successfully" in message.value for message in app.success):
+            if app.exception:
+                raise RuntimeError(app.exception[0].message)
+            failed = [message.value for message in app.error if "could not be generated" in message.value]
+            if failed:
+                raise RuntimeError(failed[0])
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"No bill generated within {timeout}s")
+            time.sleep(0.005)
+            app.run()
+
+    sessions = []
+    started = time.perf_counter()
+    first_run = None
+    for table in range(1, tables + 1):
+        app = AppTest.from_file(APP_PATH, default_timeout=120)
+        elapsed, _ = timed(app.run)
+        if table == 1:
+            first_run = elapsed
+        app.sidebar.number_input(key="table_number").set_value(table).run()
+        sessions.append(app)
+
+    rerun_times = {"add_item": [], "generate_bill": [], "open_analytics": []}
+    state_start = [session_state_bytes(app.session_state) for app in sessions]
+    bills = 0
+    quick_items = ["Butter Chicken", "Butter Naan", "Masala Tea"]
+
+    # Round-robin across sessions, the way several waiters interleave on one server
+    for step in range(items_per_table):
+        for app in sessions:
+            elapsed, _ = timed(button(app, quick_items[step % len(quick_items)]).click().run)
+            rerun_times["add_item"].append(elapsed)
+    for app in sessions:
+        elapsed, _ = timed(generate_bill, app)
+        rerun_times["generate_bill"].append(elapsed)
+        bills += 1
+        elapsed, _ = timed(button(app, "View Analytics").click().run)
+        rerun_times["open_analytics"].append(elapsed)
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+    wall = time.perf_counter() - started
+    state_end = [session_state_bytes(app.session_state) for app in sessions]
+
+    return {
+        "tables": tables,
+        "items_per_table": items_per_table,
+        "first_run_ms": first_run * 1000,
+        "reruns": {name: latency_stats(samples) for name, samples in rerun_times.items()},
+        "bills_per_s": bills / wall,
+        "session_state_bytes": {
+            "start_mean": sum(state_start) / len(state_start),
+            "end_mean": sum(state_end) / len(state_end),
+            "growth_mean": (sum(state_end) - sum(state_start)) / len(state_end),
+        },
+    }
+
+
+def environment():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(APP_PATH)).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": revision,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default="billing,tables,workers,history,app",
+                        help="comma-separated subset of billing,tables,workers,history,app")
+    parser.add_argument("--lines", type=int_list, default=[10, 100, 1000, 10000],
+                        help="order lines per bill for the billing scenario")
+    parser.add_argument("--history", type=int_list, default=[1000, 10000],
+                        help="historical bill counts, up to 1000000")
+    parser.add_argument("--tables", type=int, default=8, help="concurrent tables / sessions")
+    parser.add_argument("--table-lines", type=int, default=10, help="lines per bill in the tables scenario")
+    parser.add_argument("--bills-per-table", type=int, default=20)
+    parser.add_argument("--workers", type=int_list, default=[1, 2, 4, 8],
+                        help="app process counts for the workers scenario")
+    parser.add_argument("--worker-tables", type=int, default=4, help="tables each worker process serves")
+    parser.add_argument("--app-items", type=int, default=5, help="items each AppTest session adds")
+    parser.add_argument("--out", help="JSON results file, defaults to data/benchmarks/bench_<timestamp>.json")
+    args = parser.parse_args(argv)
+
+    scenarios = set(args.scenarios.split(","))
+    catalog = load_catalog()
+    results = {"environment": environment(), "parameters": vars(args), "results": {}}
+    try:
+        if "billing" in scenarios:
+            print("billing ...", file=sys.stderr)
+            results["results"]["billing"] = bench_billing(args.lines, catalog)
+        if "tables" in scenarios:
+            print("tables ...", file=sys.stderr)
+            results["results"]["tables"] = bench_tables(args.tables, args.table_lines, args.bills_per_table, catalog)
+        if "workers" in scenarios:
+            print(f"workers ... ({WORKERS_NOTE})", file=sys.stderr)
+            results["results"]["workers"] = {
+                "note": WORKERS_NOTE,
+                "own_tables": bench_workers(args.workers, args.worker_tables, args.table_lines,
+                                            args.bills_per_table, catalog),
+                "shared_tables": bench_workers(args.workers, args.worker_tables, args.table_lines,
+                                               args.bills_per_table, catalog, shared=True),
+            }
+        if "history" in scenarios:
+            print("history ...", file=sys.stderr)
+            results["results"]["history"] = bench_history(args.history, catalog)
+        if "app" in scenarios:
+            print("app ...", file=sys.stderr)
+            results["results"]["app"] = bench_app(args.tables, args.app_items)
+    finally:
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+    results["max_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    out_path = args.out or os.path.join("data", "benchmarks", f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as out:
+        json.dump(results, out, indent=2, ensure_ascii=False, default=str)
+    print(f"Results written to {out_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
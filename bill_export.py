@@ -0,0 +1,257 @@
+"""Bill rendering and streaming batch export (TXT, CSV, PDF, ZIP)."""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import zipfile
+from datetime import date
+from string import Template
+
+from pricing import describe_discount, format_rupees, quote_lines, tax_label, to_paise
+
+# Templates are parsed once at import and reused for every bill
+BILL_HEADER = Template("""SMART RESTAURANT BILLING SYSTEM
+================================
+Bill No: $bill_no
+Date: $date $time
+Customer: $customer
+Table: $table
+Phone: $phone
+
+ORDER DETAILS:
+==============
+""")
+BILL_LINE = Template("$item x $quantity = ₹$total\n")
+BILL_FOOTER = Template("""
+BILL SUMMARY:
+=============
+Subtotal: ₹$subtotal
+Discount$discount_label: -₹$discount
+Tax ($tax_label): ₹$tax
+Total: ₹$total
+
+Payment Mode: $payment_mode
+
+Thank you for dining with us!
+""")
+
+CSV_COLUMNS = [
+    "bill_no", "date", "time", "table", "customer", "phone", "payment_mode",
+    "items", "subtotal", "discount", "tax", "total",
+]
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "pdf": "application/pdf",
+    "zip": "application/zip",
+}
+
+
+def bill_figures(bill_data):
+    """``pricing.Quote`` for a stored bill, recomputed from its lines and discounts."""
+    return quote_lines(bill_data["orders"], bill_data.get("discount", {}))
+
+
+def render_bill_text(bill_data):
+    """Plain-text bill for a ``bill_data`` dict as stored in the sales ledger."""
+    customer = bill_data.get("customer", {})
+    totals = bill_figures(bill_data)
+    label = describe_discount(bill_data.get("discount", {}))
+
+    parts = [BILL_HEADER.substitute(
+        bill_no=bill_data.get("id") or "-",
+        date=bill_data["date"],
+        time=bill_data["time"],
+        customer=customer.get("name") or "Walk-in",
+        table=customer.get("table") or "N/A",
+        phone=customer.get("phone") or "N/A",
+    )]
+    parts.extend(
+        BILL_LINE.substitute(
+            item=line["item"], quantity=line["quantity"],
+            total=format_rupees(to_paise(line["price"]) * line["quantity"]),
+        )
+        for line in bill_data["orders"]
+    )
+    parts.append(BILL_FOOTER.substitute(
+        subtotal=format_rupees(totals.subtotal),
+        discount_label=f" ({label})" if label else "",
+        discount=format_rupees(totals.discount),
+        tax_label=tax_label(totals),
+        tax=format_rupees(totals.tax),
+        total=format_rupees(totals.total),
+        payment_mode=bill_data.get("payment_mode") or "N/A",
+    ))
+    return "".join(parts)
+
+
+def csv_row(bill_data):
+    customer = bill_data.get("customer", {})
+    totals = bill_figures(bill_data)
+    return [
+        bill_data.get("id"), bill_data["date"], bill_data["time"], customer.get("table"),
+        customer.get("name"), customer.get("phone"), bill_data.get("payment_mode"),
+        sum(line["quantity"] for line in bill_data["orders"]),
+        format_rupees(totals.subtotal), format_rupees(totals.discount),
+        format_rupees(totals.tax), format_rupees(totals.total),
+    ]
+
+
+# Streaming writers; each holds at most one bill in memory
+
+
+def write_csv(bills, out):
+    """One summary row per bill into the text stream ``out``."""
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for bill_data in bills:
+        writer.writerow(csv_row(bill_data))
+        count += 1
+    return count
+
+
+def write_zip(bills, out):
+    """A TXT file per bill plus a ``bills.csv`` summary, into the binary stream ``out``."""
+    count = 0
+    # Summary rows are spooled to disk so they can be added after the bills in one pass
+    with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as summary, \
+            zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        writer = csv.writer(summary)
+        writer.writerow(CSV_COLUMNS)
+        for bill_data in bills:
+            name = f"bill_{bill_data.get('id') or count + 1}_{bill_data['date']}.txt"
+            archive.writestr(name, render_bill_text(bill_data))
+            writer.writerow(csv_row(bill_data))
+            count += 1
+        summary.seek(0)
+        with archive.open("bills.csv", "w") as entry:
+            for chunk in iter(lambda: summary.read(64 * 1024), ""):
+                entry.write(chunk.encode("utf-8"))
+    return count
+
+
+class PdfWriter:
+    """Minimal streaming PDF writer: monospaced text pages in the standard Courier font.
+
+    Page objects are written as soon as they are added; only their byte
+    offsets are kept until the cross-reference table is written on close.
+    """
+
+    LINES_PER_PAGE = 60
+
+    def __init__(self, out):
+        self._out = out
+        self._offsets = []
+        self._pages = []
+        self._position = 0
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        # Objects 1-3 are the catalog, page tree and font; the page tree is written last
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>")
+
+    def _write(self, data):
+        self._out.write(data)
+        self._position += len(data)
+
+    def _object(self, number, body):
+        while len(self._offsets) < number:
+            self._offsets.append(None)
+        self._offsets[number - 1] = self._position
+        self._write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+    def add_text(self, text):
+        lines = text.replace("₹", "Rs.").splitlines() or [""]
+        for start in range(0, len(lines), self.LINES_PER_PAGE):
+            self._add_page(lines[start:start + self.LINES_PER_PAGE])
+
+    def _add_page(self, lines):
+        commands = [b"BT /F1 10 Tf 12 TL 50 800 Td"]
+        for line in lines:
+            encoded = line.encode("cp1252", "replace")
+            escaped = encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+            commands.append(b"(" + escaped + b") Tj T*")
+        commands.append(b"ET")
+        stream = b"\n".join(commands)
+
+        content_number = max(len(self._offsets), 3) + 1
+        self._object(content_number, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        self._object(
+            content_number + 1,
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842]"
+            b" /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_number,
+        )
+        self._pages.append(content_number + 1)
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % page for page in self._pages)
+        self._object(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(self._pages))
+        xref_position = self._position
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self._offsets) + 1))
+        for offset in self._offsets:
+            self._write(b"%010d 00000 n \n" % offset)
+        self._write(
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(self._offsets) + 1, xref_position)
+        )
+
+
+def write_pdf(bills, out):
+    """One or more pages per bill into the binary stream ``out``."""
+    pdf = PdfWriter(out)
+    count = 0
+    for bill_data in bills:
+        pdf.add_text(render_bill_text(bill_data))
+        count += 1
+    if not count:
+        pdf.add_text("No bills in the selected range")
+    pdf.close()
+    return count
+
+
+def export_bills(bills, fmt, out):
+    """Stream ``bills`` to the binary file ``out`` as CSV, PDF or ZIP; returns the bill count."""
+    if fmt == "csv":
+        text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+        try:
+            return write_csv(bills, text)
+        finally:
+            text.detach()
+    if fmt == "pdf":
+        return write_pdf(bills, out)
+    if fmt == "zip":
+        return write_zip(bills, out)
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+def export_to_tempfile(bills, fmt):
+    """Export into an unnamed temporary file, rewound for reading (for download buttons)."""
+    out = tempfile.TemporaryFile()
+    export_bills(bills, fmt, out)
+    out.seek(0)
+    return out
+
+
+def main(argv=None):
+    from sales_ledger import DEFAULT_DB_PATH, SalesLedger
+
+    parser = argparse.ArgumentParser(description="Export bills from the sales ledger")
+    parser.add_argument("--from", dest="start", default=date.today().isoformat(), help="first day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", help="last day (YYYY-MM-DD), defaults to --from")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="sales ledger database")
+    parser.add_argument("--out", help="output file, defaults to bills_<from>_<to>.<format>")
+    args = parser.parse_args(argv)
+
+    end = args.end or args.start
+    out_path = args.out or f"bills_{args.start}_{end}.{args.format}"
+    ledger = SalesLedger(args.db)
+    with open(out_path, "wb") as out:
+        count = export_bills(ledger.iter_bills(args.start, end), args.format, out)
+    print(f"Exported {count} bills to {os.path.abspath(out_path)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Order model with incrementally maintained bill aggregates."""
+import hashlib
+import time
+
+import profiling
+from pricing import discount_rules, gst_rate, quote, to_paise, to_rupees
+
+# Payment options offered at checkout; day-end reports list every one of them
+PAYMENT_MODES = ["💵 Cash", "💳 Card", "📱 UPI", "💰 Digital Wallet"]
+
+# Columns shown in the Order Summary table, in display order
+DISPLAY_COLUMNS = {
+    "timestamp": "Time",
+    "category": "Category",
+    "item": "Item",
+    "quantity": "Qty",
+    "price": "Price (₹)",
+    "total": "Total (₹)",
+    "instructions": "Instructions",
+}
+
+
+class OrderLine:
+    """One order line: a catalog item id, quantity, unit price in paise and epoch seconds.
+
+    Names, categories and flags are not copied into the line; they are looked
+    up in the catalog when the line is shown or exported. ``version`` is the
+    menu version the price was taken from.
+    """
+
+    __slots__ = ("item_id", "quantity", "price", "ts", "instructions", "version")
+
+    def __init__(self, item_id, quantity, price, ts, instructions=None, version=None):
+        self.item_id = item_id
+        self.quantity = quantity
+        # Price at the time of ordering, so later menu changes don't reprice the tab
+        self.price = price
+        self.ts = ts
+        self.instructions = instructions
+        self.version = version
+
+    @property
+    def total(self):
+        return self.price * self.quantity
+
+    def __repr__(self):
+        return f"OrderLine(item_id={self.item_id}, quantity={self.quantity}, price={self.price}, ts={self.ts})"
+
+
+class Bill:
+    """Order lines of an open order plus running aggregates.
+
+    Every mutation adjusts subtotal, item count, price sum, per-category
+    quantities and per-GST-slab amounts in O(1), so a rerun can read the bill
+    figures without rebuilding a DataFrame from the lines. Money is in paise.
+    Lines are ``OrderLine``s resolved through ``catalog``; ``line_dicts``
+    expands them into the record shape the ledger, kitchen tickets and
+    exports take.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.lines = []
+        self.subtotal = 0
+        self.item_count = 0
+        self.category_quantities = {}
+        self.slab_subtotals = {}
+        self._price_sum = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def add(self, menu_item, quantity=1, instructions=""):
+        # Priced from the current menu, which may have been reloaded since ``menu_item`` was shown
+        item, version = self.catalog.resolve(menu_item.id)
+        line = OrderLine(item.id, quantity, to_paise(item.price), int(time.time()), instructions or None, version)
+        self.lines.append(line)
+        self._account(line, 1)
+        return line
+
+    def pop(self):
+        line = self.lines.pop()
+        self._account(line, -1)
+        return line
+
+    def clear(self):
+        self.lines = []
+        self.subtotal = 0
+        self.item_count = 0
+        self.category_quantities = {}
+        self.slab_subtotals = {}
+        self._price_sum = 0
+
+    def records(self):
+        """The lines as plain lists, with items named rather than numbered, for shared storage.
+
+        Catalog ids are local to a process (they depend on the order menus
+        were loaded in), so items are stored by name and category, along with
+        the item's details in case another process's menu no longer has it.
+        """
+        by_id = self.catalog.by_id
+        records = []
+        for line in self.lines:
+            item = by_id(line.item_id)
+            records.append([item.name, item.category, line.quantity, line.price, line.ts, line.instructions,
+                            line.version, [item.price, item.description, item.item_type, item.spicy]])
+        return records
+
+    @classmethod
+    def from_records(cls, catalog, records):
+        bill = cls(catalog)
+        for name, category, quantity, price, ts, instructions, version, fields in records:
+            line = OrderLine(catalog.id_for(name, category, fields), quantity, price, ts, instructions, version)
+            bill.lines.append(line)
+            bill._account(line, 1)
+        return bill
+
+    def copy(self):
+        # Lines are never mutated once added, so sharing them is safe
+        bill = Bill(self.catalog)
+        bill.lines = list(self.lines)
+        bill.subtotal = self.subtotal
+        bill.item_count = self.item_count
+        bill.category_quantities = dict(self.category_quantities)
+        bill.slab_subtotals = dict(self.slab_subtotals)
+        bill._price_sum = self._price_sum
+        return bill
+
+    def _account(self, line, sign):
+        self.subtotal += sign * line.total
+        self.item_count += sign * line.quantity
+        self._price_sum += sign * line.price
+
+        item = self.catalog.by_id(line.item_id)
+        quantity = self.category_quantities.get(item.category, 0) + sign * line.quantity
+        if quantity:
+            self.category_quantities[item.category] = quantity
+        else:
+            self.category_quantities.pop(item.category, None)
+
+        rate = gst_rate(item.name, item.category)
+        amount = self.slab_subtotals.get(rate, 0) + sign * line.total
+        if amount:
+            self.slab_subtotals[rate] = amount
+        else:
+            self.slab_subtotals.pop(rate, None)
+
+    @property
+    def average_price(self):
+        # Mean unit price across order lines, as the summary table showed it
+        return self._price_sum / len(self.lines) if self.lines else 0
+
+    def totals(self, discounts):
+        """``pricing.Quote`` for the bill with ``discounts`` applied."""
+        return quote(self.slab_subtotals, discount_rules(discounts))
+
+    def content_key(self, table, opened_at):
+        """Idempotency key for billing this order: a hash of the table, when it opened and every line.
+
+        Generating the same order twice yields the same key; any change to the
+        order, or a new order on the same table, yields a different one.
+        """
+        digest = hashlib.blake2b(f"{table}|{opened_at!r}".encode(), digest_size=16)
+        by_id = self.catalog.by_id
+        for line in self.lines:
+            # By name, so every app process sharing the tab computes the same key
+            item = by_id(line.item_id)
+            digest.update(f"|{item.name},{item.category},{line.quantity},{line.price},{line.ts},"
+                          f"{line.instructions}".encode())
+        return digest.hexdigest()
+
+    def line_dicts(self, start=0, stop=None):
+        """Lines ``start`` to ``stop`` as plain dicts with the item details filled in."""
+        by_id = self.catalog.by_id
+        records = []
+        for line in self.lines[start:stop]:
+            item = by_id(line.item_id)
+            records.append({
+                "timestamp": time.strftime("%H:%M:%S", time.localtime(line.ts)),
+                "category": item.category,
+                "item": item.name,
+                "price": to_rupees(line.price),
+                "quantity": line.quantity,
+                "total": to_rupees(line.total),
+                "instructions": line.instructions or "",
+                "item_type": item.item_type,
+                "spicy": item.spicy,
+                "menu_version": line.version,
+                "gst_bp": gst_rate(item.name, item.category),
+            })
+        return records
+
+    def to_dataframe(self, start=0, stop=None):
+        """Display table of lines ``start`` to ``stop``, numbered from 1 by position in the bill."""
+        # Only the explicit table view needs a DataFrame (and pandas)
+        import pandas as pd
+
+        profiling.count("dataframe")
+        df = pd.DataFrame(self.line_dicts(start, stop), columns=list(DISPLAY_COLUMNS))
+        df.index = range(start + 1, start + len(df) + 1)
+        return df.rename(columns=DISPLAY_COLUMNS)
@@ -0,0 +1,379 @@
+"""Versioned menu catalog with an item index, precomputed filter sets and name search.
+
+The menu lives in ``menu.json`` (or ``RESTAURANT_MENU_PATH``): categories
+mapping item names to price, description, veg/non-veg ``category`` and
+``spicy`` flag. The catalog can watch that file and apply edits while the
+server is running.
+"""
+import bisect
+import copy
+import difflib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MENU_PATH = os.environ.get(
+    "RESTAURANT_MENU_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu.json")
+)
+
+# Shown as one-tap buttons in the sidebar
+POPULAR_ITEMS = ["Butter Chicken", "Butter Naan", "Masala Tea"]
+
+MenuItem = namedtuple("MenuItem", ["id", "name", "category", "price", "description", "item_type", "spicy"])
+
+
+def load_menu(path=DEFAULT_MENU_PATH):
+    with open(path, encoding="utf-8") as menu_file:
+        return json.load(menu_file)
+
+
+class _MenuIndex:
+    """One immutable version of the menu's indexes.
+
+    ``patched`` builds the next version from this one by retiring and
+    placing only the items that changed, so a price edit touches a handful
+    of bits and index entries instead of rebuilding everything.
+    """
+
+    def __init__(self):
+        self.version = 0
+        # Indexed by item id; retired items stay so open orders can still resolve them
+        self.items = []
+        self.by_name = {}
+        self.ids = {}
+        self.categories = []
+        self.category_masks = {}
+        self.veg_mask = 0
+        self.spicy_mask = 0
+        self.all_mask = 0
+        self.filter_sets = {}
+        self.names_lower = {}
+        # Sorted (word, id) pairs over every word of every item name, for search-as-you-type
+        self.prefix_index = []
+        self.word_masks = {}
+
+    def mask(self, category=None, veg_only=False, spicy_only=False):
+        mask = self.category_masks.get(category, 0) if category else self.all_mask
+        if veg_only:
+            mask &= self.veg_mask
+        if spicy_only:
+            mask &= self.spicy_mask
+        return mask
+
+    def items_in(self, mask):
+        items = []
+        while mask:
+            low_bit = mask & -mask
+            items.append(self.items[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return tuple(items)
+
+    def patched(self, menu):
+        """The index for ``menu`` and the bits of the items that changed (0 if none did)."""
+        new = _MenuIndex()
+        new.version = self.version + 1
+        new.items = list(self.items)
+        new.by_name = dict(self.by_name)
+        new.ids = dict(self.ids)
+        new.category_masks = dict(self.category_masks)
+        new.veg_mask, new.spicy_mask, new.all_mask = self.veg_mask, self.spicy_mask, self.all_mask
+        new.names_lower = dict(self.names_lower)
+        new.prefix_index = list(self.prefix_index)
+        new.word_masks = dict(self.word_masks)
+
+        changed = 0
+        for category, items in menu.items():
+            for name, data in items.items():
+                old = self.by_name.get(name)
+                fields = (category, data["price"], data.get("description", ""), data["category"],
+                          bool(data.get("spicy")))
+                if old is not None and old[2:] == fields:
+                    continue
+                if old is not None:
+                    new._retire(old)
+                    changed |= 1 << old.id
+                # An item keeps its id unless it moves category, so open orders keep
+                # counting it under the category it was ordered from
+                item_id = new.ids.get((name, category))
+                if item_id is None:
+                    item_id = len(new.items)
+                    new.items.append(None)
+                    new.ids[(name, category)] = item_id
+                item = MenuItem(item_id, name, *fields)
+                new._place(item)
+                changed |= 1 << item_id
+        listed = {name for items in menu.values() for name in items}
+        for name, old in self.by_name.items():
+            if name not in listed:
+                new._retire(old)
+                changed |= 1 << old.id
+
+        if not changed:
+            return self, 0
+        new.categories = [category for category in menu if new.category_masks.get(category)]
+        for category in [None] + new.categories:
+            for veg_only in (False, True):
+                for spicy_only in (False, True):
+                    key = (category, veg_only, spicy_only)
+                    before = self.filter_sets.get(key)
+                    if before is not None and not (self.mask(*key) | new.mask(*key)) & changed:
+                        new.filter_sets[key] = before
+                    else:
+                        new.filter_sets[key] = new.items_in(new.mask(*key))
+        return new, changed
+
+    def with_retired(self, name, category, fields):
+        """This version plus a retired item that was only ever on a menu another process loaded."""
+        new = copy.copy(self)
+        item = MenuItem(len(self.items), name, category, *fields)
+        new.items = self.items + [item]
+        new.ids = {**self.ids, (name, category): item.id}
+        return new, item.id
+
+    def _place(self, item):
+        bit = 1 << item.id
+        self.items[item.id] = item
+        self.by_name[item.name] = item
+        self.names_lower[item.name.lower()] = item
+        self.category_masks[item.category] = self.category_masks.get(item.category, 0) | bit
+        self.all_mask |= bit
+        if item.item_type == "veg":
+            self.veg_mask |= bit
+        if item.spicy:
+            self.spicy_mask |= bit
+        for word in item.name.lower().split():
+            bisect.insort(self.prefix_index, (word, item.id))
+            self.word_masks[word] = self.word_masks.get(word, 0) | bit
+
+    def _retire(self, item):
+        bit = 1 << item.id
+        del self.by_name[item.name]
+        del self.names_lower[item.name.lower()]
+        self.category_masks[item.category] &= ~bit
+        self.all_mask &= ~bit
+        self.veg_mask &= ~bit
+        self.spicy_mask &= ~bit
+        for word in item.name.lower().split():
+            position = bisect.bisect_left(self.prefix_index, (word, item.id))
+            del self.prefix_index[position]
+            remaining = self.word_masks[word] & ~bit
+            if remaining:
+                self.word_masks[word] = remaining
+            else:
+                del self.word_masks[word]
+
+
+class MenuCatalog:
+    """Shared index over the menu, versioned so it can be edited while serving.
+
+    Each item gets an integer id and a bit in a set of bitmasks (one per
+    category, plus veg and spicy), so every category x veg x spicy filter
+    combination is a couple of ANDs. The combinations are resolved to item
+    tuples up front since the sidebar asks for them on every rerun.
+
+    ``apply`` patches a new version of the indexes from the old one and
+    swaps it in with a single assignment, so readers always see one whole
+    version. Item ids are never reused: a removed item keeps resolving
+    through ``by_id`` for orders that already have it.
+
+    ``hide`` takes items out of filters and search (e.g. when they run out
+    of stock) without a new menu version; the hidden bits are worked out
+    once per menu version and hidden set.
+    """
+
+    def __init__(self, menu, path=None):
+        self.path = path
+        self._index = _MenuIndex()
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._watcher = None
+        self._hidden_names = frozenset()
+        # (index, hidden names, hidden mask, filter sets without the hidden items)
+        self._hidden = None
+        self.apply(menu)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_MENU_PATH):
+        catalog = cls(load_menu(path), path)
+        catalog._stamp = catalog._file_stamp()
+        return catalog
+
+    # Updates
+
+    def apply(self, menu):
+        """Switch to ``menu``; returns how many items changed."""
+        with self._lock:
+            index, changed = self._index.patched(menu)
+            self._index = index
+        return bin(changed).count("1")
+
+    def hide(self, names):
+        """Leave ``names`` out of ``mask``, ``filter`` and ``search`` until the next ``hide``."""
+        self._hidden_names = frozenset(names)
+
+    def _hidden_state(self):
+        index, names = self._index, self._hidden_names
+        state = self._hidden
+        if state is None or state[0] is not index or state[1] is not names:
+            mask = 0
+            for name in names:
+                item = index.by_name.get(name)
+                if item is not None:
+                    mask |= 1 << item.id
+            # Readers racing here build the same state; whichever is stored last wins
+            state = self._hidden = (index, names, mask, {})
+        return state
+
+    def _file_stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """Apply the menu file if it changed since it was last read; returns how many items changed."""
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return 0
+        menu = load_menu(self.path)
+        self._stamp = stamp
+        changed = self.apply(menu)
+        if changed:
+            logger.info("Menu version %s loaded from %s (%s items changed)", self.version, self.path, changed)
+        return changed
+
+    def watch(self, interval=2.0):
+        """Poll the menu file from a daemon thread and hot-reload it when it changes."""
+        if self._watcher is not None or self.path is None:
+            return
+
+        def poll():
+            while True:
+                try:
+                    self.reload()
+                except (OSError, ValueError, KeyError):
+                    # A half-saved or invalid file keeps the current menu until it is fixed
+                    logger.exception("Could not reload the menu from %s", self.path)
+                time.sleep(interval)
+
+        self._watcher = threading.Thread(target=poll, name="menu-watcher", daemon=True)
+        self._watcher.start()
+
+    # Lookups
+
+    @property
+    def version(self):
+        return self._index.version
+
+    @property
+    def categories(self):
+        return self._index.categories
+
+    def __len__(self):
+        return len(self._index.by_name)
+
+    def __contains__(self, name):
+        return name in self._index.by_name
+
+    def __getitem__(self, name):
+        return self._index.by_name[name]
+
+    def get(self, name, default=None):
+        return self._index.by_name.get(name, default)
+
+    def by_id(self, item_id):
+        return self._index.items[item_id]
+
+    def id_for(self, name, category, fields=None):
+        """The id of the item ``name`` listed under ``category`` in this or any earlier menu version.
+
+        An item this process has never seen raises ``KeyError``, unless
+        ``fields`` gives its price, description, type and spicy flag as they
+        were when it was ordered: it is then registered as a retired item, so
+        an open order from before a menu edit still resolves.
+        """
+        item_id = self._index.ids.get((name, category))
+        if item_id is None and self.path is not None:
+            # Possibly added by a menu edit another process has already picked up
+            self.reload()
+            item_id = self._index.ids.get((name, category))
+        if item_id is None and fields is not None:
+            with self._lock:
+                item_id = self._index.ids.get((name, category))
+                if item_id is None:
+                    self._index, item_id = self._index.with_retired(name, category, fields)
+        if item_id is None:
+            raise KeyError(f"{name} ({category}) is not on the menu")
+        return item_id
+
+    def resolve(self, item_id):
+        """The current ``MenuItem`` for ``item_id`` and the menu version it comes from."""
+        index = self._index
+        return index.items[item_id], index.version
+
+    def is_hidden(self, name):
+        index, _, hidden, _ = self._hidden_state()
+        item = index.by_name.get(name)
+        return item is not None and bool(hidden >> item.id & 1)
+
+    def mask(self, category=None, veg_only=False, spicy_only=False):
+        index, _, hidden, _ = self._hidden_state()
+        return index.mask(category, veg_only, spicy_only) & ~hidden
+
+    def items_in(self, mask):
+        return self._index.items_in(mask)
+
+    def filter(self, category=None, veg_only=False, spicy_only=False):
+        index, _, hidden, visible_sets = self._hidden_state()
+        key = (category, bool(veg_only), bool(spicy_only))
+        items = index.filter_sets.get(key, ())
+        if not hidden:
+            return items
+        visible = visible_sets.get(key)
+        if visible is None:
+            visible = visible_sets[key] = tuple(item for item in items if not hidden >> item.id & 1)
+        return visible
+
+    def search(self, query, limit=10, mask=None):
+        """Items whose name has a word starting with ``query``, then close misspellings."""
+        query = query.strip().lower()
+        if not query:
+            return ()
+        index, _, hidden, _ = self._hidden_state()
+        if mask is None:
+            mask = index.all_mask
+        mask &= index.all_mask & ~hidden
+
+        found = 0
+        # Multi-word queries match the whole name prefix
+        if " " in query:
+            for name, item in index.names_lower.items():
+                if name.startswith(query):
+                    found |= 1 << item.id
+        else:
+            start = bisect.bisect_left(index.prefix_index, (query,))
+            for word, item_id in index.prefix_index[start:]:
+                if not word.startswith(query):
+                    break
+                found |= 1 << item_id
+        results = list(index.items_in(found & mask))
+
+        if len(results) < limit:
+            # Misspellings are matched against whole names and single words
+            close = 0
+            for name in difflib.get_close_matches(query, index.names_lower, n=limit, cutoff=0.7):
+                close |= 1 << index.names_lower[name].id
+            for word in difflib.get_close_matches(query, index.word_masks, n=limit, cutoff=0.7):
+                close |= index.word_masks[word]
+            results.extend(index.items_in(close & mask & ~found))
+        return tuple(results[:limit])
+
+
+def load_catalog(path=DEFAULT_MENU_PATH, watch=False):
+    catalog = MenuCatalog.from_file(path)
+    if watch:
+        catalog.watch()
+    return catalog
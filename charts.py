@@ -0,0 +1,91 @@
+"""Plotly figures memoized on the aggregates they are drawn from.
+
+Every builder takes plain tuples, so identical data hits the LRU cache and
+an unchanged chart is never rebuilt. Callers must treat returned figures as
+read-only since they are shared between reruns and sessions.
+"""
+from functools import lru_cache
+
+import profiling
+
+FIGURE_CACHE_SIZE = 64
+
+
+def _px():
+    # Plotly Express takes a few hundred ms to import; pay for it when the first chart is drawn.
+    # Builders only get here on a cache miss, so this also counts real figure builds.
+    import plotly.express as px
+    profiling.count("chart_build")
+    return px
+
+
+def frozen(df):
+    """Hashable ``(columns, rows)`` form of a small aggregate DataFrame."""
+    return tuple(df.columns), tuple(df.itertuples(index=False, name=None))
+
+
+def _columns(data):
+    columns, rows = data
+    return {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def order_composition(category_quantities):
+    px = _px()
+    names, values = zip(*category_quantities)
+    fig = px.pie(values=values, names=names,
+                 title='Order Composition',
+                 color_discrete_sequence=px.colors.qualitative.Set3)
+    fig.update_layout(height=300)
+    return fig
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def daily_revenue(data):
+    px = _px()
+    return px.bar(_columns(data), x='date', y='revenue',
+                  title='Daily Sales Revenue',
+                  labels={'revenue': 'Revenue (₹)', 'date': 'Date'})
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def top_items(data):
+    px = _px()
+    fig = px.bar(_columns(data), x='quantity', y='item', orientation='h',
+                 title='Top Items',
+                 labels={'quantity': 'Quantity Sold', 'item': 'Item'})
+    fig.update_layout(yaxis={'categoryorder': 'total ascending'})
+    return fig
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def payment_modes(data):
+    px = _px()
+    return px.pie(_columns(data), values='bills', names='payment_mode',
+                  title='Payment Mode Distribution')
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def veg_split(data):
+    px = _px()
+    return px.pie(_columns(data), values='revenue', names='item_type',
+                  title='Veg vs Non-Veg Revenue',
+                  color_discrete_sequence=px.colors.qualitative.Set2)
+
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def hourly_heatmap(weekdays, hours, values):
+    px = _px()
+    return px.imshow(values, x=list(hours), y=list(weekdays), aspect='auto',
+                     color_continuous_scale='Sunsetdark',
+                     title='Revenue by Weekday and Hour',
+                     labels={'x': 'Hour', 'y': 'Weekday', 'color': 'Revenue (₹)'})
+
+
+def heatmap_key(heatmap):
+    return tuple(heatmap.index), tuple(heatmap.columns), tuple(map(tuple, heatmap.to_numpy().tolist()))
+
+
+def cache_stats():
+    builders = [order_composition, daily_revenue, top_items, payment_modes, veg_split, hourly_heatmap]
+    return {builder.__name__: builder.cache_info() for builder in builders}
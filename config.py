@@ -0,0 +1,5 @@
+"""Runtime settings read from the environment."""
+import os
+
+# Sales ledger, KOT spool, metrics and other runtime files live here
+DATA_DIR = os.environ.get("RESTAURANT_DATA_DIR", "data")
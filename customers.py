@@ -0,0 +1,158 @@
+"""Customer profiles keyed by phone number, with loyalty points and tiers.
+
+Each bill with a phone number adds a visit, its total and the points it
+earns to that customer's profile. The tier, and with it the loyalty
+discount, follows from the lifetime points.
+"""
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from analytics_store import ExternalChanges
+
+CUSTOMER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    phone TEXT PRIMARY KEY,
+    name TEXT,
+    visits INTEGER NOT NULL,
+    spend REAL NOT NULL,
+    points INTEGER NOT NULL,
+    first_visit TEXT NOT NULL,
+    last_visit TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# One point per this many rupees of a bill's final total
+RUPEES_PER_POINT = 10
+
+# (name, lifetime points needed, loyalty discount percent), best first.
+# A customer's first bill creates the profile; the discount applies from the next visit.
+LOYALTY_TIERS = [
+    ("🥇 Gold", 2000, 10),
+    ("🥈 Silver", 500, 7.5),
+    ("🥉 Bronze", 0, 5),
+]
+
+Customer = namedtuple("Customer", ["phone", "name", "visits", "spend", "points", "first_visit", "last_visit"])
+Tier = namedtuple("Tier", ["name", "min_points", "discount"])
+
+
+def normalize_phone(phone):
+    """The last 10 digits of ``phone``, or ``None`` if it has fewer."""
+    digits = re.sub(r"\D", "", phone or "")
+    return digits[-10:] if len(digits) >= 10 else None
+
+
+def tier_for(points):
+    for name, min_points, discount in LOYALTY_TIERS:
+        if points >= min_points:
+            return Tier(name, min_points, discount)
+    return None
+
+
+def points_for(total_amount):
+    return int(total_amount // RUPEES_PER_POINT)
+
+
+class CustomerStore:
+    """Customer profiles in the sales ledger database behind an LRU cache.
+
+    Built with ``SalesLedger.attach`` so a bill and the profile update it
+    causes commit together; the cached profile is only replaced once they
+    have. Visits, spend and points are running totals
+    bumped by each bill rather than recomputed from past bills, and a lookup
+    is a dict hit for the ``cache_size`` most recently used numbers. Numbers
+    billed by another app process sharing the database are dropped from the
+    cache before the next lookup; numbers without a profile aren't cached.
+    """
+
+    def __init__(self, conn, lock, after_commit, cache_size=10000):
+        self._conn = conn
+        self._lock = lock
+        self._after_commit = after_commit
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        self._conn.executescript(CUSTOMER_SCHEMA)
+        self._changes = ExternalChanges(conn, lock)
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM customers LIMIT 1").fetchone() is None:
+                self._backfill()
+
+    def _backfill(self):
+        # Ledgers created before the customer table existed; profiles are built once from past bills
+        bills = self._conn.execute(
+            "SELECT phone, customer_name AS name, date, total_amount FROM bills WHERE phone IS NOT NULL ORDER BY id"
+        ).fetchall()
+        if not bills:
+            return
+        self._conn.execute("SAVEPOINT customers")
+        for bill in bills:
+            self._upsert(normalize_phone(bill["phone"]), bill["name"], bill["date"], bill["total_amount"])
+        self._conn.execute("RELEASE customers")
+
+    def _upsert(self, phone, name, day, total_amount):
+        if phone is None:
+            return None
+        row = self._conn.execute(
+            "INSERT INTO customers VALUES (?, ?, 1, ?, ?, ?, ?) ON CONFLICT (phone) DO UPDATE SET"
+            " name = COALESCE(excluded.name, name), visits = visits + 1, spend = spend + excluded.spend,"
+            " points = points + excluded.points, last_visit = excluded.last_visit"
+            " RETURNING phone, name, visits, spend, points, first_visit, last_visit",
+            (phone, name or None, total_amount, points_for(total_amount), day, day),
+        ).fetchone()
+        return Customer(*row)
+
+    # Updates
+
+    def record(self, bill_data):
+        """Add a bill to its customer's profile; called by the ledger inside its write transaction."""
+        customer = bill_data.get("customer", {})
+        profile = self._upsert(normalize_phone(customer.get("phone")), customer.get("name"),
+                               bill_data["date"], bill_data["total_amount"])
+        if profile is not None:
+            self._after_commit(lambda: self._remember(profile.phone, profile))
+
+    # Lookups
+
+    def _remember(self, phone, profile):
+        with self._cache_lock:
+            self._cache[phone] = profile
+            self._cache.move_to_end(phone)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget_external(self):
+        bills = self._changes.poll()
+        if bills:
+            with self._cache_lock:
+                for bill in bills:
+                    self._cache.pop(normalize_phone(bill[2]), None)
+
+    def lookup(self, phone):
+        """The ``Customer`` for ``phone`` (in any format), or ``None``."""
+        phone = normalize_phone(phone)
+        if phone is None:
+            return None
+        self._forget_external()
+        with self._cache_lock:
+            profile = self._cache.get(phone)
+            if profile is not None:
+                self._cache.move_to_end(phone)
+                return profile
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT phone, name, visits, spend, points, first_visit, last_visit FROM customers WHERE phone = ?",
+                (phone,),
+            ).fetchone()
+            if row is None:
+                return None
+            profile = Customer(*row)
+            # Cached under the ledger lock so a bill recorded meanwhile can't be overwritten by this read
+            self._remember(phone, profile)
+        return profile
+
+    def tier(self, phone):
+        """The loyalty ``Tier`` for ``phone``, or ``None`` for a number without a profile."""
+        profile = self.lookup(phone)
+        return tier_for(profile.points) if profile is not None else None
@@ -0,0 +1,200 @@
+"""Next-service demand forecasts and prep lists from the item-by-hour sales rollup.
+
+A service is forecast from the same weekday over the last few weeks it
+traded: each of those days is an ``(items, 24)`` matrix of quantities by
+hour, and the forecast is their exponentially weighted mean, so the most
+recent week counts most. Prep quantities add a safety margin of the
+weighted standard deviation of each item's daily total.
+"""
+import math
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+from kitchen import station_for
+
+Forecast = namedtuple("Forecast", ["target", "basis", "items", "categories", "hourly", "expected", "spread"])
+
+PREP_COLUMNS = ["station", "item", "expected", "prep", "peak_hour"]
+
+
+class DemandForecaster:
+    """Per-day cached demand forecasts, kept current as bills are recorded.
+
+    Only the handful of days a forecast is based on are read from the
+    rollup, whatever the length of the history. Those day matrices stay in
+    memory and ``record`` adds each new bill to them, so a bill that lands
+    inside a cached forecast's window updates it by re-weighting the cached
+    matrices rather than reading the history again. Today's matrix is always
+    kept, for the sold-so-far column. Days that other app processes sharing
+    the ledger have sold on are reread, and the forecasts over them dropped,
+    before the next forecast.
+    """
+
+    def __init__(self, analytics, catalog=None, weeks=4, decay=0.7, safety=1.0, max_days=64):
+        self.analytics = analytics
+        self.catalog = catalog
+        self.weeks = weeks
+        self.decay = decay
+        self.safety = safety
+        self._max_days = max_days
+        self._lock = threading.RLock()
+        # Item names index the rows of every day matrix; new items are appended
+        self._items = []
+        self._item_rows = {}
+        self._categories = []
+        self._days = OrderedDict()
+        # Id of the newest bill each loaded day matrix already includes
+        self._loaded_upto = {}
+        self._forecasts = {}
+        self._changes = analytics.external_changes()
+
+    def _row(self, item, category):
+        row = self._item_rows.get(item)
+        if row is None:
+            row = self._item_rows[item] = len(self._items)
+            self._items.append(item)
+            self._categories.append(category)
+        return row
+
+    def _day(self, day):
+        """The ``(items, 24)`` quantity matrix for ``day``, padded to the current item count."""
+        import numpy as np
+
+        matrix = self._days.get(day)
+        if matrix is None:
+            rows, self._loaded_upto[day] = self.analytics.item_hours(day)
+            positions = [self._row(item, category) for _, item, category, _ in rows]
+            matrix = np.zeros((len(self._items), 24), dtype=np.int64)
+            if rows:
+                np.add.at(matrix, (positions, [row[0] for row in rows]), [row[3] for row in rows])
+            self._days[day] = matrix
+        elif len(matrix) < len(self._items):
+            matrix = self._days[day] = np.pad(matrix, ((0, len(self._items) - len(matrix)), (0, 0)))
+        self._days.move_to_end(day)
+        return matrix
+
+    def _trim(self):
+        needed = {str(date.today())}
+        for forecast in self._forecasts.values():
+            needed.update(forecast.basis)
+        for day in list(self._days):
+            if len(self._days) <= self._max_days:
+                break
+            if day not in needed:
+                del self._days[day]
+                del self._loaded_upto[day]
+
+    def _sync(self):
+        # Bills recorded by other processes never reach ``record``
+        bills = self._changes.poll()
+        for day in {bill[1] for bill in bills or ()}:
+            if self._days.pop(day, None) is not None:
+                del self._loaded_upto[day]
+            self._forget_forecasts(day)
+
+    def _forget_forecasts(self, day):
+        weekday = date.fromisoformat(day).weekday()
+        for target in [target for target in self._forecasts if target.weekday() == weekday and day < str(target)]:
+            del self._forecasts[target]
+
+    # Updates
+
+    def record(self, bill_data):
+        """Add a newly recorded bill; subscribe this to ``SalesLedger``."""
+        day = bill_data["date"]
+        weekday = date.fromisoformat(day).weekday()
+        with self._lock:
+            if day in self._days and bill_data["id"] <= self._loaded_upto[day]:
+                # The day was (re)read from the rollup after this bill was recorded
+                return
+            lines = [(self._row(line["item"], line["category"]),
+                      int((line.get("timestamp") or bill_data["time"])[:2]), line["quantity"])
+                     for line in bill_data["orders"]]
+            # A day not loaded yet will be read from the rollup, which already has this bill
+            if day in self._days:
+                matrix = self._day(day)
+                for row, hour, quantity in lines:
+                    matrix[row, hour] += quantity
+            for target, forecast in list(self._forecasts.items()):
+                if target.weekday() != weekday or day >= str(target):
+                    continue
+                if day in forecast.basis:
+                    self._forecasts[target] = self._reduce(target, forecast.basis)
+                elif len(forecast.basis) < self.weeks or day > forecast.basis[-1]:
+                    # A first bill on a newer day than the oldest in the window moves the window
+                    del self._forecasts[target]
+
+    # Forecasts
+
+    def _reduce(self, target, basis):
+        import numpy as np
+
+        # Loading a day can add items, so every matrix is padded once all are loaded
+        for day in basis:
+            self._day(day)
+        days = np.stack([self._day(day) for day in basis]) if basis else np.zeros((1, len(self._items), 24))
+        weights = self.decay ** np.arange(len(days), dtype=float)
+        weights /= weights.sum()
+        hourly = np.tensordot(weights, days, axes=1)
+        totals = days.sum(axis=2)
+        expected = weights @ totals
+        spread = np.sqrt(weights @ (totals - expected) ** 2)
+        return Forecast(target, tuple(basis), tuple(self._items), tuple(self._categories), hourly, expected, spread)
+
+    def forecast(self, target=None):
+        """The ``Forecast`` for ``target`` (default today), computed once per day and then kept current."""
+        target = target or date.today()
+        with self._lock:
+            self._sync()
+            forecast = self._forecasts.get(target)
+            if forecast is None or len(forecast.items) < len(self._items):
+                basis = self.analytics.trading_days(target.weekday(), target, self.weeks)
+                forecast = self._forecasts[target] = self._reduce(target, basis)
+                # Forecasts for past days are never asked for again
+                for old in [day for day in self._forecasts if day < date.today()]:
+                    del self._forecasts[old]
+                self._trim()
+            return forecast
+
+    def sold(self, day=None):
+        """``{item: quantity}`` sold on ``day`` (default today)."""
+        with self._lock:
+            self._sync()
+            totals = self._day(str(day or date.today())).sum(axis=1)
+            return {item: int(quantity) for item, quantity in zip(self._items, totals) if quantity}
+
+    def prep_list(self, target=None, from_hour=0):
+        """Rows of ``PREP_COLUMNS`` for the items expected from ``from_hour`` on, by station then quantity.
+
+        ``prep`` rounds the expected quantity plus the safety margin up to
+        whole portions; the margin shrinks with the share of the day left.
+        """
+        forecast = self.forecast(target)
+        rows = []
+        for row, item in enumerate(forecast.items):
+            hourly = forecast.hourly[row]
+            expected = float(hourly[from_hour:].sum())
+            if expected < 0.05:
+                continue
+            share = expected / forecast.expected[row] if forecast.expected[row] else 0.0
+            menu_item = self.catalog.get(item) if self.catalog is not None else None
+            if self.catalog is not None and menu_item is None:
+                # Taken off the menu since
+                continue
+            category = menu_item.category if menu_item is not None else forecast.categories[row]
+            rows.append({
+                "station": station_for(category),
+                "item": item,
+                "expected": round(expected, 1),
+                "prep": math.ceil(expected + self.safety * forecast.spread[row] * share - 1e-9),
+                "peak_hour": from_hour + int(hourly[from_hour:].argmax()),
+            })
+        rows.sort(key=lambda prep_row: (prep_row["station"], -prep_row["expected"], prep_row["item"]))
+        return rows
+
+    def station_totals(self, rows):
+        totals = {}
+        for prep_row in rows:
+            totals[prep_row["station"]] = totals.get(prep_row["station"], 0) + prep_row["prep"]
+        return totals
@@ -0,0 +1,276 @@
+"""Ingredient stock, depleted through each menu item's recipe as bills are recorded.
+
+Recipes live in ``recipes.json`` (or ``RESTAURANT_RECIPES_PATH``): the
+ingredients with their unit, opening stock and reorder level, and for each
+menu item the ingredient quantities one portion uses. Current levels are
+kept in the sales ledger database next to a log of every stock movement.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+from analytics_store import ExternalChanges
+
+DEFAULT_RECIPES_PATH = os.environ.get(
+    "RESTAURANT_RECIPES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "recipes.json")
+)
+
+INVENTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stock_levels (
+    ingredient TEXT PRIMARY KEY,
+    quantity REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stock_moves (
+    id INTEGER PRIMARY KEY,
+    at TEXT NOT NULL,
+    ingredient TEXT NOT NULL,
+    change REAL NOT NULL,
+    reason TEXT NOT NULL,
+    bill_key TEXT
+);
+"""
+
+STOCK_COLUMNS = ["ingredient", "quantity", "unit", "reorder_level"]
+
+
+def load_recipes(path=DEFAULT_RECIPES_PATH):
+    with open(path, encoding="utf-8") as recipes_file:
+        return json.load(recipes_file)
+
+
+class RecipeMatrix:
+    """Menu items x ingredients bill of materials as a CSR sparse matrix.
+
+    Row ``r`` holds item ``items[r]``'s ingredient columns in
+    ``indices[indptr[r]:indptr[r + 1]]`` and the quantity per portion in the
+    same slice of ``data``. ``explode`` turns a vector of portions per item
+    into ingredient usage with one repeat-multiply-bincount, so a day's
+    sales cost the same as a single bill.
+    """
+
+    def __init__(self, recipes, ingredients):
+        import numpy as np
+
+        self.items = list(recipes)
+        self.rows = {name: row for row, name in enumerate(self.items)}
+        self.ingredients = list(ingredients)
+        self.columns = {name: column for column, name in enumerate(self.ingredients)}
+        indptr, indices, data = [0], [], []
+        for name in self.items:
+            for ingredient, quantity in recipes[name].items():
+                indices.append(self.columns[ingredient])
+                data.append(quantity)
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.data = np.array(data, dtype=float)
+        # Transposed index: the rows that use each ingredient
+        order = np.argsort(self.indices, kind="stable")
+        row_of_entry = np.repeat(np.arange(len(self.items)), np.diff(self.indptr))
+        counts = np.bincount(self.indices, minlength=len(self.ingredients))
+        self.users = np.split(row_of_entry[order], np.cumsum(counts)[:-1])
+
+    def portions_vector(self, quantities_by_item):
+        """Portions per row for an ``{item: quantity}`` mapping; items without a recipe are ignored."""
+        import numpy as np
+
+        portions = np.zeros(len(self.items))
+        for name, quantity in quantities_by_item.items():
+            row = self.rows.get(name)
+            if row is not None:
+                portions[row] += quantity
+        return portions
+
+    def explode(self, portions):
+        """Ingredient usage for a vector of portions per row."""
+        import numpy as np
+
+        per_entry = self.data * np.repeat(portions, np.diff(self.indptr))
+        return np.bincount(self.indices, weights=per_entry, minlength=len(self.ingredients))
+
+    def servings(self, levels, rows):
+        """``{row: whole portions the levels allow}`` for ``rows``; items with no ingredients are left out."""
+        servings = {}
+        for row in rows:
+            start, end = self.indptr[row], self.indptr[row + 1]
+            if start < end:
+                servings[int(row)] = int((levels[self.indices[start:end]] / self.data[start:end]).min())
+        return servings
+
+
+class InventoryStore:
+    """Stock levels, depleted inside the ledger's transaction for each bill.
+
+    Built on the sales ledger's connection with ``SalesLedger.attach``, so a
+    bill and the stock it uses are recorded or rolled back together. The
+    levels are also held as a vector in memory, changed (and listeners
+    told) only once the stock movement commits; after each bill only the
+    ingredients it used are checked against their reorder level and only
+    the items using those ingredients are checked for running out, so
+    neither check ever rereads history. Reads first reload the levels if
+    another app process sharing the database has committed since.
+    """
+
+    def __init__(self, conn, lock, after_commit, book):
+        import numpy as np
+
+        self._conn = conn
+        self._lock = lock
+        self._after_commit = after_commit
+        ingredients = book["ingredients"]
+        self.units = {name: spec.get("unit", "") for name, spec in ingredients.items()}
+        self.matrix = RecipeMatrix(book["recipes"], ingredients)
+        self.reorder_levels = np.array(
+            [ingredients[name].get("reorder_level", 0) for name in self.matrix.ingredients], dtype=float
+        )
+        self._listeners = []
+        self._notify_lock = threading.Lock()
+        self._unavailable = frozenset()
+        self._conn.executescript(INVENTORY_SCHEMA)
+        with self._lock:
+            # Ingredients new to the recipe file start at their opening stock
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO stock_levels VALUES (?, ?)",
+                [(name, spec.get("opening_stock", 0)) for name, spec in ingredients.items()],
+            )
+            self._changes = ExternalChanges(conn, lock)
+            self._load()
+
+    def _load(self):
+        import numpy as np
+
+        stored = dict(self._conn.execute("SELECT ingredient, quantity FROM stock_levels").fetchall())
+        self.levels = np.array([stored[name] for name in self.matrix.ingredients], dtype=float)
+        self._low = {int(column) for column in np.flatnonzero(self.levels <= self.reorder_levels)}
+        servings = self.matrix.servings(self.levels, range(len(self.matrix.items)))
+        self._set_unavailable({self.matrix.items[row] for row, count in servings.items() if count < 1})
+
+    def _sync(self):
+        """Reload the levels if another process has committed to the database since the last read."""
+        with self._lock:
+            # Skipped while this process has stock movements waiting to commit; they'd be counted twice
+            if not self._conn.in_transaction and self._changes.poll() is not None:
+                self._load()
+
+    # Updates
+
+    def record(self, bill_data):
+        """Deplete the ingredients for a bill; called by the ledger inside its write transaction."""
+        quantities = {}
+        for line in bill_data["orders"]:
+            quantities[line["item"]] = quantities.get(line["item"], 0) + line["quantity"]
+        usage = self.matrix.explode(self.matrix.portions_vector(quantities))
+        columns = self._move(-usage, "sale", bill_data.get("bill_key"))
+        self._after_commit(lambda: self._apply(-usage, columns))
+
+    def receive(self, ingredient, quantity, reason="restock"):
+        """Add stock (or remove it, with a negative ``quantity``) outside of a bill."""
+        import numpy as np
+
+        change = np.zeros(len(self.matrix.ingredients))
+        change[self.matrix.columns[ingredient]] = quantity
+        with self._lock:
+            # A savepoint works both on its own and inside a batch of bills the ledger has open
+            self._conn.execute("SAVEPOINT stock")
+            try:
+                columns = self._move(change, reason)
+            except Exception:
+                self._conn.execute("ROLLBACK TO stock")
+                raise
+            finally:
+                self._conn.execute("RELEASE stock")
+            self._after_commit(lambda: self._apply(change, columns))
+
+    def _move(self, change, reason, bill_key=None):
+        """Write a stock movement; returns the ingredient columns it touched."""
+        import numpy as np
+
+        columns = np.flatnonzero(change)
+        if not len(columns):
+            return columns
+        names = [self.matrix.ingredients[column] for column in columns]
+        at = datetime.now().isoformat(timespec="seconds")
+        self._conn.executemany(
+            "UPDATE stock_levels SET quantity = quantity + ? WHERE ingredient = ?",
+            [(float(change[column]), name) for column, name in zip(columns, names)],
+        )
+        self._conn.executemany(
+            "INSERT INTO stock_moves (at, ingredient, change, reason, bill_key) VALUES (?, ?, ?, ?, ?)",
+            [(at, name, float(change[column]), reason, bill_key) for column, name in zip(columns, names)],
+        )
+        return columns
+
+    def _apply(self, change, columns):
+        if len(columns):
+            self.levels[columns] += change[columns]
+            self._refresh(columns)
+
+    def _refresh(self, columns):
+        levels = self.levels
+        for column in columns:
+            if levels[column] <= self.reorder_levels[column]:
+                self._low.add(int(column))
+            else:
+                self._low.discard(int(column))
+        rows = set()
+        for column in columns:
+            rows.update(self.matrix.users[column].tolist())
+        servings = self.matrix.servings(levels, rows)
+        out = {self.matrix.items[row] for row, count in servings.items() if count < 1}
+        back = {self.matrix.items[row] for row, count in servings.items() if count >= 1}
+        self._set_unavailable((self._unavailable - back) | out)
+
+    def _set_unavailable(self, unavailable):
+        if unavailable == self._unavailable:
+            return
+        self._unavailable = frozenset(unavailable)
+        with self._notify_lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(self._unavailable)
+
+    # Reads
+
+    @property
+    def unavailable(self):
+        """Names of the menu items there isn't enough stock for one more portion of."""
+        self._sync()
+        return self._unavailable
+
+    def subscribe(self, listener):
+        """Call ``listener(unavailable_names)`` whenever the set of unavailable items changes."""
+        with self._notify_lock:
+            self._listeners.append(listener)
+
+    def _rows(self, columns):
+        return [
+            {"ingredient": self.matrix.ingredients[column], "quantity": round(float(self.levels[column]), 1),
+             "unit": self.units[self.matrix.ingredients[column]],
+             "reorder_level": float(self.reorder_levels[column])}
+            for column in columns
+        ]
+
+    def low_stock(self):
+        """``STOCK_COLUMNS`` rows for the ingredients at or below their reorder level, lowest cover first."""
+        self._sync()
+        columns = sorted(self._low, key=lambda column: self.levels[column] / (self.reorder_levels[column] or 1))
+        return self._rows(columns)
+
+    def level(self, ingredient):
+        self._sync()
+        return round(float(self.levels[self.matrix.columns[ingredient]]), 1)
+
+    def stock(self):
+        self._sync()
+        return self._rows(range(len(self.matrix.ingredients)))
+
+    def consumption(self, start, end):
+        """``{ingredient: quantity}`` used by the items sold from ``start`` to ``end`` (inclusive)."""
+        with self._lock:
+            sold = dict(self._conn.execute(
+                "SELECT item, SUM(quantity) FROM item_sales WHERE date BETWEEN ? AND ? GROUP BY item",
+                (str(start), str(end)),
+            ).fetchall())
+        usage = self.matrix.explode(self.matrix.portions_vector(sold))
+        return {name: float(used) for name, used in zip(self.matrix.ingredients, usage) if used}
@@ -0,0 +1,213 @@
+"""Kitchen order tickets (KOTs) and their asynchronous dispatch to station printers."""
+import itertools
+import logging
+import os
+import queue
+import re
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from config import DATA_DIR
+from tasks import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Menu categories prepared somewhere other than the main kitchen
+STATION_ROUTES = {
+    "🫓 Breads": "tandoor",
+    "🥤 Beverages": "bar",
+}
+DEFAULT_STATION = "kitchen"
+STATIONS = [DEFAULT_STATION, "tandoor", "bar"]
+
+DEFAULT_SPOOL_DIR = os.path.join(DATA_DIR, "kot_spool")
+
+
+def station_for(category):
+    return STATION_ROUTES.get(category, DEFAULT_STATION)
+
+
+class Ticket:
+    """One KOT: the new lines of a table's order for a single station."""
+
+    __slots__ = ("number", "table", "station", "lines", "created_at")
+
+    def __init__(self, number, table, station, lines):
+        self.number = number
+        self.table = table
+        self.station = station
+        self.lines = lines
+        self.created_at = time.monotonic()
+
+    def render(self):
+        rows = [
+            f"KOT #{self.number}  [{self.station.upper()}]",
+            f"Table {self.table}  {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            "-" * 32,
+        ]
+        for line in self.lines:
+            rows.append(f"{line['quantity']:>3} x {line['item']}")
+            if line.get("instructions"):
+                rows.append(f"      * {line['instructions']}")
+        rows.append("-" * 32)
+        return "\n".join(rows) + "\n"
+
+
+# Printers
+
+
+_SPOOL_NAME = re.compile(r"kot_(\d+)(?:-\d+)?\.txt$")
+
+
+class SpoolPrinter:
+    """Writes each ticket as a text file under ``directory/<station>/``.
+
+    Files are never overwritten: a ticket whose number is already spooled
+    (by another process, or by a run before a restart) is written as
+    ``kot_<number>-2.txt`` and so on.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def last_number(self):
+        """The highest ticket number in the spool, or 0 for an empty one."""
+        highest = 0
+        for station in STATIONS:
+            try:
+                names = os.listdir(os.path.join(self.directory, station))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                match = _SPOOL_NAME.match(name)
+                if match:
+                    highest = max(highest, int(match.group(1)))
+        return highest
+
+    def send(self, ticket):
+        station_dir = os.path.join(self.directory, ticket.station)
+        os.makedirs(station_dir, exist_ok=True)
+        base = os.path.join(station_dir, f"kot_{ticket.number:06d}")
+        # Written to a private temp file and then linked into place, so spool readers
+        # never see a partial ticket and a name that is already taken fails instead of being replaced
+        temp = f"{base}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "w", encoding="utf-8") as spool_file:
+            spool_file.write(ticket.render())
+        try:
+            for copy in itertools.count(1):
+                path = f"{base}.txt" if copy == 1 else f"{base}-{copy}.txt"
+                try:
+                    os.link(temp, path)
+                except FileExistsError:
+                    continue
+                return path
+        finally:
+            os.remove(temp)
+
+
+class TcpPrinter:
+    """Sends the rendered ticket as raw text to a network printer (port 9100 style)."""
+
+    def __init__(self, host, port, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def send(self, ticket):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as connection:
+            connection.sendall(ticket.render().encode("utf-8"))
+
+
+def printer_from_url(url):
+    """``tcp://host:port`` for a network printer, anything else is a spool directory."""
+    if url.startswith("tcp://"):
+        host, _, port = url[len("tcp://"):].rpartition(":")
+        return TcpPrinter(host, int(port))
+    return SpoolPrinter(url)
+
+
+def printers_from_env():
+    # RESTAURANT_KOT_PRINTER sets the default; RESTAURANT_KOT_PRINTER_<STATION> overrides per station
+    default = os.environ.get("RESTAURANT_KOT_PRINTER", DEFAULT_SPOOL_DIR)
+    return {
+        station: printer_from_url(os.environ.get(f"RESTAURANT_KOT_PRINTER_{station.upper()}", default))
+        for station in STATIONS
+    }
+
+
+class KitchenDispatcher(WorkerPool):
+    """Bounded KOT queue drained by a pool of printer worker threads.
+
+    ``submit`` only groups lines into tickets and enqueues them, so the
+    calling script thread never waits on printer I/O. Workers retry a send
+    that fails with an ``OSError`` with exponential backoff before counting
+    it as failed.
+
+    Ticket numbers carry on from the highest one already in the spool
+    printers' directories, so a restart doesn't start again from #1. They
+    come from ``numbers(count, floor)``, which returns the first of
+    ``count`` new numbers above ``floor``; pass e.g.
+    ``partial(tables.reserve_numbers, "kot")`` to share one sequence
+    between app processes. By default the dispatcher counts on its own.
+    """
+
+    def __init__(self, printers, workers=2, max_queue=200, retries=3, backoff=0.5, numbers=None):
+        self.printers = printers
+        self._submit_lock = threading.Lock()
+        spooled = [printer.last_number() for printer in printers.values() if isinstance(printer, SpoolPrinter)]
+        self._floor = self._last_number = max(spooled, default=0)
+        self._numbers = numbers or self._next_numbers
+        self._latencies = deque(maxlen=500)
+        super().__init__("kot-printer", workers, max_queue, retries, backoff, ["queued", "sent", "retried", "failed"])
+
+    def submit(self, table, lines):
+        """Queue one ticket per station for ``lines``; raises ``queue.Full`` when they don't all fit."""
+        by_station = {}
+        for line in lines:
+            by_station.setdefault(station_for(line["category"]), []).append(line)
+
+        with self._submit_lock:
+            # Workers only ever free up space, so checking up front keeps a table's tickets together
+            if self._queue.maxsize and self._queue.qsize() + len(by_station) > self._queue.maxsize:
+                raise queue.Full
+            first = self._numbers(len(by_station), self._floor)
+            tickets = [
+                Ticket(number, table, station, station_lines)
+                for number, (station, station_lines) in enumerate(by_station.items(), first)
+            ]
+            for ticket in tickets:
+                self._queue.put_nowait(ticket)
+        self._count("queued", len(tickets))
+        return tickets
+
+    def _next_numbers(self, count, floor):
+        # Called under the submit lock
+        self._last_number = max(self._last_number, floor) + count
+        return self._last_number - count + 1
+
+    def _attempt(self, ticket):
+        printer = self.printers.get(ticket.station) or self.printers[DEFAULT_STATION]
+        printer.send(ticket)
+
+    def _retryable(self, exc):
+        return isinstance(exc, OSError)
+
+    def _succeeded(self, ticket, result):
+        self._latencies.append(time.monotonic() - ticket.created_at)
+        self._count("sent")
+
+    def _failed(self, ticket, exc):
+        logger.exception("KOT #%s for %s could not be printed", ticket.number, ticket.station)
+        self._count("failed")
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        return {
+            **super().metrics(),
+            "latency_avg": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p95": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        }
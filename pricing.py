@@ -0,0 +1,199 @@
+"""Bill pricing in integer paise: a stackable discount pipeline and GST slabs.
+
+Amounts are whole paise and rates are basis points throughout, so a bill
+prices to the same paisa on the bill card, in the downloaded bill, in the
+sales ledger and when day-end reconciliation recomputes it. Every rounding
+step is half up.
+
+Each line is taxed at its item's GST slab. The sales ledger stores the rate
+a line was charged at, so changing a slab never reprices bills already
+recorded.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+DEFAULT_GST_BP = 1800  # 18% GST
+# Item-level GST slabs in basis points, looked up by item name first, then by category
+GST_SLABS = {
+    "🍰 Desserts": 1200,
+    "🥤 Beverages": 1200,
+    "Masala Tea": 500,
+    "Coffee": 500,
+}
+
+Quote = namedtuple("Quote", ["subtotal", "discount", "tax", "total", "tax_by_rate"])
+
+
+def to_paise(rupees):
+    # Through str so float noise such as 0.1 + 0.2 never reaches the paise
+    return int((Decimal(str(rupees)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_bp(percent):
+    return int((Decimal(str(percent)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_rupees(paise):
+    """Paise as a rupee float, for storage and charts."""
+    return paise / 100
+
+
+def format_rupees(paise):
+    sign = "-" if paise < 0 else ""
+    paise = abs(paise)
+    return f"{sign}{paise // 100}.{paise % 100:02d}"
+
+
+def percent_of(amount, bp):
+    return (amount * bp + 5000) // 10000
+
+
+def gst_rate(name, category):
+    return GST_SLABS.get(name, GST_SLABS.get(category, DEFAULT_GST_BP))
+
+
+def line_rate(line):
+    """GST rate of an order-line dict: the one it was charged at if recorded, else its slab's."""
+    rate = line.get("gst_bp")
+    return gst_rate(line["item"], line["category"]) if rate is None else rate
+
+
+# Discount rules; each takes the running net amount and returns what it takes off
+
+
+class PercentageDiscount:
+    __slots__ = ("bp",)
+
+    label = ""
+
+    def __init__(self, bp):
+        self.bp = bp
+
+    def apply(self, net):
+        return percent_of(net, self.bp)
+
+    def describe(self):
+        return f"{self.bp / 100:g}%{self.label}"
+
+
+class LoyaltyDiscount(PercentageDiscount):
+    __slots__ = ()
+
+    label = " loyalty"
+
+
+class FixedDiscount:
+    __slots__ = ("paise",)
+
+    def __init__(self, paise):
+        self.paise = paise
+
+    def apply(self, net):
+        return self.paise
+
+    def describe(self):
+        return f"₹{self.paise / 100:g}"
+
+
+def discount_rules(discounts):
+    """Rules for a ``{"percentage", "loyalty", "fixed"}`` discount dict, in the order they stack.
+
+    Percentages apply to what is left after the rules before them, and the
+    fixed amount comes off last.
+    """
+    rules = []
+    if discounts.get("percentage"):
+        rules.append(PercentageDiscount(to_bp(discounts["percentage"])))
+    if discounts.get("loyalty"):
+        rules.append(LoyaltyDiscount(to_bp(discounts["loyalty"])))
+    if discounts.get("fixed"):
+        rules.append(FixedDiscount(to_paise(discounts["fixed"])))
+    return rules
+
+
+def describe_discount(discounts):
+    return " + ".join(rule.describe() for rule in discount_rules(discounts))
+
+
+def allocate(amount, weights):
+    """Split ``amount`` in proportion to ``weights`` into whole shares that add up to it."""
+    total = sum(weights)
+    shares = []
+    cumulative = allocated = 0
+    for weight in weights:
+        cumulative += weight
+        upto = amount * cumulative // total
+        shares.append(upto - allocated)
+        allocated = upto
+    return shares
+
+
+def quote(slab_subtotals, rules=()):
+    """Price a bill from its gross paise per GST rate, ``{rate_bp: paise}``.
+
+    Discounts are taken off the whole bill, then spread over the GST slabs in
+    proportion to their gross amounts so each slab is taxed on its net.
+    """
+    rates = sorted(rate for rate, amount in slab_subtotals.items() if amount)
+    gross = [slab_subtotals[rate] for rate in rates]
+    subtotal = sum(gross)
+
+    net = subtotal
+    for rule in rules:
+        net -= min(rule.apply(net), net)
+    discount = subtotal - net
+
+    tax_by_rate = {}
+    if subtotal:
+        for rate, amount, share in zip(rates, gross, allocate(discount, gross)):
+            tax_by_rate[rate] = percent_of(amount - share, rate)
+    tax = sum(tax_by_rate.values())
+    return Quote(subtotal, discount, tax, net + tax, tax_by_rate)
+
+
+def slab_subtotals(lines):
+    """``{rate_bp: paise}`` for order-line dicts as stored in the sales ledger."""
+    slabs = {}
+    for line in lines:
+        rate = line_rate(line)
+        slabs[rate] = slabs.get(rate, 0) + to_paise(line["price"]) * line["quantity"]
+    return slabs
+
+
+def quote_lines(lines, discounts):
+    return quote(slab_subtotals(lines), discount_rules(discounts))
+
+
+def tax_label(bill_quote):
+    rates = sorted(bill_quote.tax_by_rate) or [DEFAULT_GST_BP]
+    return "/".join(f"{rate / 100:g}%" for rate in rates) + " GST"
+
+
+def quote_many(slab_matrix, rates, percentage_bp=0, loyalty_bp=0, fixed_paise=0):
+    """Vectorised ``quote`` over many bills at once, for day-end recomputation.
+
+    ``slab_matrix`` is an ``(n_bills, n_rates)`` array of gross paise per GST
+    rate in ``rates``; the discounts are per-bill arrays (or scalars) in basis
+    points and paise, stacked as ``discount_rules`` stacks them. Returns
+    ``(subtotal, discount, tax, total)`` int64 arrays that match ``quote``
+    bill for bill.
+    """
+    import numpy as np
+
+    rates = np.asarray(rates, dtype=np.int64)
+    order = np.argsort(rates, kind="stable")
+    rates = rates[order]
+    gross = np.asarray(slab_matrix, dtype=np.int64).reshape(-1, len(rates))[:, order]
+    subtotal = gross.sum(axis=1)
+
+    net = subtotal.copy()
+    for bp in (percentage_bp, loyalty_bp):
+        net -= np.minimum((net * np.asarray(bp, dtype=np.int64) + 5000) // 10000, net)
+    net -= np.minimum(np.asarray(fixed_paise, dtype=np.int64), net)
+    discount = subtotal - net
+
+    # Same cumulative split as ``allocate``; empty slabs get no share and no tax
+    upto = discount[:, None] * gross.cumsum(axis=1) // np.maximum(subtotal, 1)[:, None]
+    shares = np.diff(upto, axis=1, prepend=0)
+    tax = (((gross - shares) * rates + 5000) // 10000).sum(axis=1)
+    return subtotal, discount, tax, net + tax
@@ -0,0 +1,247 @@
+"""Rerun instrumentation: per-section wall time, hot-path counters and exporters.
+
+A ``RerunProfiler`` is started at the top of every script run and made the
+active profiler for that thread (Streamlit runs each session's script in its
+own thread), so library code can call ``count("dataframe")`` without having
+the profiler passed in. A run cut short by ``st.rerun()`` never reaches its
+``finish`` call; it is finished when the next run starts on the thread.
+Finished runs are folded into a process-wide ``MetricsRegistry`` that keeps
+a bounded window of samples per section.
+"""
+import atexit
+import functools
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from config import DATA_DIR
+
+METRICS_JSONL_PATH = os.path.join(DATA_DIR, "metrics.jsonl")
+METRICS_PROM_PATH = os.path.join(DATA_DIR, "metrics.prom")
+
+_active = threading.local()
+
+
+def count(kind, amount=1):
+    """Count a hot-path event (DataFrame built, chart built, ...) against the active rerun."""
+    profiler = getattr(_active, "profiler", None)
+    if profiler is not None:
+        profiler.counts[kind] += amount
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def session_state_bytes(session_state):
+    # Pickled size is a fair proxy for what a session keeps alive; fall back to shallow sizes
+    state = {key: session_state[key] for key in list(session_state.keys())}
+    try:
+        return len(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sum(sys.getsizeof(value) for value in state.values())
+
+
+class RerunProfiler:
+    """Times consecutive named sections of one script run.
+
+    ``section(name)`` closes the running section and opens the next one, so
+    the script only needs a marker line at each section boundary.
+    """
+
+    def __init__(self, registry, kind="rerun"):
+        self.registry = registry
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.sections = {}
+        self.counts = Counter()
+        self._current = None
+        self._section_started = None
+        _active.profiler = self
+
+    def section(self, name):
+        self.end_section()
+        self._current = name
+        self._section_started = time.perf_counter()
+
+    def end_section(self):
+        if self._current is not None:
+            elapsed = time.perf_counter() - self._section_started
+            self.sections[self._current] = self.sections.get(self._current, 0.0) + elapsed
+            self._current = None
+
+    def finish(self, session_state=None):
+        self.end_section()
+        if getattr(_active, "profiler", None) is self:
+            _active.profiler = None
+        state_bytes = session_state_bytes(session_state) if session_state is not None else None
+        self.registry.record(self.kind, time.perf_counter() - self.started, self.sections, self.counts, state_bytes)
+
+
+class _NullProfiler:
+    def section(self, name):
+        pass
+
+    def end_section(self):
+        pass
+
+    def finish(self, session_state=None):
+        pass
+
+
+class MetricsRegistry:
+    """Process-wide rolling window of rerun and section timings.
+
+    ``window`` samples are kept per section for the p50/p95 figures, counters
+    accumulate for the life of the process. When ``export`` is on, every run
+    is buffered as a JSON line and written to ``jsonl_path`` (together with a
+    Prometheus text snapshot at ``prom_path``) every ``flush_every`` runs.
+    """
+
+    def __init__(self, enabled=None, window=1000, export=True, flush_every=20,
+                 jsonl_path=METRICS_JSONL_PATH, prom_path=METRICS_PROM_PATH):
+        if enabled is None:
+            enabled = os.environ.get("RESTAURANT_PROFILING", "0") not in ("", "0", "false")
+        self.enabled = enabled
+        self.export = export
+        self.flush_every = flush_every
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self._window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._totals = {}
+        self._counts = Counter()
+        self._last_state_bytes = None
+        self._pending = []
+        if export:
+            atexit.register(self.flush)
+
+    def start(self, kind="rerun"):
+        # A previous run on this thread that is still active ended early in a rerun
+        interrupted = getattr(_active, "profiler", None)
+        if interrupted is not None:
+            interrupted.finish()
+        return RerunProfiler(self, kind) if self.enabled else _NullProfiler()
+
+    @contextmanager
+    def fragment(self, name):
+        """Profile a fragment that reran on its own, without the rest of the script.
+
+        During a full run the fragment body is already covered by the rerun's
+        section markers, so nothing extra is recorded.
+        """
+        if getattr(_active, "profiler", None) is not None:
+            yield
+            return
+        profiler = self.start(f"fragment:{name}")
+        profiler.section(name)
+        try:
+            yield
+        finally:
+            profiler.finish()
+
+    def profiled(self, name):
+        """Decorator form of ``fragment`` for ``st.fragment`` functions."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.fragment(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, kind, total, sections, counts, state_bytes=None):
+        record = {
+            "ts": round(time.time(), 3),
+            "kind": kind,
+            "total_ms": round(total * 1000, 3),
+            "sections_ms": {name: round(seconds * 1000, 3) for name, seconds in sections.items()},
+            "counts": dict(counts),
+        }
+        if state_bytes is not None:
+            record["session_state_bytes"] = state_bytes
+
+        with self._lock:
+            for name, seconds in [(kind, total), *sections.items()]:
+                self._samples.setdefault(name, deque(maxlen=self._window)).append(seconds)
+                runs, sum_seconds = self._totals.get(name, (0, 0.0))
+                self._totals[name] = (runs + 1, sum_seconds + seconds)
+            self._counts.update(counts)
+            if state_bytes is not None:
+                self._last_state_bytes = state_bytes
+            if self.export:
+                self._pending.append(record)
+                flush = len(self._pending) >= self.flush_every
+            else:
+                flush = False
+        if flush:
+            self.flush()
+
+    def summary(self):
+        """``{section: {"runs", "p50_ms", "p95_ms", "max_ms"}}`` over the current window."""
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            totals = dict(self._totals)
+        return {
+            name: {
+                "runs": totals[name][0],
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+            for name, values in samples.items()
+        }
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counts), self._last_state_bytes
+
+    def prometheus(self):
+        summary = self.summary()
+        with self._lock:
+            totals = dict(self._totals)
+        counts, state_bytes = self.counters()
+
+        lines = [
+            "# HELP restaurant_section_seconds Wall time per app section and per rerun",
+            "# TYPE restaurant_section_seconds summary",
+        ]
+        for name, stats in sorted(summary.items()):
+            label = f'section="{name}"'
+            lines.append(f'restaurant_section_seconds{{{label},quantile="0.5"}} {stats["p50_ms"] / 1000:.6f}')
+            lines.append(f'restaurant_section_seconds{{{label},quantile="0.95"}} {stats["p95_ms"] / 1000:.6f}')
+            lines.append(f"restaurant_section_seconds_sum{{{label}}} {totals[name][1]:.6f}")
+            lines.append(f"restaurant_section_seconds_count{{{label}}} {totals[name][0]}")
+        lines += [
+            "# HELP restaurant_events_total Hot-path events such as DataFrame and chart builds",
+            "# TYPE restaurant_events_total counter",
+        ]
+        lines += [f'restaurant_events_total{{kind="{kind}"}} {value}' for kind, value in sorted(counts.items())]
+        if state_bytes is not None:
+            lines += [
+                "# HELP restaurant_session_state_bytes Pickled size of the last profiled session state",
+                "# TYPE restaurant_session_state_bytes gauge",
+                f"restaurant_session_state_bytes {state_bytes}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+        with open(self.jsonl_path, "a", encoding="utf-8") as jsonl:
+            jsonl.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in pending)
+        # Written then renamed so a node_exporter textfile collector never reads half a file
+        with open(self.prom_path + ".tmp", "w", encoding="utf-8") as prom:
+            prom.write(self.prometheus())
+        os.replace(self.prom_path + ".tmp", self.prom_path)
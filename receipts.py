@@ -0,0 +1,69 @@
+"""SMS receipts for generated bills, sent through a pluggable gateway."""
+import json
+import os
+import urllib.request
+from datetime import datetime
+
+from config import DATA_DIR
+
+DEFAULT_OUTBOX_DIR = os.path.join(DATA_DIR, "outbox")
+
+RECEIPT_TEMPLATE = ("Smart Restaurant: Bill #{id} for Rs.{total:.2f} on {date} at {time} "
+                    "({payment_mode}). Thank you for dining with us!")
+
+
+def receipt_text(bill_data):
+    return RECEIPT_TEMPLATE.format(
+        id=bill_data.get("id") or "-",
+        total=bill_data["total_amount"],
+        date=bill_data["date"],
+        time=bill_data["time"][:5],
+        # Payment options carry an emoji prefix, which would force the whole SMS into UCS-2
+        payment_mode=(bill_data.get("payment_mode") or "N/A").split(" ", 1)[-1],
+    )
+
+
+class OutboxGateway:
+    """Local stand-in for an SMS service: each message is a JSON file under ``directory``."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def send(self, phone, text, reference):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"sms_{reference}.json")
+        message = {"to": phone, "text": text, "queued_at": datetime.now().isoformat(timespec="seconds")}
+        # Write then rename so a reader polling the outbox never sees a partial message
+        with open(path + ".tmp", "w", encoding="utf-8") as outbox_file:
+            json.dump(message, outbox_file, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+
+class HttpGateway:
+    """POSTs ``{"to", "text", "reference"}`` as JSON to an SMS provider endpoint."""
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, phone, text, reference):
+        body = json.dumps({"to": phone, "text": text, "reference": reference}).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        # Connection errors and HTTP error statuses both surface as OSError subclasses
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def gateway_from_env():
+    # RESTAURANT_SMS_GATEWAY is an http(s):// endpoint or an outbox directory
+    target = os.environ.get("RESTAURANT_SMS_GATEWAY", DEFAULT_OUTBOX_DIR)
+    if target.startswith(("http://", "https://")):
+        return HttpGateway(target)
+    return OutboxGateway(target)
+
+
+def send_receipt(gateway, ledger, bill_id, phone):
+    """Text the customer a receipt for a bill already recorded in ``ledger``."""
+    bill_data = ledger.bill(bill_id)
+    # One message per bill; a retried send overwrites rather than duplicates it in the outbox
+    gateway.send(phone, receipt_text(bill_data), f"bill_{bill_id}")
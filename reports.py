@@ -0,0 +1,312 @@
+"""Streaming end-of-day reconciliation over the sales ledger.
+
+Bills are read from ``SalesLedger.iter_bills`` a chunk at a time and folded
+into a ``Reconciliation`` in one pass. Its state grows with the number of
+days, payment modes, items and tables in the range, never with the number
+of bills. Every chunk is repriced with ``pricing.quote_many``, so discount
+and tax figures come from the same arithmetic that priced the bills, and
+bills whose stored total disagrees are counted as mismatches. Long ranges
+can be split by day across a process pool and the partial results merged.
+
+Run ``python reports.py --from 2026-01-01 --to 2026-01-31`` to write the
+reports without the Streamlit UI.
+"""
+import argparse
+import csv
+import io
+import itertools
+import os
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+from billing import PAYMENT_MODES
+from pricing import quote_many, slab_subtotals, to_bp, to_paise, to_rupees
+from sales_ledger import DEFAULT_DB_PATH, SalesLedger
+
+REPORT_FORMATS = ("csv", "parquet")
+
+REPORT_COLUMNS = {
+    "summary": ["date", "bills", "gross", "discount", "net", "tax", "collected",
+                "discount_pct", "mismatched_bills", "mismatch_amount"],
+    "payment_modes": ["payment_mode", "bills", "gross", "discount", "tax", "collected", "share_pct"],
+    "discounts": ["discount", "bills", "gross", "discount_amount", "leakage_pct"],
+    "items": ["item", "category", "quantity", "revenue", "bills", "per_trading_hour"],
+    "tables": ["table", "bills", "revenue", "turns_per_day", "avg_seated_min"],
+}
+
+# Summed money figures per day and per payment mode: bills, gross, discount, tax, collected
+_FIGURES = 5
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _pct(part, whole):
+    return round(part * 100 / whole, 2) if whole else 0.0
+
+
+def _add(totals, key, values):
+    row = totals.get(key)
+    if row is None:
+        totals[key] = list(values)
+    else:
+        for i, value in enumerate(values):
+            row[i] += value
+
+
+class Reconciliation:
+    """Single-pass day-end aggregates; amounts are kept in paise."""
+
+    def __init__(self):
+        self.days = {}
+        self.payment_modes = {mode: [0] * _FIGURES for mode in PAYMENT_MODES}
+        self.discounts = {}
+        self.items = {}
+        self.tables = {}
+        self.trading_hours = set()
+        self.mismatches = {}
+
+    def add_chunk(self, bills):
+        """Fold a list of bills, as yielded by ``SalesLedger.iter_bills``, into the totals."""
+        # Lines carry the GST rate they were charged at, so old bills reprice at their original slabs
+        slabs = [slab_subtotals(bill_data["orders"]) for bill_data in bills]
+        rates = sorted({rate for bill_slabs in slabs for rate in bill_slabs}) or [0]
+
+        discounts = [bill_data.get("discount", {}) for bill_data in bills]
+        subtotal, discount, tax, total = (
+            figures.tolist() for figures in quote_many(
+                [[bill_slabs.get(rate, 0) for rate in rates] for bill_slabs in slabs],
+                rates,
+                [to_bp(d.get("percentage") or 0) for d in discounts],
+                [to_bp(d.get("loyalty") or 0) for d in discounts],
+                [to_paise(d.get("fixed") or 0) for d in discounts],
+            )
+        )
+
+        for i, bill_data in enumerate(bills):
+            day = bill_data["date"]
+            figures = (1, subtotal[i], discount[i], tax[i], total[i])
+            _add(self.days, day, figures)
+            _add(self.payment_modes, bill_data.get("payment_mode") or "Unknown", figures)
+
+            kinds = [name for name in ("percentage", "loyalty", "fixed") if discounts[i].get(name)]
+            _add(self.discounts, " + ".join(kinds) or "none", (1, subtotal[i], discount[i]))
+
+            difference = to_paise(bill_data["total_amount"]) - total[i]
+            if difference:
+                _add(self.mismatches, day, (1, difference))
+
+            self.trading_hours.add((day, bill_data["time"][:2]))
+            for line in bill_data["orders"]:
+                row = self.items.setdefault(line["item"], [line["category"], 0, 0, 0])
+                row[1] += line["quantity"]
+                row[2] += to_paise(line["price"]) * line["quantity"]
+            for name in {line["item"] for line in bill_data["orders"]}:
+                self.items[name][3] += 1
+
+            seated = 0
+            opened_at = bill_data.get("opened_at")
+            if opened_at:
+                closed = datetime.fromisoformat(f"{day}T{bill_data['time']}")
+                seated = max(0, (closed - datetime.fromtimestamp(opened_at)).total_seconds())
+            table = bill_data.get("customer", {}).get("table")
+            _add(self.tables, table, (1, subtotal[i], seated, 1 if opened_at else 0))
+
+    def merge(self, other):
+        for mine, theirs in [(self.days, other.days), (self.payment_modes, other.payment_modes),
+                             (self.discounts, other.discounts), (self.tables, other.tables),
+                             (self.mismatches, other.mismatches)]:
+            for key, values in theirs.items():
+                _add(mine, key, values)
+        for name, (category, quantity, revenue, bills) in other.items.items():
+            row = self.items.setdefault(name, [category, 0, 0, 0])
+            row[1] += quantity
+            row[2] += revenue
+            row[3] += bills
+        self.trading_hours |= other.trading_hours
+        return self
+
+    # Report rows, money in rupees
+
+    def summary(self):
+        rows = []
+        grand = [0] * _FIGURES
+        grand_mismatch = [0, 0]
+        for day in sorted(self.days):
+            figures = self.days[day]
+            mismatch = self.mismatches.get(day, (0, 0))
+            rows.append(self._summary_row(day, figures, mismatch))
+            grand = [a + b for a, b in zip(grand, figures)]
+            grand_mismatch = [a + b for a, b in zip(grand_mismatch, mismatch)]
+        rows.append(self._summary_row("TOTAL", grand, grand_mismatch))
+        return rows
+
+    @staticmethod
+    def _summary_row(day, figures, mismatch):
+        bills, gross, discount, tax, collected = figures
+        return {
+            "date": day, "bills": bills, "gross": to_rupees(gross), "discount": to_rupees(discount),
+            "net": to_rupees(gross - discount), "tax": to_rupees(tax), "collected": to_rupees(collected),
+            "discount_pct": _pct(discount, gross), "mismatched_bills": mismatch[0],
+            "mismatch_amount": to_rupees(mismatch[1]),
+        }
+
+    def payment_mode_rows(self):
+        collected_total = sum(figures[4] for figures in self.payment_modes.values())
+        return [
+            {"payment_mode": mode, "bills": bills, "gross": to_rupees(gross), "discount": to_rupees(discount),
+             "tax": to_rupees(tax), "collected": to_rupees(collected), "share_pct": _pct(collected, collected_total)}
+            for mode, (bills, gross, discount, tax, collected) in self.payment_modes.items()
+        ]
+
+    def discount_rows(self):
+        return [
+            {"discount": kind, "bills": bills, "gross": to_rupees(gross), "discount_amount": to_rupees(discount),
+             "leakage_pct": _pct(discount, gross)}
+            for kind, (bills, gross, discount) in sorted(self.discounts.items(), key=lambda item: -item[1][2])
+        ]
+
+    def item_rows(self):
+        hours = len(self.trading_hours) or 1
+        return [
+            {"item": name, "category": category, "quantity": quantity, "revenue": to_rupees(revenue),
+             "bills": bills, "per_trading_hour": round(quantity / hours, 2)}
+            for name, (category, quantity, revenue, bills)
+            in sorted(self.items.items(), key=lambda item: (-item[1][1], item[0]))
+        ]
+
+    def table_rows(self):
+        days = len(self.days) or 1
+        return [
+            {"table": table, "bills": bills, "revenue": to_rupees(revenue), "turns_per_day": round(bills / days, 2),
+             "avg_seated_min": round(seated / timed / 60, 1) if timed else None}
+            for table, (bills, revenue, seated, timed)
+            in sorted(self.tables.items(), key=lambda item: (item[0] is None, item[0] or 0))
+        ]
+
+    def reports(self):
+        """``{report name: rows}`` for every report in ``REPORT_COLUMNS``."""
+        return {
+            "summary": self.summary(),
+            "payment_modes": self.payment_mode_rows(),
+            "discounts": self.discount_rows(),
+            "items": self.item_rows(),
+            "tables": self.table_rows(),
+        }
+
+
+def reconcile(bills, chunk_size=500):
+    recon = Reconciliation()
+    for chunk in chunked(bills, chunk_size):
+        recon.add_chunk(chunk)
+    return recon
+
+
+def _reconcile_span(db_path, start, end, chunk_size):
+    ledger = SalesLedger(db_path)
+    try:
+        return reconcile(ledger.iter_bills(start, end, chunk_size), chunk_size)
+    finally:
+        ledger.close()
+
+
+def day_spans(start, end, parts):
+    """Split ``start``..``end`` into at most ``parts`` contiguous (first, last) day spans."""
+    start, end = date.fromisoformat(str(start)), date.fromisoformat(str(end))
+    days = (end - start).days + 1
+    step = -(-days // parts)
+    return [
+        (start + timedelta(days=offset), min(end, start + timedelta(days=offset + step - 1)))
+        for offset in range(0, days, step)
+    ]
+
+
+def reconcile_range(db_path, start, end, workers=1, chunk_size=500):
+    """Reconcile bills dated ``start`` to ``end``, fanning out over ``workers`` processes."""
+    spans = day_spans(start, end, workers * 4) if workers > 1 else [(start, end)]
+    if len(spans) == 1:
+        return _reconcile_span(db_path, start, end, chunk_size)
+
+    # Opened once up front so schema migrations never race between workers
+    SalesLedger(db_path).close()
+    recon = Reconciliation()
+    with ProcessPoolExecutor(workers) as pool:
+        for part in pool.map(_reconcile_span, itertools.repeat(db_path), *zip(*spans),
+                             itertools.repeat(chunk_size)):
+            recon.merge(part)
+    return recon
+
+
+# Writers
+
+
+def write_csv_report(rows, columns, out):
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def write_reports(recon, out_dir, fmt="csv"):
+    """One file per report into ``out_dir``; returns the paths written."""
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format: {fmt}")
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for name, rows in recon.reports().items():
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        if fmt == "csv":
+            with open(path, "w", encoding="utf-8", newline="") as out:
+                write_csv_report(rows, REPORT_COLUMNS[name], out)
+        else:
+            # Parquet goes through pandas and needs pyarrow (or fastparquet) installed
+            import pandas as pd
+
+            pd.DataFrame(rows, columns=REPORT_COLUMNS[name]).to_parquet(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def reports_to_tempfile(recon):
+    """All reports as CSVs in one ZIP, in an unnamed temporary file (for download buttons)."""
+    out = tempfile.TemporaryFile()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, rows in recon.reports().items():
+            text = io.StringIO()
+            write_csv_report(rows, REPORT_COLUMNS[name], text)
+            archive.writestr(f"{name}.csv", text.getvalue())
+    out.seek(0)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Day-end reconciliation reports from the sales ledger")
+    parser.add_argument("--from", dest="start", default=date.today().isoformat(), help="first day (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", help="last day (YYYY-MM-DD), defaults to --from")
+    parser.add_argument("--format", choices=REPORT_FORMATS, default="csv")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="sales ledger database")
+    parser.add_argument("--workers", type=int, default=1, help="processes to split multi-day ranges over")
+    parser.add_argument("--chunk-size", type=int, default=500, help="bills read per query")
+    parser.add_argument("--out-dir", help="output directory, defaults to reports_<from>_<to>")
+    args = parser.parse_args(argv)
+
+    end = args.end or args.start
+    out_dir = args.out_dir or f"reports_{args.start}_{end}"
+    recon = reconcile_range(args.db, args.start, end, args.workers, args.chunk_size)
+    paths = write_reports(recon, out_dir, args.format)
+    total = recon.summary()[-1]
+    print(f"Reconciled {total['bills']} bills, ₹{total['collected']:.2f} collected, "
+          f"{total['mismatched_bills']} mismatched; wrote {len(paths)} reports to {os.path.abspath(out_dir)}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
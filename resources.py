@@ -0,0 +1,88 @@
+"""Process-wide resources, created once and shared by every session.
+
+Streamlit re-executes the app script on every interaction; everything here
+is built on the first run after a server (re)start and then reused, with
+the time each piece took kept for the startup report.
+"""
+import os
+import time
+from collections import namedtuple
+from functools import partial
+
+import streamlit as st
+
+from catalog import load_catalog
+from customers import CustomerStore
+from forecasting import DemandForecaster
+from inventory import InventoryStore, load_recipes
+from kitchen import KitchenDispatcher, printers_from_env
+from profiling import MetricsRegistry
+from receipts import gateway_from_env
+from sales_ledger import SalesLedger
+from table_store import open_table_store
+from tasks import TaskRunner
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+Resources = namedtuple(
+    "Resources", ["catalog", "ledger", "tables", "kitchen", "tasks", "receipts", "forecaster", "inventory", "customers",
+                  "metrics", "css", "startup"]
+)
+
+
+def load_css():
+    with open(os.path.join(STATIC_DIR, "styles.css"), encoding="utf-8") as css_file:
+        return f"<style>\n{css_file.read()}</style>"
+
+
+@st.cache_resource(show_spinner="Starting up...")
+def get_resources():
+    startup = {}
+
+    def timed(name, factory):
+        started = time.perf_counter()
+        value = factory()
+        startup[name] = (time.perf_counter() - started) * 1000
+        return value
+
+    catalog = timed("catalog", lambda: load_catalog(watch=True))
+    ledger = timed("ledger", SalesLedger)
+    forecaster = DemandForecaster(ledger.analytics, catalog)
+    ledger.subscribe(forecaster.record)
+    # Stock is depleted in each bill's transaction; items that run out drop off the menu filters
+    inventory = timed("inventory", lambda: ledger.attach(partial(InventoryStore, book=load_recipes())))
+    catalog.hide(inventory.unavailable)
+    inventory.subscribe(catalog.hide)
+    customers = timed("customers", lambda: ledger.attach(CustomerStore))
+    tables = timed("tables", lambda: open_table_store(catalog))
+    return Resources(
+        catalog=catalog,
+        ledger=ledger,
+        tables=tables,
+        # KOT numbers come from the table store, so processes sharing it never print the same one
+        kitchen=timed("kitchen", lambda: KitchenDispatcher(printers_from_env(),
+                                                           numbers=partial(tables.reserve_numbers, "kot"))),
+        tasks=timed("tasks", TaskRunner),
+        receipts=gateway_from_env(),
+        forecaster=forecaster,
+        inventory=inventory,
+        customers=customers,
+        metrics=timed("metrics", MetricsRegistry),
+        css=timed("styles", load_css),
+        startup=startup,
+    )
+
+
+def record_rerun(resources, started):
+    """Rerun duration in ms; the first one after startup is kept as the cold-start time."""
+    elapsed = (time.perf_counter() - started) * 1000
+    resources.startup.setdefault("first_rerun", elapsed)
+    return elapsed
+
+
+def timing_report(resources, rerun_ms):
+    startup = resources.startup
+    names = ("catalog", "ledger", "inventory", "customers", "tables", "kitchen", "tasks", "styles")
+    parts = ", ".join(f"{name} {startup[name]:.0f} ms" for name in names)
+    return (f"⏱️ This rerun {rerun_ms:.0f} ms · cold start {startup.get('first_rerun', rerun_ms):.0f} ms "
+            f"({parts})")
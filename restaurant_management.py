@@ -1,10 +1,25 @@
+import time
+
+rerun_started = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-from datetime import datetime, date
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import json
+from datetime import datetime, date, timedelta
+import queue
+
+# Heavy libraries (pandas, Plotly) are imported by these modules only when first needed
+import charts
+from bill_export import EXPORT_FORMATS, export_to_tempfile, render_bill_text
+from billing import PAYMENT_MODES
+from catalog import POPULAR_ITEMS
+from customers import tier_for
+from kitchen import STATIONS
+from pricing import describe_discount, format_rupees, tax_label, to_rupees
+from receipts import send_receipt
+from reports import reconcile, reports_to_tempfile
+from resources import get_resources, record_rerun, timing_report
+from sales_ledger import BILL_SORTS, BillFilter, phone_key
+from table_store import MAX_TABLES, ConflictError
+from tasks import DONE, FAILED, RETRYING, PermanentError
 
 # Page configuration
 st.set_page_config(
@@ -14,319 +29,210 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for modern styling
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 3rem;
-        font-weight: bold;
-        background: linear-gradient(135deg, #ff6a00 0%, #ee0979 50%, #6a00ff 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        text-align: center;
-        margin-bottom: 2rem;
-        animation: gradient 3s ease infinite;
-    }
-    
-    @keyframes gradient {
-        0% { background-position: 0% 50%; }
-        50% { background-position: 100% 50%; }
-        100% { background-position: 0% 50%; }
-    }
-    
-    .bill-card {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 2rem;
-        border-radius: 20px;
-        color: white;
-        text-align: center;
-        box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-        margin: 1rem 0;
-        animation: pulse 2s infinite;
-    }
-    
-    @keyframes pulse {
-        0% { transform: scale(1); }
-        50% { transform: scale(1.02); }
-        100% { transform: scale(1); }
-    }
-    
-    .order-card {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 1.5rem;
-        border-radius: 15px;
-        color: white;
-        margin: 1rem 0;
-        box-shadow: 0 5px 20px rgba(0,0,0,0.1);
-        border-left: 5px solid #ff6a00;
-    }
-    
-    .stats-card {
-        background: linear-gradient(135deg, #11998e 0%, #38ef7d 100%);
-        padding: 1.5rem;
-        border-radius: 15px;
-        color: white;
-        text-align: center;
-        margin: 0.5rem 0;
-        box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-    }
-    
-    .payment-card {
-        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        padding: 1.5rem;
-        border-radius: 15px;
-        color: white;
-        margin: 1rem 0;
-        box-shadow: 0 5px 20px rgba(0,0,0,0.1);
-    }
-    
-    .menu-item {
-        background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-        padding: 1rem;
-        border-radius: 10px;
-        margin: 0.5rem 0;
-        color: white;
-        cursor: pointer;
-        transition: all 0.3s ease;
-    }
-    
-    .menu-item:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 10px 25px rgba(0,0,0,0.2);
-    }
-    
-    .stButton>button {
-        background: linear-gradient(45deg, #FE6B8B 30%, #FF8E53 90%);
-        color: white;
-        border: none;
-        border-radius: 25px;
-        padding: 0.75rem 2rem;
-        font-weight: bold;
-        box-shadow: 0 4px 15px rgba(254,107,139,0.4);
-        transition: all 0.3s ease;
-    }
-    
-    .stButton>button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 6px 20px rgba(254,107,139,0.6);
-    }
-    
-    .discount-badge {
-        background: linear-gradient(45deg, #ff9a9e 0%, #fecfef 100%);
-        color: #333;
-        padding: 0.5rem 1rem;
-        border-radius: 20px;
-        font-weight: bold;
-        display: inline-block;
-        margin: 0.5rem;
-    }
-    
-    .notification {
-        background: linear-gradient(135deg, #a8edea 0%, #fed6e3 100%);
-        padding: 1rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-        border-left: 4px solid #ff6a00;
-        animation: slideIn 0.5s ease-out;
-    }
-    
-    @keyframes slideIn {
-        from { transform: translateX(-100%); opacity: 0; }
-        to { transform: translateX(0); opacity: 1; }
-    }
-</style>
-""", unsafe_allow_html=True)
+# Menu catalog, sales ledger, table tabs, kitchen dispatcher and styles are
+# created once per server process and shared by every session
+resources = get_resources()
+catalog = resources.catalog
+ledger = resources.ledger
+tables = resources.tables
+kitchen = resources.kitchen
+task_runner = resources.tasks
+forecaster = resources.forecaster
+inventory = resources.inventory
+customers = resources.customers
 
-# Enhanced menu items with categories, descriptions, and special offers
-menu_items = {
-    "🥗 Starters": {
-        "Finger Chips": {"price": 80, "description": "Crispy golden fries", "category": "veg", "spicy": False},
-        "Paneer Chilly": {"price": 170, "description": "Spicy paneer in Chinese style", "category": "veg", "spicy": True},
-        "Manchurian": {"price": 120, "description": "Vegetable balls in tangy sauce", "category": "veg", "spicy": True},
-        "Chicken Wings": {"price": 200, "description": "Spicy grilled chicken wings", "category": "non-veg", "spicy": True},
-        "Fish Tikka": {"price": 250, "description": "Tandoori fish pieces", "category": "non-veg", "spicy": True}
-    },
-    "🍲 Soups": {
-        "Tomato Soup": {"price": 90, "description": "Fresh tomato soup", "category": "veg", "spicy": False},
-        "Manchow Soup": {"price": 120, "description": "Spicy Chinese soup", "category": "veg", "spicy": True},
-        "Sweet Corn Soup": {"price": 110, "description": "Creamy sweet corn", "category": "veg", "spicy": False},
-        "Chicken Soup": {"price": 140, "description": "Hot chicken broth", "category": "non-veg", "spicy": False}
-    },
-    "🥘 Main Course": {
-        "Paneer Bhurji": {"price": 180, "description": "Scrambled paneer curry", "category": "veg", "spicy": True},
-        "Kaju Curry": {"price": 220, "description": "Rich cashew curry", "category": "veg", "spicy": False},
-        "Veg Handi": {"price": 150, "description": "Mixed vegetable curry", "category": "veg", "spicy": True},
-        "Butter Chicken": {"price": 280, "description": "Creamy chicken curry", "category": "non-veg", "spicy": False},
-        "Mutton Curry": {"price": 320, "description": "Spicy mutton curry", "category": "non-veg", "spicy": True}
-    },
-    "🫓 Breads": {
-        "Phulka Roti": {"price": 8, "description": "Soft wheat bread", "category": "veg", "spicy": False},
-        "Butter Naan": {"price": 40, "description": "Buttery naan bread", "category": "veg", "spicy": False},
-        "Paneer Kulcha": {"price": 40, "description": "Stuffed paneer bread", "category": "veg", "spicy": False},
-        "Garlic Naan": {"price": 45, "description": "Garlic flavored naan", "category": "veg", "spicy": False}
-    },
-    "🍰 Desserts": {
-        "Gulab Jamun": {"price": 60, "description": "Sweet milk balls", "category": "veg", "spicy": False},
-        "Ice Cream": {"price": 80, "description": "Vanilla ice cream", "category": "veg", "spicy": False},
-        "Rasgulla": {"price": 70, "description": "Spongy cheese balls", "category": "veg", "spicy": False}
-    },
-    "🥤 Beverages": {
-        "Lassi": {"price": 50, "description": "Yogurt drink", "category": "veg", "spicy": False},
-        "Fresh Lime": {"price": 40, "description": "Fresh lime water", "category": "veg", "spicy": False},
-        "Masala Tea": {"price": 20, "description": "Spiced tea", "category": "veg", "spicy": False},
-        "Coffee": {"price": 30, "description": "Hot coffee", "category": "veg", "spicy": False}
-    }
-}
+# Rows sent to the browser per page of a long order or of the bill history
+LINES_PER_PAGE = 50
+HISTORY_PAGE_SIZE = 25
+metrics = resources.metrics
+
+# Per-section timings for the admin panel; a no-op unless profiling is switched on
+profiler = metrics.start()
+
+# Custom CSS for modern styling, read from static/styles.css at startup
+st.markdown(resources.css, unsafe_allow_html=True)
 
 # Initialize session states
-if "orders" not in st.session_state:
-    st.session_state.orders = []
 if "payment_mode" not in st.session_state:
     st.session_state.payment_mode = None
 if "customer_info" not in st.session_state:
     st.session_state.customer_info = {}
-if "daily_sales" not in st.session_state:
-    st.session_state.daily_sales = []
-if "discounts" not in st.session_state:
-    st.session_state.discounts = {"percentage": 0, "fixed": 0}
 if "table_number" not in st.session_state:
     st.session_state.table_number = 1
+if "show_analytics" not in st.session_state:
+    st.session_state.show_analytics = False
+if "pending_bill" not in st.session_state:
+    st.session_state.pending_bill = None
 
 # Header
 st.markdown('<div class="main-header">🍽️ Smart Restaurant Billing System</div>', unsafe_allow_html=True)
 
 # Sidebar - Enhanced Order section
+profiler.section("sidebar_menu")
 st.sidebar.header("📋 Place Your Order")
 
-# Customer info section
+# Changes made after this point by any terminal trigger a refresh
+st.session_state.seen_sequence = tables.sequence
+
+def update_customer(table, field):
+    value = st.session_state[f"customer_{field}"]
+
+    def set_field(tab):
+        tab.customer[field] = value
+        # A known number fills in the name it was last billed under
+        if field == "phone" and not tab.customer["name"]:
+            profile = customers.lookup(value)
+            if profile is not None and profile.name:
+                tab.customer["name"] = profile.name
+
+    tables.update(table, set_field)
+
+# Customer info section; the table number picks which shared tab this terminal works on
 with st.sidebar.expander("👤 Customer Information"):
-    customer_name = st.text_input("Customer Name", placeholder="Enter customer name")
-    table_number = st.number_input("Table Number", min_value=1, max_value=50, value=1)
-    phone_number = st.text_input("Phone Number", placeholder="Contact number")
+    table_number = st.number_input("Table Number", min_value=1, max_value=MAX_TABLES, key="table_number")
+    bill, customer, opened_at, tab_version = tables.snapshot(table_number)
+    
+    # Pick up name/phone edits made on other terminals
+    if st.session_state.get("synced_tab") != (table_number, tab_version):
+        st.session_state.customer_name = customer["name"]
+        st.session_state.customer_phone = customer["phone"]
+        st.session_state.synced_tab = (table_number, tab_version)
+    
+    customer_name = st.text_input("Customer Name", placeholder="Enter customer name",
+                                  key="customer_name", on_change=update_customer, args=(table_number, "name"))
+    phone_number = st.text_input("Phone Number", placeholder="Contact number",
+                                 key="customer_phone", on_change=update_customer, args=(table_number, "phone"))
     st.session_state.customer_info = {
         "name": customer_name,
         "table": table_number,
         "phone": phone_number
     }
+    profile = customers.lookup(customer["phone"])
+    loyalty_tier = tier_for(profile.points) if profile is not None else None
+    if profile is not None:
+        st.caption(f"{loyalty_tier.name} · {profile.points} points · {profile.visits} visits · "
+                   f"₹{profile.spend:,.0f} spent · last visit {profile.last_visit}")
+    elif phone_number:
+        st.caption("🆕 New customer: points start with this bill")
 
-# Menu selection with enhanced UI
-st.sidebar.subheader("🍽️ Menu Selection")
+# Tables with a running tab on any terminal
+open_tabs = tables.open_tables()
+if open_tabs:
+    st.sidebar.caption("🪑 Open tables: "
+                       + " · ".join(f"T{tab.table} ₹{to_rupees(tab.bill.subtotal):.0f}" for tab in open_tabs))
 
-# Category filter
-category = st.sidebar.selectbox("Select Category", list(menu_items.keys()))
-
-# Filter options
-col1, col2 = st.sidebar.columns(2)
-with col1:
-    veg_filter = st.checkbox("🥬 Veg Only", value=False)
-with col2:
-    spicy_filter = st.checkbox("🌶️ Spicy Only", value=False)
-
-# Filter items based on selection
-filtered_items = {}
-for item_name, item_data in menu_items[category].items():
-    if veg_filter and item_data["category"] != "veg":
-        continue
-    if spicy_filter and not item_data["spicy"]:
-        continue
-    filtered_items[item_name] = item_data
-
-if filtered_items:
-    item = st.sidebar.selectbox("Select Item", list(filtered_items.keys()))
-    
-    # Display item details
-    item_data = filtered_items[item]
-    st.sidebar.markdown(f"""
-    <div class="menu-item">
-        <strong>{item}</strong><br>
-        💰 ₹{item_data['price']}<br>
-        📝 {item_data['description']}<br>
-        {'🥬' if item_data['category'] == 'veg' else '🍖'} {'🌶️' if item_data['spicy'] else ''}
-    </div>
-    """, unsafe_allow_html=True)
-    
-    price = item_data['price']
-    quantity = st.sidebar.number_input("Quantity", min_value=1, max_value=20, value=1)
-    
-    # Special instructions
-    special_instructions = st.sidebar.text_area("Special Instructions", placeholder="e.g., Less spicy, Extra sauce")
-    
-    if st.sidebar.button("Add to Order ➕", key="add_order"):
-        st.session_state.orders.append({
-            "timestamp": datetime.now().strftime("%H:%M:%S"),
-            "category": category,
-            "item": item,
-            "price": price,
-            "quantity": quantity,
-            "total": price * quantity,
-            "instructions": special_instructions,
-            "item_type": item_data["category"],
-            "spicy": item_data["spicy"]
-        })
-        st.sidebar.success(f"✅ Added {quantity} x {item}")
+@st.fragment(run_every="2s")
+def watch_tables(table):
+    # Rerun the page only when another terminal touched this table
+    latest, changed = tables.changes_since(st.session_state.seen_sequence)
+    st.session_state.seen_sequence = latest
+    if changed is None or table in changed:
         st.rerun()
-else:
-    st.sidebar.info("No items match your filter criteria")
 
-# Quick add popular items
+with st.sidebar:
+    watch_tables(table_number)
+
+# Menu selection with enhanced UI. It runs as a fragment, so browsing the menu or typing
+# special instructions reruns only this block instead of the bill and charts.
+@st.fragment
+@metrics.profiled("sidebar_menu")
+def menu_selection(table_number):
+    st.subheader("🍽️ Menu Selection")
+
+    # Category filter
+    category = st.selectbox("Select Category", catalog.categories)
+
+    # Filter options
+    col1, col2 = st.columns(2)
+    with col1:
+        veg_filter = st.checkbox("🥬 Veg Only", value=False)
+    with col2:
+        spicy_filter = st.checkbox("🌶️ Spicy Only", value=False)
+
+    # Typing a name searches the whole menu; otherwise list the selected category
+    search_query = st.text_input("🔎 Search Menu", placeholder="e.g., naan, paneer")
+    if search_query:
+        filtered_items = catalog.search(search_query, mask=catalog.mask(None, veg_filter, spicy_filter))
+    else:
+        filtered_items = catalog.filter(category, veg_filter, spicy_filter)
+
+    if filtered_items:
+        item = st.selectbox("Select Item", filtered_items, format_func=lambda menu_item: menu_item.name)
+
+        # Display item details
+        st.markdown(f"""
+        <div class="menu-item">
+            <strong>{item.name}</strong><br>
+            💰 ₹{item.price}<br>
+            📝 {item.description}<br>
+            {'🥬' if item.item_type == 'veg' else '🍖'} {'🌶️' if item.spicy else ''}
+        </div>
+        """, unsafe_allow_html=True)
+
+        quantity = st.number_input("Quantity", min_value=1, max_value=20, value=1)
+
+        # Special instructions
+        special_instructions = st.text_area("Special Instructions", placeholder="e.g., Less spicy, Extra sauce")
+
+        if st.button("Add to Order ➕", key="add_order"):
+            tables.update(table_number, lambda tab: tab.bill.add(item, quantity, instructions=special_instructions))
+            st.success(f"✅ Added {quantity} x {item.name}")
+            st.rerun()
+    else:
+        st.info("No items match your filter criteria")
+
+    if inventory.unavailable:
+        st.caption("🚫 Out of stock: " + ", ".join(sorted(inventory.unavailable)))
+
+with st.sidebar:
+    menu_selection(table_number)
+
+# Quick add popular items, resolved through the catalog
 st.sidebar.subheader("⚡ Quick Add Popular Items")
-popular_items = [
-    ("Butter Chicken", "🥘 Main Course", 280),
-    ("Butter Naan", "🫓 Breads", 40),
-    ("Masala Tea", "🥤 Beverages", 20)
-]
-
-for item, cat, price in popular_items:
-    if st.sidebar.button(f"{item} - ₹{price}", key=f"quick_{item}"):
-        st.session_state.orders.append({
-            "timestamp": datetime.now().strftime("%H:%M:%S"),
-            "category": cat,
-            "item": item,
-            "price": price,
-            "quantity": 1,
-            "total": price,
-            "instructions": "",
-            "item_type": "veg" if item != "Butter Chicken" else "non-veg",
-            "spicy": False
-        })
-        st.sidebar.success(f"✅ Added {item}")
+
+for item in filter(None, (catalog.get(name) for name in POPULAR_ITEMS if not catalog.is_hidden(name))):
+    if st.sidebar.button(f"{item.name} - ₹{item.price}", key=f"quick_{item.name}"):
+        tables.update(table_number, lambda tab: tab.bill.add(item))
+        st.sidebar.success(f"✅ Added {item.name}")
         st.rerun()
 
+# Discounts are picked further down the page; reading the widget values here
+# lets the bill card above them already show the current figures
+def selected_discounts():
+    state = st.session_state
+    discount_type = state.get("discount_type", "None")
+    return {
+        "percentage": state.get("discount_percentage", 0) if discount_type == "Percentage" else 0,
+        "fixed": state.get("discount_fixed", 0) if discount_type == "Fixed Amount" else 0,
+        "loyalty": loyalty_tier.discount if loyalty_tier and state.get("apply_loyalty", True) else 0,
+    }
+
+discounts = selected_discounts()
+bill_quote = bill.totals(discounts)
+
 # Main content area
+profiler.section("order_summary")
 col1, col2 = st.columns([2, 1])
 
 with col1:
     st.subheader("🧾 Order Summary")
+    if st.session_state.pop("tab_conflict", False):
+        st.warning("⚠️ This order was changed on another terminal, please review it and try again")
     
-    if st.session_state.orders:
-        # Create enhanced dataframe
-        df = pd.DataFrame(st.session_state.orders)
-        
-        # Add row numbers
-        df.index = range(1, len(df) + 1)
-        
-        # Display order table with better formatting
-        display_df = df[['timestamp', 'category', 'item', 'quantity', 'price', 'total', 'instructions']]
-        display_df.columns = ['Time', 'Category', 'Item', 'Qty', 'Price (₹)', 'Total (₹)', 'Instructions']
-        
-        st.dataframe(display_df, use_container_width=True)
-        
-        # Order statistics
-        total_items = df['quantity'].sum()
-        total_bill = df['total'].sum()
-        avg_item_price = df['price'].mean()
-        
-        # Calculate discounts
-        discount_amount = 0
-        if st.session_state.discounts["percentage"] > 0:
-            discount_amount += total_bill * (st.session_state.discounts["percentage"] / 100)
-        if st.session_state.discounts["fixed"] > 0:
-            discount_amount += st.session_state.discounts["fixed"]
+    if bill:
+        # Display order table with better formatting; long tabs are shown a page at a time
+        line_pages = -(-len(bill.lines) // LINES_PER_PAGE)
+        line_page = 1
+        if line_pages > 1:
+            # Unkeyed, so it starts again on the newest page whenever the page count changes
+            line_page = st.number_input(f"Page (of {line_pages})", min_value=1, max_value=line_pages,
+                                        value=line_pages)
+        first_line = (line_page - 1) * LINES_PER_PAGE
+        st.dataframe(bill.to_dataframe(first_line, first_line + LINES_PER_PAGE), use_container_width=True)
         
-        # Calculate taxes
-        tax_rate = 0.18  # 18% GST
-        tax_amount = (total_bill - discount_amount) * tax_rate
-        final_total = total_bill - discount_amount + tax_amount
+        # Bill figures come from the aggregates kept up to date on every add/pop
+        total_items = bill.item_count
+        discount_label = describe_discount(discounts)
         
         # Display bill details
         st.markdown(f"""
@@ -334,20 +240,20 @@ with col1:
             <h2>💰 Bill Summary</h2>
             <div style="display: flex; justify-content: space-between; margin: 1rem 0;">
                 <span>Subtotal ({total_items} items):</span>
-                <span>₹{total_bill:.2f}</span>
+                <span>₹{format_rupees(bill_quote.subtotal)}</span>
             </div>
             <div style="display: flex; justify-content: space-between; margin: 1rem 0;">
-                <span>Discount:</span>
-                <span>-₹{discount_amount:.2f}</span>
+                <span>Discount{f" ({discount_label})" if discount_label else ""}:</span>
+                <span>-₹{format_rupees(bill_quote.discount)}</span>
             </div>
             <div style="display: flex; justify-content: space-between; margin: 1rem 0;">
-                <span>Tax (18% GST):</span>
-                <span>₹{tax_amount:.2f}</span>
+                <span>Tax ({tax_label(bill_quote)}):</span>
+                <span>₹{format_rupees(bill_quote.tax)}</span>
             </div>
             <hr style="border: 1px solid white; margin: 1rem 0;">
             <div style="display: flex; justify-content: space-between; font-size: 1.5rem; font-weight: bold;">
                 <span>Final Total:</span>
-                <span>₹{final_total:.2f}</span>
+                <span>₹{format_rupees(bill_quote.total)}</span>
             </div>
         </div>
         """, unsafe_allow_html=True)
@@ -357,18 +263,28 @@ with col1:
         
         with col1_btn:
             if st.button("🗑️ Clear Last Item"):
-                if st.session_state.orders:
-                    st.session_state.orders.pop()
-                    st.rerun()
+                # Only if the order is still the one on screen, so a line added elsewhere isn't removed
+                try:
+                    with tables.edit(table_number, expected_version=tab_version) as tab:
+                        if tab.bill:
+                            tab.bill.pop()
+                except ConflictError:
+                    st.session_state.tab_conflict = True
+                st.rerun()
         
         with col2_btn:
             if st.button("🔄 Clear All Orders"):
-                st.session_state.orders = []
+                try:
+                    with tables.edit(table_number, expected_version=tab_version) as tab:
+                        tab.bill.clear()
+                except ConflictError:
+                    st.session_state.tab_conflict = True
                 st.rerun()
         
         with col3_btn:
             if st.button("📊 View Analytics"):
                 st.session_state.show_analytics = True
+                st.rerun()
     else:
         st.markdown("""
         <div class="notification">
@@ -377,16 +293,15 @@ with col1:
         </div>
         """, unsafe_allow_html=True)
 
+profiler.section("quick_stats")
 with col2:
     st.subheader("📈 Quick Stats")
     
-    if st.session_state.orders:
-        df = pd.DataFrame(st.session_state.orders)
-        
+    if bill:
         # Statistics cards
-        total_items = df['quantity'].sum()
-        total_value = df['total'].sum()
-        avg_price = df['price'].mean()
+        total_items = bill.item_count
+        total_value = to_rupees(bill.subtotal)
+        avg_price = to_rupees(bill.average_price)
         
         st.markdown(f"""
         <div class="stats-card">
@@ -409,19 +324,16 @@ with col2:
         </div>
         """, unsafe_allow_html=True)
         
-        # Order composition chart
-        category_counts = df.groupby('category')['quantity'].sum().reset_index()
-        if not category_counts.empty:
-            fig = px.pie(category_counts, values='quantity', names='category',
-                        title='Order Composition',
-                        color_discrete_sequence=px.colors.qualitative.Set3)
-            fig.update_layout(height=300)
+        # Order composition chart, rebuilt only when the category split changes
+        if bill.category_quantities:
+            fig = charts.order_composition(tuple(sorted(bill.category_quantities.items())))
             st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("📊 Stats will appear once you add items to your order")
 
 # Payment and Discount Section
-if st.session_state.orders:
+profiler.section("payment_discounts")
+if bill:
     st.subheader("💳 Payment & Discounts")
     
     col1, col2 = st.columns(2)
@@ -429,8 +341,7 @@ if st.session_state.orders:
     with col1:
         st.markdown('<div class="payment-card"><h3>💳 Payment Options</h3></div>', unsafe_allow_html=True)
         
-        payment_methods = ["💵 Cash", "💳 Card", "📱 UPI", "💰 Digital Wallet"]
-        st.session_state.payment_mode = st.selectbox("Choose Payment Method", payment_methods)
+        st.session_state.payment_mode = st.selectbox("Choose Payment Method", PAYMENT_MODES)
         
         # Special notes
         customer_note = st.text_area("📝 Special Notes", 
@@ -439,117 +350,349 @@ if st.session_state.orders:
     with col2:
         st.markdown('<div class="payment-card"><h3>🏷️ Discounts</h3></div>', unsafe_allow_html=True)
         
-        discount_type = st.selectbox("Discount Type", ["None", "Percentage", "Fixed Amount"])
+        discount_type = st.selectbox("Discount Type", ["None", "Percentage", "Fixed Amount"], key="discount_type")
         
         if discount_type == "Percentage":
-            discount_value = st.slider("Discount Percentage", 0, 50, 0)
-            st.session_state.discounts = {"percentage": discount_value, "fixed": 0}
+            st.slider("Discount Percentage", 0, 50, 0, key="discount_percentage")
         elif discount_type == "Fixed Amount":
-            discount_value = st.number_input("Discount Amount (₹)", min_value=0, value=0)
-            st.session_state.discounts = {"percentage": 0, "fixed": discount_value}
-        else:
-            st.session_state.discounts = {"percentage": 0, "fixed": 0}
+            st.number_input("Discount Amount (₹)", min_value=0, value=0, key="discount_fixed")
         
-        # Loyalty program
-        is_member = st.checkbox("🏆 Loyalty Member")
-        if is_member:
-            st.success("5% loyalty discount applied!")
-            st.session_state.discounts["percentage"] += 5
+        # Loyalty discount from the customer's tier, stacked on top of any other discount
+        if loyalty_tier is not None:
+            if st.toggle(f"🏆 {loyalty_tier.name} member: {loyalty_tier.discount:g}% off", value=True,
+                         key="apply_loyalty"):
+                st.success(f"{loyalty_tier.discount:g}% loyalty discount applied!")
+        else:
+            st.caption("🏆 Loyalty discounts apply to returning customers; enter their phone number")
+
+# Runs on a task worker: records the bill and closes the table, then queues the SMS receipt
+def generate_bill(table, key, bill_data, phone):
+    bill_id = tables.close(table, key, lambda: ledger.append(bill_data))
+    if bill_id is None:
+        # Already billed by an earlier click, or changed on another terminal
+        bill_id = ledger.bill_id_for(key)
+        if bill_id is None:
+            raise PermanentError("This order was changed on another terminal, please review it and try again")
+        return {"bill_id": bill_id, "receipt_task": None}
+    
+    receipt_task = None
+    if phone:
+        try:
+            receipt_task = task_runner.submit("sms_receipt", send_receipt, resources.receipts, ledger,
+                                              bill_id, phone).id
+        except queue.Full:
+            pass
+    return {"bill_id": bill_id, "receipt_task": receipt_task}
+
+# Polls the bill task this terminal queued and reloads the page once the table is closed
+@st.fragment(run_every="1s")
+def bill_progress():
+    pending = st.session_state.pending_bill
+    if pending is None:
+        return
+    task = task_runner.get(pending["task"])
+    if task is None or task.status == FAILED:
+        st.session_state.bill_error = task.error if task is not None else "the task was lost"
+        st.session_state.pending_bill = None
+        st.rerun()
+    elif task.status == DONE:
+        st.session_state.last_bill = {"table": pending["table"], "id": task.result["bill_id"],
+                                      "receipt_task": task.result["receipt_task"], "new": True}
+        st.session_state.pending_bill = None
+        st.rerun()
+    else:
+        retrying = " (retrying)" if task.status == RETRYING or task.attempts > 1 else ""
+        st.info(f"⏳ Generating bill...{retrying}")
+
+@st.fragment(run_every="2s")
+def receipt_status(task_id):
+    task = task_runner.get(task_id)
+    if task is not None:
+        st.caption(f"📱 SMS receipt: {task.status}" + (f" ({task.error})" if task.error else ""))
 
 # Final Actions
-if st.session_state.orders:
+profiler.section("final_actions")
+if st.session_state.get("bill_error"):
+    st.error(f"⚠️ Bill could not be generated: {st.session_state.pop('bill_error')}")
+
+if bill:
     st.subheader("✅ Final Actions")
     
+    # The same bill record feeds the sales ledger and the downloaded bill. It is only
+    # built when one of them needs it, since that is when order lines get expanded.
+    now = datetime.now()
+    customer_info = dict(st.session_state.customer_info)
+    payment_mode = st.session_state.payment_mode
+    
+    def make_bill_data(bill_key=None):
+        return {
+            "date": now.strftime("%Y-%m-%d"),
+            "time": now.strftime("%H:%M:%S"),
+            "customer": customer_info,
+            "orders": bill.line_dicts(),
+            "payment_mode": payment_mode,
+            "subtotal": to_rupees(bill_quote.subtotal),
+            "total_amount": to_rupees(bill_quote.total),
+            "discount": discounts,
+            "notes": customer_note,
+            "opened_at": opened_at,
+            "bill_key": bill_key
+        }
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        # Generate bill
+        # Generate bill: queued for a task worker, which records it in the sales ledger and
+        # closes the table in one step. The bill is keyed on the order's content, so
+        # repeated clicks can't bill it twice.
         if st.button("🧾 Generate Bill", type="primary"):
-            # Add to daily sales
-            bill_data = {
-                "date": datetime.now().strftime("%Y-%m-%d"),
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "customer": st.session_state.customer_info,
-                "orders": st.session_state.orders,
-                "payment_mode": st.session_state.payment_mode,
-                "total_amount": sum(order['total'] for order in st.session_state.orders),
-                "discount": st.session_state.discounts,
-                "notes": customer_note
-            }
-            st.session_state.daily_sales.append(bill_data)
-            
-            st.success("✅ Bill generated successfully!")
-            st.balloons()
+            key = bill.content_key(table_number, opened_at)
+            try:
+                task = task_runner.submit("generate_bill", generate_bill, table_number, key,
+                                          make_bill_data(key), customer_info.get("phone"))
+            except queue.Full:
+                st.warning("⚠️ Too much work is queued, please try again shortly")
+            else:
+                st.session_state.pending_bill = {"task": task.id, "table": table_number}
     
     with col2:
-        # Download detailed bill
-        if st.session_state.orders:
-            df = pd.DataFrame(st.session_state.orders)
-            
-            # Create detailed bill
-            detailed_bill = f"""
-            SMART RESTAURANT BILLING SYSTEM
-            ================================
-            Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-            Customer: {st.session_state.customer_info.get('name', 'Walk-in')}
-            Table: {st.session_state.customer_info.get('table', 'N/A')}
-            Phone: {st.session_state.customer_info.get('phone', 'N/A')}
-            
-            ORDER DETAILS:
-            ==============
-            """
-            
-            for order in st.session_state.orders:
-                detailed_bill += f"{order['item']} x {order['quantity']} = ₹{order['total']}\n"
-            
-            detailed_bill += f"""
-            
-            BILL SUMMARY:
-            =============
-            Subtotal: ₹{sum(order['total'] for order in st.session_state.orders):.2f}
-            Discount: ₹{st.session_state.discounts['percentage'] + st.session_state.discounts['fixed']:.2f}
-            Tax (18%): ₹{(sum(order['total'] for order in st.session_state.orders) * 0.18):.2f}
-            
-            Payment Mode: {st.session_state.payment_mode}
-            
-            Thank you for dining with us!
-            """
-            
-            st.download_button(
-                label="💾 Download Bill",
-                data=detailed_bill,
-                file_name=f"bill_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain"
-            )
+        # Download detailed bill, rendered only when the button is actually clicked
+        st.download_button(
+            label="💾 Download Bill",
+            data=lambda: render_bill_text(make_bill_data()),
+            file_name=f"bill_{now.strftime('%Y%m%d_%H%M%S')}.txt",
+            mime="text/plain"
+        )
     
     with col3:
-        # Print order (simulation)
+        # Send lines not yet printed to the kitchen stations as KOTs
         if st.button("🖨️ Print Order"):
-            st.info("📄 Order sent to kitchen printer!")
+            # Claim the unprinted lines first, so two terminals never print the same lines
+            def claim_new_lines(tab):
+                start = tab.kot_cursor
+                tab.kot_cursor = len(tab.bill)
+                return start, tab.bill.line_dicts(start)
+
+            kot_start, new_lines = tables.update(table_number, claim_new_lines)
+            try:
+                tickets = kitchen.submit(table_number, new_lines) if new_lines else []
+            except queue.Full:
+                # Hand the lines back so the next Print Order sends them
+                def release_lines(tab):
+                    tab.kot_cursor = min(tab.kot_cursor, kot_start)
+
+                tables.update(table_number, release_lines)
+                tickets = None
+            
+            if tickets is None:
+                st.warning("⚠️ Kitchen queue is full, please try again shortly")
+            elif tickets:
+                stations = ", ".join(ticket.station for ticket in tickets)
+                st.info(f"📄 Order sent to kitchen printer! ({stations})")
+            else:
+                st.info("📄 All items have already been sent to the kitchen")
+        
+        kot_metrics = kitchen.metrics()
+        st.caption(f"🍳 KOT queue: {kot_metrics['queue_depth']} waiting · "
+                   f"{kot_metrics['sent']} sent · {kot_metrics['failed']} failed · "
+                   f"p95 dispatch {kot_metrics['latency_p95'] * 1000:.0f} ms")
+elif st.session_state.get("last_bill", {}).get("table") == table_number:
+    # The table was just billed and closed; the bill can still be downloaded from the ledger
+    last_bill_id = st.session_state.last_bill["id"]
+    st.success(f"✅ Bill #{last_bill_id} generated successfully!")
+    if st.session_state.last_bill.pop("new", False):
+        st.balloons()
+    if st.session_state.last_bill["receipt_task"] is not None:
+        receipt_status(st.session_state.last_bill["receipt_task"])
+    st.download_button(
+        label="💾 Download Bill",
+        data=lambda: render_bill_text(ledger.bill(last_bill_id)),
+        file_name=f"bill_{last_bill_id}.txt",
+        mime="text/plain"
+    )
+
+if (st.session_state.pending_bill or {}).get("table") == table_number:
+    bill_progress()
+
+# Bill history, read from the ledger one page at a time
+def turn_history_page(step, cursor=None):
+    if step > 0:
+        st.session_state.history_cursors.append(cursor)
+    else:
+        st.session_state.history_cursors.pop()
+
 
-# Analytics Dashboard
-if st.session_state.daily_sales:
-    st.subheader("📊 Analytics Dashboard")
+def bill_history(start_day, end_day):
+    filter_cols = st.columns(4)
+    with filter_cols[0]:
+        table_filter = st.number_input("Table (0 = all)", min_value=0, max_value=MAX_TABLES, value=0)
+    with filter_cols[1]:
+        mode_filter = st.selectbox("Payment", ["All"] + PAYMENT_MODES)
+    with filter_cols[2]:
+        # Numbers typed with spaces or a +91 prefix match the same bills
+        phone_filter = phone_key(st.text_input("Customer Phone").strip())
+    with filter_cols[3]:
+        sort = st.selectbox("Sort", list(BILL_SORTS))
+    filters = BillFilter(start_day, end_day, table_filter or None,
+                         None if mode_filter == "All" else mode_filter, phone_filter or None)
+
+    # Cursors of the pages visited so far; a new query starts again from page 1
+    if st.session_state.get("history_query") != (filters, sort):
+        st.session_state.history_query = (filters, sort)
+        st.session_state.history_cursors = [None]
+    cursors = st.session_state.history_cursors
+    rows, next_cursor = ledger.bill_page(filters, sort, cursors[-1], HISTORY_PAGE_SIZE)
+    total = ledger.count_bills(filters)
+
+    if not rows:
+        st.info("No bills match these filters")
+        return
+    st.dataframe(
+        [{"Bill #": row["id"], "Date": row["date"], "Time": row["time"][:5], "Table": row["table_no"],
+          "Customer": row["customer_name"] or "", "Phone": row["phone"] or "", "Payment": row["payment_mode"],
+          "Total (₹)": row["total_amount"]} for row in rows],
+        hide_index=True, use_container_width=True
+    )
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        st.button("◀ Previous", disabled=len(cursors) == 1, on_click=turn_history_page, args=(-1,))
+    with page_col:
+        st.caption(f"Page {len(cursors)} of {max(1, -(-total // HISTORY_PAGE_SIZE))} · {total} bills")
+    with next_col:
+        st.button("Next ▶", disabled=next_cursor is None, on_click=turn_history_page, args=(1, next_cursor))
+
+    # Lines are only read for the one bill opened
+    bill_id = st.selectbox("Open Bill", [row["id"] for row in rows], format_func=lambda bill_id: f"#{bill_id}")
+    opened = ledger.bill(bill_id)
+    st.dataframe(
+        [{"Item": line["item"], "Qty": line["quantity"], "Price (₹)": line["price"], "Total (₹)": line["total"],
+          "Instructions": line["instructions"] or ""} for line in opened["orders"]],
+        hide_index=True, use_container_width=True
+    )
+    st.download_button(f"📄 Download Bill #{bill_id}", data=lambda: render_bill_text(opened),
+                       file_name=f"bill_{bill_id}.txt", mime="text/plain", key="history_download")
+
+# Analytics Dashboard, only built once someone asks for it. It runs as a fragment so
+# changing the date range or view doesn't rerun the rest of the page.
+@st.fragment
+@metrics.profiled("analytics_dashboard")
+def analytics_dashboard():
+    header_col, hide_col = st.columns([4, 1])
+    with header_col:
+        st.subheader("📊 Analytics Dashboard")
+    with hide_col:
+        if st.button("✖️ Hide Analytics"):
+            st.session_state.show_analytics = False
+            st.rerun()
     
-    # Create analytics from daily sales
-    sales_df = pd.DataFrame(st.session_state.daily_sales)
+    # Only the rollups for the selected date range are read
+    first_day, last_day = (date.fromisoformat(d) for d in ledger.date_span())
+    last_day = max(last_day, date.today())
+    date_range = st.date_input(
+        "Date Range",
+        value=(max(first_day, last_day - timedelta(days=6)), last_day),
+        min_value=first_day,
+        max_value=last_day
+    )
+    start_day, end_day = date_range if len(date_range) == 2 else (date_range[0], date_range[0])
     
-    col1, col2 = st.columns(2)
+    # Only the selected view is queried and drawn
+    view = st.segmented_control("View", ["📈 Overview", "🍛 Items", "🕒 Busy Hours", "🔮 Prep List",
+                                         "🧾 Bill History", "📦 Export"],
+                                default="📈 Overview", key="analytics_view") or "📈 Overview"
     
-    with col1:
-        # Daily sales chart
-        daily_totals = sales_df.groupby('date')['total_amount'].sum().reset_index()
-        fig = px.bar(daily_totals, x='date', y='total_amount',
-                    title='Daily Sales Revenue',
-                    labels={'total_amount': 'Revenue (₹)', 'date': 'Date'})
-        st.plotly_chart(fig, use_container_width=True)
+    analytics = ledger.analytics
+    if view == "🔮 Prep List":
+        # Forecast from the same weekday over recent weeks, not from the date range
+        service_day = st.date_input("Service Day", value=date.today(), min_value=date.today(), key="prep_day")
+        from_hour = datetime.now().hour if service_day == date.today() else 0
+        prep_rows = forecaster.prep_list(service_day, from_hour)
+        if not prep_rows:
+            st.info(f"No sales history for {service_day:%A}s yet")
+            return
+        st.caption(f"Expected demand from {from_hour:02d}:00, based on the last "
+                   f"{len(forecaster.forecast(service_day).basis)} {service_day:%A}s (recent weeks weigh more)")
+        station_cols = st.columns(len(STATIONS))
+        for col, (station, portions) in zip(station_cols, forecaster.station_totals(prep_rows).items()):
+            col.metric(f"{station.title()} portions", portions)
+        if service_day == date.today():
+            sold = forecaster.sold()
+            for prep_row in prep_rows:
+                prep_row["sold_today"] = sold.get(prep_row["item"], 0)
+        st.dataframe(prep_rows, hide_index=True, use_container_width=True)
+        return
     
-    with col2:
-        # Payment mode distribution
-        payment_counts = sales_df['payment_mode'].value_counts().reset_index()
-        fig = px.pie(payment_counts, values='count', names='payment_mode',
-                    title='Payment Mode Distribution')
-        st.plotly_chart(fig, use_container_width=True)
+    daily_totals = analytics.daily_revenue(start_day, end_day)
+    if daily_totals.empty:
+        st.info("No bills in the selected date range")
+        return
+    
+    if view == "📈 Overview":
+        col1, col2 = st.columns(2)
+        with col1:
+            # Daily sales chart
+            st.plotly_chart(charts.daily_revenue(charts.frozen(daily_totals)), use_container_width=True)
+        with col2:
+            # Payment mode distribution
+            payment_counts = analytics.payment_modes(start_day, end_day)
+            st.plotly_chart(charts.payment_modes(charts.frozen(payment_counts)), use_container_width=True)
+    
+    elif view == "🍛 Items":
+        col1, col2 = st.columns(2)
+        with col1:
+            # Best sellers
+            top_items = analytics.top_items(start_day, end_day)
+            st.plotly_chart(charts.top_items(charts.frozen(top_items)), use_container_width=True)
+        with col2:
+            # Veg / non-veg split
+            veg_split = analytics.veg_split(start_day, end_day)
+            st.plotly_chart(charts.veg_split(charts.frozen(veg_split)), use_container_width=True)
+        # Ingredients the items sold in the range went through, from their recipes
+        used = inventory.consumption(start_day, end_day)
+        if used:
+            st.dataframe(
+                [{"Ingredient": name, "Used": round(quantity, 1), "Unit": inventory.units[name]}
+                 for name, quantity in sorted(used.items(), key=lambda entry: -entry[1])],
+                hide_index=True, use_container_width=True
+            )
+    
+    elif view == "🕒 Busy Hours":
+        heatmap = analytics.hourly_heatmap(start_day, end_day)
+        st.plotly_chart(charts.hourly_heatmap(*charts.heatmap_key(heatmap)), use_container_width=True)
+    
+    elif view == "🧾 Bill History":
+        bill_history(start_day, end_day)
+    
+    else:
+        # End-of-day export of every bill in the range, streamed from the ledger on click
+        export_col, format_col = st.columns([3, 1])
+        with format_col:
+            export_format = st.selectbox("Export Format", list(EXPORT_FORMATS), format_func=str.upper)
+        with export_col:
+            st.download_button(
+                label=f"📦 Export Bills ({start_day} to {end_day})",
+                data=lambda: export_to_tempfile(ledger.iter_bills(start_day, end_day), export_format),
+                file_name=f"bills_{start_day}_{end_day}.{export_format}",
+                mime=EXPORT_FORMATS[export_format]
+            )
+        # Day-end reconciliation, built in one streaming pass over the same bills
+        st.download_button(
+            label=f"🧮 Day-End Reports ({start_day} to {end_day})",
+            data=lambda: reports_to_tempfile(reconcile(ledger.iter_bills(start_day, end_day))),
+            file_name=f"reports_{start_day}_{end_day}.zip",
+            mime=EXPORT_FORMATS["zip"]
+        )
+
+profiler.section("analytics_dashboard")
+if ledger.has_sales():
+    if st.session_state.show_analytics:
+        analytics_dashboard()
+    elif not bill:
+        if st.button("📊 View Analytics", key="open_analytics"):
+            st.session_state.show_analytics = True
+            st.rerun()
+
+profiler.end_section()
 
 # Footer
 st.markdown("""
@@ -558,4 +701,53 @@ st.markdown("""
     <p>Streamlining your restaurant operations with modern technology</p>
     <p>Made with ❤️ for restaurant efficiency</p>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+# Startup / rerun timing report
+st.caption(timing_report(resources, record_rerun(resources, rerun_started)))
+profiler.finish(st.session_state)
+
+# Stock alerts and deliveries
+low_stock = inventory.low_stock()
+with st.sidebar.expander(f"📦 Inventory ({len(low_stock)} low)"):
+    for row in low_stock:
+        st.warning(f"{row['ingredient'].title()}: {row['quantity']:g} {row['unit']} left "
+                   f"(reorder at {row['reorder_level']:g})")
+    ingredient = st.selectbox("Ingredient", inventory.matrix.ingredients, key="restock_ingredient")
+    received = st.number_input(f"Received ({inventory.units[ingredient]})", min_value=0.0, step=100.0,
+                               key="restock_quantity")
+    if st.button("📥 Record Delivery", disabled=not received):
+        inventory.receive(ingredient, received)
+        st.success(f"✅ {ingredient.title()} now at {inventory.level(ingredient):g} {inventory.units[ingredient]}")
+
+# Admin performance panel
+def set_profiling():
+    metrics.enabled = st.session_state.profiling_enabled
+
+with st.sidebar.expander("🛠️ Performance (admin)"):
+    # The switch is server-wide, so show its current state rather than this session's last click
+    st.session_state.profiling_enabled = metrics.enabled
+    st.toggle("Profile reruns", key="profiling_enabled", on_change=set_profiling,
+              help="Shared by every terminal on this server")
+    st.caption(f"📋 Menu version {catalog.version} · {len(catalog)} items")
+    task_metrics = task_runner.metrics()
+    st.caption(f"🧵 Background tasks: {task_metrics['queue_depth']} waiting · {task_metrics['done']} done · "
+               f"{task_metrics['retried']} retried · {task_metrics['failed']} failed")
+    section_stats = metrics.summary()
+    if section_stats:
+        st.dataframe(
+            [{"Section": name, "Runs": stats["runs"], "p50 (ms)": round(stats["p50_ms"], 1),
+              "p95 (ms)": round(stats["p95_ms"], 1), "Max (ms)": round(stats["max_ms"], 1)}
+             for name, stats in sorted(section_stats.items())],
+            hide_index=True, use_container_width=True
+        )
+        event_counts, state_bytes = metrics.counters()
+        st.caption(" · ".join(f"{kind}: {value}" for kind, value in sorted(event_counts.items()))
+                   + (f" · session state {state_bytes / 1024:.1f} KiB" if state_bytes is not None else ""))
+        st.download_button("⬇️ Prometheus metrics", data=metrics.prometheus, file_name="metrics.prom",
+                           mime="text/plain")
+        if st.button("💾 Write metrics files"):
+            metrics.flush()
+            st.success(f"Written to {metrics.jsonl_path}")
+    else:
+        st.caption("Switch on profiling to collect per-section rerun timings.")
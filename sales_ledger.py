@@ -0,0 +1,527 @@
+"""Durable, append-only sales ledger backed by SQLite."""
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from analytics_store import AnalyticsStore
+from config import DATA_DIR
+from customers import normalize_phone
+from pricing import line_rate
+
+DEFAULT_DB_PATH = os.path.join(DATA_DIR, "sales.db")
+
+# Money columns hold rupees as ``pricing.to_rupees`` gives them for whole paise. A
+# float of that form always reads back to the same paise through ``pricing.to_paise``,
+# so REAL keeps existing ledgers, exports and rollups in rupees without losing a paisa.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    table_no INTEGER,
+    customer_name TEXT,
+    phone TEXT,
+    payment_mode TEXT,
+    subtotal REAL NOT NULL,
+    discount_pct REAL NOT NULL DEFAULT 0,
+    discount_fixed REAL NOT NULL DEFAULT 0,
+    total_amount REAL NOT NULL,
+    notes TEXT,
+    discount_loyalty REAL NOT NULL DEFAULT 0,
+    opened_at REAL,
+    bill_key TEXT,
+    phone_key TEXT
+);
+CREATE INDEX IF NOT EXISTS bills_by_date ON bills (date);
+CREATE INDEX IF NOT EXISTS bills_by_payment_mode ON bills (payment_mode, date);
+CREATE INDEX IF NOT EXISTS bills_by_table ON bills (table_no, date);
+CREATE INDEX IF NOT EXISTS bills_by_total ON bills (total_amount, id);
+
+-- Item descriptions are stored once; bill lines only reference them
+CREATE TABLE IF NOT EXISTS line_items (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    item_type TEXT NOT NULL,
+    UNIQUE (name, category, item_type)
+);
+
+CREATE TABLE IF NOT EXISTS bill_lines (
+    bill_id INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL NOT NULL,
+    time TEXT,
+    instructions TEXT,
+    menu_version INTEGER,
+    gst_bp INTEGER NOT NULL DEFAULT 1800,
+    PRIMARY KEY (bill_id, line_no)
+) WITHOUT ROWID;
+"""
+
+BILL_COLUMNS = [
+    "id", "date", "time", "table_no", "customer_name", "phone",
+    "payment_mode", "subtotal", "discount_pct", "discount_fixed",
+    "total_amount", "notes", "discount_loyalty", "opened_at", "bill_key",
+]
+
+# Columns added after the first release, with their definitions
+MIGRATIONS = {
+    "bills": {
+        "discount_loyalty": "REAL NOT NULL DEFAULT 0",
+        # Epoch seconds when the table's tab was opened, for table turnover
+        "opened_at": "REAL",
+        # Idempotency key of the tab the bill closed; generating it twice must not record it twice
+        "bill_key": "TEXT",
+        # ``customers.normalize_phone`` of the phone, so differently typed numbers filter alike
+        "phone_key": "TEXT",
+    },
+    "bill_lines": {
+        # Menu catalog version the line was priced from
+        "menu_version": "INTEGER",
+        # GST rate the line was charged at; lines billed before slabs were all taxed at 18%
+        "gst_bp": "INTEGER NOT NULL DEFAULT 1800",
+    },
+}
+
+# Bill history filters; fields left as None don't filter. Dates are inclusive.
+BillFilter = namedtuple("BillFilter", ["start", "end", "table", "payment_mode", "phone"], defaults=(None,) * 5)
+
+# Bill history orderings: key columns (ending in the unique id) and whether they descend.
+# Date order follows the (filter column, date) indexes, so filtered pages come straight off an index.
+BILL_SORTS = {
+    "Newest first": (("date", "id"), True),
+    "Oldest first": (("date", "id"), False),
+    "Highest total": (("total_amount", "id"), True),
+    "Lowest total": (("total_amount", "id"), False),
+}
+
+HISTORY_COLUMNS = ["id", "date", "time", "table_no", "customer_name", "phone", "payment_mode", "total_amount"]
+
+
+def phone_key(phone):
+    """What a phone filter matches on: the normalised number, or the text as typed if it isn't one."""
+    return normalize_phone(phone) or phone
+
+
+def filter_clauses(filters):
+    """SQL conditions and parameters selecting the bills that match ``filters``."""
+    clauses, params = [], []
+    if filters.start is not None:
+        clauses.append("date >= ?")
+        params.append(str(filters.start))
+    if filters.end is not None:
+        clauses.append("date <= ?")
+        params.append(str(filters.end))
+    for column, value in (("table_no", filters.table), ("payment_mode", filters.payment_mode),
+                          ("phone_key", filters.phone and phone_key(filters.phone))):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    return clauses, params
+
+
+def filter_matches(filters, bill_data):
+    customer = bill_data.get("customer", {})
+    return ((filters.start is None or bill_data["date"] >= str(filters.start))
+            and (filters.end is None or bill_data["date"] <= str(filters.end))
+            and (filters.table is None or customer.get("table") == filters.table)
+            and (filters.payment_mode is None or bill_data.get("payment_mode") == filters.payment_mode)
+            and (filters.phone is None or normalize_phone(customer.get("phone")) == phone_key(filters.phone)))
+
+
+def bill_from_row(row, lines):
+    return {
+        "id": row["id"],
+        "date": row["date"],
+        "time": row["time"],
+        "customer": {"name": row["customer_name"] or "", "table": row["table_no"], "phone": row["phone"] or ""},
+        "orders": lines,
+        "payment_mode": row["payment_mode"],
+        "subtotal": row["subtotal"],
+        "total_amount": row["total_amount"],
+        "discount": {
+            "percentage": row["discount_pct"], "fixed": row["discount_fixed"], "loyalty": row["discount_loyalty"],
+        },
+        "notes": row["notes"] or "",
+        "opened_at": row["opened_at"],
+        "bill_key": row["bill_key"],
+    }
+
+
+class SalesLedger:
+    """Append-only store of generated bills.
+
+    Writes go through a single connection in WAL mode. ``batch_size`` and
+    ``max_delay`` control how many bills may share one commit, and
+    ``synchronous`` sets how hard SQLite fsyncs that commit: the defaults
+    commit and fully sync every bill. A partly filled batch is committed by
+    the first append after ``max_delay`` seconds, by ``flush()`` or at exit.
+
+    A bill carrying a ``bill_key`` is recorded at most once. Recent keys are
+    held in a bounded in-memory index (``key_cache_size`` entries) in front
+    of a unique index on the column, so a repeat append is a dict lookup.
+
+    Bill history is read a page at a time with keyset pagination. The
+    matching-bill count for each recently used filter is cached and bumped
+    as matching bills are appended, so it is counted once per filter.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, batch_size=1, max_delay=2.0, synchronous="FULL",
+                 key_cache_size=10000):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._item_ids = {}
+        self._new_item_keys = []
+        self._bill_ids = OrderedDict()
+        self._key_cache_size = key_cache_size
+        self._pending = 0
+        self._batch_started = None
+        self._listeners = []
+        self._stores = []
+        # Callbacks waiting for the open transaction to commit, and how many came before this bill
+        self._after_commit = []
+        self._bill_callbacks = 0
+        self._counts = OrderedDict()
+        self._counted_upto = None
+        self.analytics = AnalyticsStore(self._conn, self._lock)
+        if self.has_sales():
+            if self.analytics.is_empty():
+                self._backfill_rollups(self.analytics.record)
+            elif self.analytics.is_empty("item_hourly_sales"):
+                self._backfill_rollups(self.analytics.record_item_hours)
+        atexit.register(self.close)
+
+    # Writes
+
+    def append(self, bill_data):
+        """Record a bill and return its id.
+
+        If a bill with the same ``bill_key`` is already recorded, nothing is
+        written and that bill's id is returned instead.
+        """
+        customer = bill_data.get("customer", {})
+        discount = bill_data.get("discount", {})
+        key = bill_data.get("bill_key")
+        with self._lock:
+            if key is not None:
+                existing = self.bill_id_for(key)
+                if existing is not None:
+                    return existing
+            if not self._pending:
+                self._conn.execute("BEGIN")
+                self._batch_started = time.monotonic()
+            # A failed bill only undoes itself, not the others waiting in the batch
+            self._conn.execute("SAVEPOINT bill")
+            self._bill_callbacks = len(self._after_commit)
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO bills (date, time, table_no, customer_name, phone, payment_mode, subtotal,"
+                    " discount_pct, discount_fixed, total_amount, notes, discount_loyalty, opened_at, bill_key,"
+                    " phone_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        bill_data["date"], bill_data["time"], customer.get("table"),
+                        customer.get("name") or None, customer.get("phone") or None,
+                        bill_data.get("payment_mode"), bill_data.get("subtotal", bill_data["total_amount"]),
+                        discount.get("percentage", 0), discount.get("fixed", 0),
+                        bill_data["total_amount"], bill_data.get("notes") or None,
+                        discount.get("loyalty", 0), bill_data.get("opened_at"), key,
+                        normalize_phone(customer.get("phone")),
+                    ),
+                )
+                bill_id = cursor.lastrowid
+                self._conn.executemany(
+                    "INSERT INTO bill_lines (bill_id, line_no, item_id, quantity, price, time, instructions,"
+                    " menu_version, gst_bp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (bill_id, line_no, self._item_id(line), line["quantity"], line["price"],
+                         line.get("timestamp"), line.get("instructions") or None, line.get("menu_version"),
+                         line_rate(line))
+                        for line_no, line in enumerate(bill_data["orders"], 1)
+                    ],
+                )
+                self.analytics.record(bill_data)
+                for store in self._stores:
+                    store.record(bill_data)
+            except sqlite3.IntegrityError:
+                self._rollback_bill()
+                # Another app process sharing the database recorded the same bill first
+                existing = key and self._conn.execute("SELECT id FROM bills WHERE bill_key = ?", (key,)).fetchone()
+                if not existing:
+                    raise
+                self._remember(key, existing[0])
+                return existing[0]
+            except Exception:
+                self._rollback_bill()
+                raise
+            self._conn.execute("RELEASE bill")
+            self._new_item_keys.clear()
+            if key is not None:
+                self._remember(key, bill_id)
+            for filters in self._counts:
+                if filter_matches(filters, bill_data):
+                    self._counts[filters] += 1
+            if self._counted_upto == bill_id - 1:
+                self._counted_upto = bill_id
+            self._pending += 1
+            if self._pending >= self.batch_size or time.monotonic() - self._batch_started >= self.max_delay:
+                self.flush()
+            listeners = list(self._listeners)
+        if listeners:
+            recorded = dict(bill_data, id=bill_id)
+            for listener in listeners:
+                listener(recorded)
+        return bill_id
+
+    def attach(self, factory):
+        """Build a store on this ledger's database with ``factory(conn, lock, after_commit)``.
+
+        The store's ``record(bill_data)`` runs inside each bill's savepoint,
+        like the analytics rollups, so it commits or rolls back with the bill.
+        In-memory state the store derives from a bill should be changed in a
+        callback passed to ``after_commit``, which is dropped if the bill is
+        rolled back.
+        """
+        with self._lock:
+            store = factory(self._conn, self._lock, self.after_commit)
+            self._stores.append(store)
+        return store
+
+    def after_commit(self, callback):
+        """Call ``callback()`` once the current transaction commits, or now if none is open."""
+        with self._lock:
+            if self._conn.in_transaction:
+                self._after_commit.append(callback)
+            else:
+                callback()
+
+    def subscribe(self, listener):
+        """Call ``listener(bill_data)`` after each newly recorded bill, with its ``id`` added."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def _item_id(self, line):
+        key = (line["item"], line["category"], line.get("item_type", "veg"))
+        item_id = self._item_ids.get(key)
+        if item_id is None:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO line_items (name, category, item_type) VALUES (?, ?, ?)", key
+            )
+            item_id = self._conn.execute(
+                "SELECT id FROM line_items WHERE name = ? AND category = ? AND item_type = ?", key
+            ).fetchone()[0]
+            self._item_ids[key] = item_id
+            self._new_item_keys.append(key)
+        return item_id
+
+    def _remember(self, key, bill_id):
+        self._bill_ids[key] = bill_id
+        self._bill_ids.move_to_end(key)
+        if len(self._bill_ids) > self._key_cache_size:
+            self._bill_ids.popitem(last=False)
+
+    def bill_id_for(self, key):
+        """Id of the bill recorded under ``key``, or ``None``."""
+        with self._lock:
+            bill_id = self._bill_ids.get(key)
+            if bill_id is None:
+                row = self._conn.execute("SELECT id FROM bills WHERE bill_key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                bill_id = row[0]
+            self._remember(key, bill_id)
+            return bill_id
+
+    def _migrate(self):
+        for table, added in MIGRATIONS.items():
+            columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column, definition in added.items():
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    if column == "phone_key":
+                        self._conn.create_function("normalize_phone", 1, normalize_phone, deterministic=True)
+                        self._conn.execute(
+                            "UPDATE bills SET phone_key = normalize_phone(phone) WHERE phone IS NOT NULL"
+                        )
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS bills_by_key ON bills (bill_key) WHERE bill_key IS NOT NULL"
+        )
+        # Phone filters match the normalised number; the index on the number as typed is replaced
+        self._conn.execute("DROP INDEX IF EXISTS bills_by_phone")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bills_by_phone_key ON bills (phone_key, date)")
+
+    def _backfill_rollups(self, record):
+        # Ledgers created before the rollup tables (or the newest of them) existed
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for bill in self._conn.execute("SELECT id, date, time, payment_mode, total_amount FROM bills").fetchall():
+                bill_data = dict(bill)
+                bill_data["orders"] = self.bill_lines(bill["id"])
+                record(bill_data)
+            self._conn.execute("COMMIT")
+
+    def _rollback_bill(self):
+        self._conn.execute("ROLLBACK TO bill")
+        self._conn.execute("RELEASE bill")
+        del self._after_commit[self._bill_callbacks:]
+        # Item ids interned for this bill were rolled back with it
+        for key in self._new_item_keys:
+            self._item_ids.pop(key, None)
+        self._new_item_keys.clear()
+        if not self._pending:
+            self._conn.execute("ROLLBACK")
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._conn.execute("COMMIT")
+                self._pending = 0
+            callbacks, self._after_commit = self._after_commit, []
+            for callback in callbacks:
+                callback()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self.flush()
+                self._conn.close()
+                self._conn = None
+
+    # Reads
+
+    def has_sales(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM bills LIMIT 1").fetchone() is not None
+
+    def date_span(self):
+        with self._lock:
+            return tuple(self._conn.execute("SELECT MIN(date), MAX(date) FROM bills").fetchone())
+
+    def bills_between(self, start, end):
+        """Bill headers dated ``start`` to ``end`` inclusive (ISO date strings)."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(BILL_COLUMNS)} FROM bills WHERE date BETWEEN ? AND ? ORDER BY id",
+                (str(start), str(end)),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def bill_page(self, filters=BillFilter(), sort="Newest first", after=None, limit=25):
+        """One page of bill headers and the cursor for the page after it (``None`` on the last page).
+
+        ``after`` is the cursor returned with the previous page: the sort key
+        of its last row. Each page seeks past that key instead of skipping
+        rows with OFFSET, so page 500 costs the same as page 1.
+        """
+        columns, descending = BILL_SORTS[sort]
+        clauses, params = filter_clauses(filters)
+        index = ""
+        if columns[0] == "total_amount" and clauses:
+            # SQLite has no statistics on date ranges, so it reads and sorts every bill in the
+            # range through the date index. Walking the total index instead visits about
+            # limit * bills / matching rows, which is fewer once matching^2 > limit * bills.
+            matching = self.count_bills(filters)
+            if matching * matching > limit * self.count_bills():
+                index = " INDEXED BY bills_by_total"
+        if after is not None:
+            clauses.append(f"({', '.join(columns)}) {'<' if descending else '>'} ({', '.join('?' * len(columns))})")
+            params.extend(after)
+        direction = " DESC" if descending else ""
+        sql = (f"SELECT {', '.join(HISTORY_COLUMNS)} FROM bills{index}"
+               + (" WHERE " + " AND ".join(clauses) if clauses else "")
+               + " ORDER BY " + ", ".join(column + direction for column in columns) + " LIMIT ?")
+        with self._lock:
+            rows = self._conn.execute(sql, (*params, limit + 1)).fetchall()
+        page = [dict(row) for row in rows[:limit]]
+        cursor = tuple(page[-1][column] for column in columns) if len(rows) > limit else None
+        return page, cursor
+
+    def count_bills(self, filters=BillFilter(), cache_size=64):
+        """How many bills match ``filters``."""
+        with self._lock:
+            # Bills appended by other processes sharing the database aren't in the cached counts
+            latest = self._conn.execute("SELECT MAX(id) FROM bills").fetchone()[0]
+            if latest != self._counted_upto:
+                self._counts.clear()
+                self._counted_upto = latest
+            count = self._counts.get(filters)
+            if count is None:
+                clauses, params = filter_clauses(filters)
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM bills" + (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+                ).fetchone()[0]
+                self._counts[filters] = count
+                if len(self._counts) > cache_size:
+                    self._counts.popitem(last=False)
+            else:
+                self._counts.move_to_end(filters)
+            return count
+
+    def iter_bills(self, start, end, chunk_size=500):
+        """Yield bills dated ``start`` to ``end`` with their lines, ``chunk_size`` at a time.
+
+        Bills come back in the same shape ``append`` takes, plus their ``id``.
+        Only one chunk is held in memory, so this is safe over months of sales.
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                headers = self._conn.execute(
+                    f"SELECT {', '.join(BILL_COLUMNS)} FROM bills"
+                    " WHERE date BETWEEN ? AND ? AND id > ? ORDER BY id LIMIT ?",
+                    (str(start), str(end), last_id, chunk_size),
+                ).fetchall()
+                if not headers:
+                    return
+                line_rows = self._conn.execute(
+                    "SELECT l.bill_id, i.name AS item, i.category, i.item_type, l.quantity, l.price,"
+                    " l.quantity * l.price AS total, l.time AS timestamp, l.instructions, l.menu_version, l.gst_bp"
+                    " FROM bill_lines l JOIN line_items i ON i.id = l.item_id"
+                    " WHERE l.bill_id BETWEEN ? AND ? ORDER BY l.bill_id, l.line_no",
+                    (headers[0]["id"], headers[-1]["id"]),
+                ).fetchall()
+
+            lines = {}
+            for row in line_rows:
+                line = dict(row)
+                lines.setdefault(line.pop("bill_id"), []).append(line)
+            for header in headers:
+                yield bill_from_row(header, lines.get(header["id"], []))
+            last_id = headers[-1]["id"]
+
+    def bill(self, bill_id):
+        """One bill with its lines, in the shape ``iter_bills`` yields, or ``None``."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(BILL_COLUMNS)} FROM bills WHERE id = ?", (bill_id,)
+            ).fetchone()
+        return bill_from_row(row, self.bill_lines(bill_id)) if row is not None else None
+
+    def bill_lines(self, bill_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT i.name AS item, i.category, i.item_type, l.quantity, l.price,"
+                " l.quantity * l.price AS total, l.time AS timestamp, l.instructions, l.menu_version, l.gst_bp"
+                " FROM bill_lines l JOIN line_items i ON i.id = l.item_id"
+                " WHERE l.bill_id = ? ORDER BY l.line_no",
+                (bill_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,388 @@
+"""Open table tabs shared by every terminal, in one server process or several.
+
+``TableStore`` keeps the tabs in this process's memory. ``SqliteTableStore``
+keeps them in a SQLite database in WAL mode, so several app processes behind
+a load balancer serve the same tables without session affinity.
+``open_table_store`` picks one from ``RESTAURANT_TABLE_STORE``.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from billing import Bill
+from config import DATA_DIR
+
+MAX_TABLES = 50
+
+DEFAULT_TABLES_DB_PATH = os.path.join(DATA_DIR, "tables.db")
+
+
+class ConflictError(Exception):
+    """The tab changed (on another terminal or process) since the version this edit was based on."""
+
+
+class TableTab:
+    """The running order of one table, guarded by its own lock."""
+
+    def __init__(self, table, catalog):
+        self.table = table
+        self.bill = Bill(catalog)
+        self.customer = {"name": "", "phone": ""}
+        self.opened_at = None
+        # Lines before this index have already been sent to the kitchen
+        self.kot_cursor = 0
+        self.version = 0
+        self.lock = threading.RLock()
+
+    def _edited(self):
+        if self.bill and self.opened_at is None:
+            self.opened_at = time.time()
+        elif not self.bill:
+            self.opened_at = None
+        self.kot_cursor = min(self.kot_cursor, len(self.bill))
+
+    def _cleared(self):
+        self.bill.clear()
+        self.customer = {"name": "", "phone": ""}
+        self.kot_cursor = 0
+
+
+class TableStore:
+    """Process-wide table tabs with one lock per table.
+
+    The store lock is only held to create a tab or publish a change; edits
+    lock just the table they touch, so waiters working different tables never
+    wait on each other. Every edit bumps the tab's version and appends
+    ``(sequence, table)`` to a bounded change feed, which terminals poll with
+    ``changes_since`` to refresh only the tables that changed. In-process
+    consumers can ``subscribe`` to be called on each change instead.
+    """
+
+    def __init__(self, catalog, feed_size=1024):
+        self.catalog = catalog
+        self._tabs = {}
+        self._lock = threading.Lock()
+        self._feed = deque(maxlen=feed_size)
+        self._sequence = 0
+        self._listeners = []
+        self._counters = {}
+        # Edits that lost a race and were retried by ``update``
+        self.conflicts = 0
+
+    def tab(self, table):
+        tab = self._tabs.get(table)
+        if tab is None:
+            with self._lock:
+                tab = self._tabs.setdefault(table, TableTab(table, self.catalog))
+        return tab
+
+    @contextmanager
+    def edit(self, table, expected_version=None):
+        """Edit a table's tab in place.
+
+        With ``expected_version`` (from ``snapshot``), raises ``ConflictError``
+        instead when the tab has changed since, e.g. so "clear last item"
+        never removes a line the waiter hasn't seen.
+        """
+        tab = self.tab(table)
+        with tab.lock:
+            if expected_version is not None and tab.version != expected_version:
+                raise ConflictError(f"Table {table} was changed on another terminal")
+            yield tab
+            tab._edited()
+            tab.version += 1
+        self._publish(table)
+
+    def update(self, table, change, retries=5):
+        """Apply ``change(tab)`` in an edit and return its result.
+
+        The edit is retried if it loses a race with another process; use it
+        for changes that are safe to reapply to a newer tab, like adding a line.
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.edit(table) as tab:
+                    result = change(tab)
+                return result
+            except ConflictError:
+                self.conflicts += 1
+                if attempt == retries:
+                    raise
+
+    def close(self, table, key, finalize):
+        """Atomically bill and clear a table's tab.
+
+        ``finalize()`` (which records the bill) runs and the tab is cleared
+        under the table lock, but only while the tab still holds the order
+        ``key`` was computed from (see ``Bill.content_key``). Returns what
+        ``finalize`` returned, or ``None`` when the tab was already closed or
+        has changed since, so a repeated click can never bill it twice.
+        """
+        tab = self.tab(table)
+        with tab.lock:
+            if not tab.bill or tab.bill.content_key(table, tab.opened_at) != key:
+                return None
+            with self.edit(table):
+                result = finalize()
+                tab._cleared()
+            return result
+
+    def snapshot(self, table):
+        """A consistent copy of the table's bill, customer details and opening time."""
+        tab = self.tab(table)
+        with tab.lock:
+            return tab.bill.copy(), dict(tab.customer), tab.opened_at, tab.version
+
+    def open_tables(self):
+        return sorted(
+            (tab for tab in list(self._tabs.values()) if tab.bill),
+            key=lambda tab: tab.table,
+        )
+
+    def reserve_numbers(self, name, count, floor=0):
+        """The first of ``count`` consecutive numbers from the counter ``name``, all above ``floor``.
+
+        Counters are shared wherever the tabs are, so e.g. KOT numbers stay
+        unique across every app process using the same store.
+        """
+        with self._lock:
+            last = self._counters[name] = max(self._counters.get(name, 0), floor) + count
+        return last - count + 1
+
+    # Change notifications
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    def _publish(self, table):
+        with self._lock:
+            self._sequence += 1
+            self._feed.append((self._sequence, table))
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(table)
+
+    def changes_since(self, sequence):
+        """Latest sequence number and the tables changed after ``sequence``.
+
+        Returns ``None`` for the tables when the feed no longer reaches back
+        that far and the caller has to treat every table as changed.
+        """
+        with self._lock:
+            latest = self._sequence
+            if self._feed and self._feed[0][0] > sequence + 1:
+                return latest, None
+            return latest, {table for seq, table in self._feed if seq > sequence}
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+
+TABLES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS table_tabs (
+    table_no INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    line_count INTEGER NOT NULL,
+    opened_at REAL,
+    kot_cursor INTEGER NOT NULL,
+    customer TEXT NOT NULL,
+    lines TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SqliteTableStore(TableStore):
+    """Table tabs in a SQLite database shared by every app process on the host.
+
+    Edits are optimistic: a tab is read with its version, changed in memory
+    and written back with one ``UPDATE … WHERE version = ?`` statement, so
+    the database's write lock is held for that statement only. A write
+    that loses the race raises ``ConflictError``; ``update`` rereads and
+    retries. Closing a tab is the exception: it takes the write lock for
+    the few milliseconds the bill is being recorded, so a tab is never
+    billed and then edited before it is cleared.
+
+    SQLite lets one connection write at a time, so adding processes adds
+    capacity for page reruns and reads, not for edits and bills, which
+    stay serialized (see the ``workers`` benchmark).
+
+    Each process caches the tabs it has read and reloads one only when its
+    version moves. Every write stamps the tab with the next sequence
+    number, so ``changes_since`` sees edits made by every process;
+    ``subscribe`` listeners only hear about this process's own edits.
+    """
+
+    def __init__(self, catalog, path=DEFAULT_TABLES_DB_PATH, feed_size=1024):
+        super().__init__(catalog, feed_size)
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._db_lock = threading.RLock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(TABLES_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(table_tabs)")}
+        if "seq" not in columns:
+            # Stores created when the change feed was a table of its own
+            self._conn.execute("ALTER TABLE table_tabs ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("DROP TABLE IF EXISTS table_changes")
+
+    def _load(self, table):
+        """The stored tab (cached while its version is unchanged), or a new empty one."""
+        row = self._conn.execute("SELECT version FROM table_tabs WHERE table_no = ?", (table,)).fetchone()
+        version = row[0] if row else 0
+        tab = self._tabs.get(table)
+        if tab is not None and tab.version == version:
+            return tab
+        tab = TableTab(table, self.catalog)
+        if row:
+            version, opened_at, kot_cursor, customer, lines = self._conn.execute(
+                "SELECT version, opened_at, kot_cursor, customer, lines FROM table_tabs WHERE table_no = ?",
+                (table,),
+            ).fetchone()
+            tab.bill = Bill.from_records(self.catalog, json.loads(lines))
+            tab.customer = json.loads(customer)
+            tab.opened_at, tab.kot_cursor, tab.version = opened_at, kot_cursor, version
+        self._tabs[table] = tab
+        return tab
+
+    def _working_copy(self, table):
+        stored = self._load(table)
+        tab = TableTab(table, self.catalog)
+        tab.bill = stored.bill.copy()
+        tab.customer = dict(stored.customer)
+        tab.opened_at, tab.kot_cursor, tab.version = stored.opened_at, stored.kot_cursor, stored.version
+        return tab
+
+    def _write(self, tab):
+        """Store ``tab`` as the next version after the one it was read at, in a single statement."""
+        row = (len(tab.bill), tab.opened_at, tab.kot_cursor, json.dumps(tab.customer, ensure_ascii=False),
+               json.dumps(tab.bill.records(), ensure_ascii=False))
+        if tab.version == 0:
+            cursor = self._conn.execute(
+                "INSERT INTO table_tabs SELECT ?, 1, ?, ?, ?, ?, ?, COALESCE(MAX(seq), 0) + 1 FROM table_tabs"
+                " WHERE true ON CONFLICT (table_no) DO NOTHING",
+                (tab.table, *row),
+            )
+        else:
+            cursor = self._conn.execute(
+                "UPDATE table_tabs SET version = version + 1, line_count = ?, opened_at = ?, kot_cursor = ?,"
+                " customer = ?, lines = ?, seq = (SELECT MAX(seq) + 1 FROM table_tabs)"
+                " WHERE table_no = ? AND version = ?",
+                (*row, tab.table, tab.version),
+            )
+        if cursor.rowcount != 1:
+            raise ConflictError(f"Table {tab.table} was changed on another terminal")
+        tab.version += 1
+        self._tabs[tab.table] = tab
+
+    def tab(self, table):
+        with self._db_lock:
+            return self._load(table)
+
+    @contextmanager
+    def edit(self, table, expected_version=None):
+        with self._db_lock:
+            tab = self._working_copy(table)
+        if expected_version is not None and tab.version != expected_version:
+            raise ConflictError(f"Table {table} was changed on another terminal")
+        yield tab
+        tab._edited()
+        with self._db_lock:
+            self._write(tab)
+        self._notify(table)
+
+    def close(self, table, key, finalize):
+        with self._db_lock:
+            # Holds the write lock from the key check until the tab is cleared
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                tab = self._working_copy(table)
+                if not tab.bill or tab.bill.content_key(table, tab.opened_at) != key:
+                    self._conn.execute("ROLLBACK")
+                    return None
+                result = finalize()
+                tab._cleared()
+                tab._edited()
+                self._write(tab)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        self._notify(table)
+        return result
+
+    def reserve_numbers(self, name, count, floor=0):
+        with self._db_lock:
+            # One statement, so it is atomic across processes without an explicit transaction
+            last = self._conn.execute(
+                "INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE"
+                " SET value = MAX(value, ?) + ? RETURNING value",
+                (name, floor + count, floor, count),
+            ).fetchone()[0]
+        return last - count + 1
+
+    def snapshot(self, table):
+        with self._db_lock:
+            tab = self._load(table)
+        # Cached tabs are replaced, never changed, so this copy is consistent
+        return tab.bill.copy(), dict(tab.customer), tab.opened_at, tab.version
+
+    def open_tables(self):
+        with self._db_lock:
+            tables = [row[0] for row in self._conn.execute(
+                "SELECT table_no FROM table_tabs WHERE line_count > 0 ORDER BY table_no"
+            )]
+            return [self._load(table) for table in tables]
+
+    # Change notifications
+
+    @property
+    def sequence(self):
+        with self._db_lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM table_tabs").fetchone()[0]
+
+    def _notify(self, table):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(table)
+
+    def changes_since(self, sequence):
+        # Each tab keeps the sequence number of its last write, so this never falls behind
+        with self._db_lock:
+            changed = self._conn.execute("SELECT table_no, seq FROM table_tabs WHERE seq > ?", (sequence,)).fetchall()
+            latest = max((seq for _, seq in changed), default=None)
+            if latest is None:
+                latest = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM table_tabs").fetchone()[0]
+        return latest, {table for table, _ in changed}
+
+
+def open_table_store(catalog, backend=None, path=DEFAULT_TABLES_DB_PATH):
+    """The table store for ``backend``: ``"memory"`` (one process) or ``"sqlite"`` (several processes).
+
+    Defaults to ``RESTAURANT_TABLE_STORE``, or ``"memory"`` when unset.
+    ``path`` is the SQLite database file; the memory store ignores it.
+    """
+    backend = backend or os.environ.get("RESTAURANT_TABLE_STORE", "memory")
+    if backend == "sqlite":
+        return SqliteTableStore(catalog, path)
+    if backend == "memory":
+        return TableStore(catalog)
+    raise ValueError(f"Unknown table store {backend!r}; expected 'memory' or 'sqlite'")
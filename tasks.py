@@ -0,0 +1,214 @@
+"""Background task runner for side effects the script thread shouldn't wait on."""
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+RETRYING = "retrying"
+DONE = "done"
+FAILED = "failed"
+
+
+class PermanentError(Exception):
+    """Raised by a task that should fail straight away rather than be retried."""
+
+
+class Task:
+    """One unit of background work and its progress, readable from any thread."""
+
+    __slots__ = ("id", "name", "func", "args", "kwargs", "retries", "status", "attempts",
+                 "result", "error", "created_at", "finished_at")
+
+    def __init__(self, task_id, name, func, args, kwargs, retries):
+        self.id = task_id
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.retries = retries
+        self.status = QUEUED
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+
+class WorkerPool:
+    """Bounded job queue drained by a pool of daemon worker threads.
+
+    A job that raises is retried with exponential backoff (``backoff``,
+    then twice that, ...) until it has been retried ``retries`` times or
+    raises something ``_retryable`` rejects. Subclasses say what running a
+    job means in ``_attempt`` and record the outcome in the other hooks;
+    queueing, retries, counters and shutdown are shared.
+    """
+
+    def __init__(self, name, workers, max_queue, retries, backoff, counters):
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(counters, 0)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"{name}-{n}", daemon=True)
+            for n in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        retries = self._retries_for(job)
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(job)
+            except Exception as exc:
+                if attempt >= retries or not self._retryable(exc):
+                    self._failed(job, exc)
+                    return
+                self._retrying(job, exc)
+                self._count("retried")
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+            else:
+                self._succeeded(job, result)
+                return
+
+    # Hooks
+
+    def _attempt(self, job):
+        raise NotImplementedError
+
+    def _retries_for(self, job):
+        return self.retries
+
+    def _retryable(self, exc):
+        return True
+
+    def _retrying(self, job, exc):
+        pass
+
+    def _succeeded(self, job, result):
+        pass
+
+    def _failed(self, job, exc):
+        """Called from the ``except`` block, so ``logger.exception`` has the traceback."""
+
+    # Metrics and shutdown
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def metrics(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {"queue_depth": self._queue.qsize(), **counts}
+
+    def shutdown(self, wait=True):
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+class TaskRunner(WorkerPool):
+    """Bounded task queue drained by a pool of worker threads.
+
+    ``submit`` only enqueues, so a button handler returns as soon as its work
+    is queued; when the queue is full it raises ``queue.Full`` for the caller
+    to back off. Workers retry a failing task with exponential backoff unless
+    it raises ``PermanentError``. Up to ``history`` tasks stay available to
+    ``get`` so sessions can poll their status; the oldest finished ones are
+    dropped first, and unfinished ones never are.
+    """
+
+    def __init__(self, workers=4, max_queue=500, retries=3, backoff=0.5, history=1000):
+        self._ids = itertools.count(1)
+        self._tasks = OrderedDict()
+        self._history = history
+        super().__init__("task-worker", workers, max_queue, retries, backoff,
+                         ["queued", "done", "retried", "failed"])
+
+    def submit(self, name, func, *args, retries=None, **kwargs):
+        """Queue ``func(*args, **kwargs)``; raises ``queue.Full`` when the queue is full."""
+        task = Task(next(self._ids), name, func, args, kwargs, self.retries if retries is None else retries)
+        self._queue.put_nowait(task)
+        with self._lock:
+            self._tasks[task.id] = task
+            self._evict()
+            self._counts["queued"] += 1
+        return task
+
+    def _evict(self):
+        # Oldest finished tasks first. Unfinished ones are skipped rather than waited for, so a
+        # stuck task never pins the ones after it; there are at most max_queue + workers of them.
+        excess = len(self._tasks) - self._history
+        if excess <= 0:
+            return
+        finished = []
+        for task_id, task in self._tasks.items():
+            if task.finished:
+                finished.append(task_id)
+                if len(finished) == excess:
+                    break
+        for task_id in finished:
+            del self._tasks[task_id]
+
+    def get(self, task_id):
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def _retries_for(self, task):
+        return task.retries
+
+    def _retryable(self, exc):
+        return not isinstance(exc, PermanentError)
+
+    def _attempt(self, task):
+        task.status = RUNNING
+        task.attempts += 1
+        return task.func(*task.args, **task.kwargs)
+
+    def _retrying(self, task, exc):
+        task.error = str(exc) or type(exc).__name__
+        task.status = RETRYING
+
+    def _succeeded(self, task, result):
+        task.result = result
+        task.error = None
+        self._finish(task, DONE)
+
+    def _failed(self, task, exc):
+        task.error = str(exc) or type(exc).__name__
+        logger.exception("Task #%s (%s) failed", task.id, task.name)
+        self._finish(task, FAILED)
+
+    def _finish(self, task, status):
+        task.finished_at = time.monotonic()
+        task.status = status
+        # Drop the callable and its arguments; only the outcome is kept for polling
+        task.func = task.args = task.kwargs = None
+        self._count(status)
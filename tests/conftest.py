@@ -0,0 +1,52 @@
+import os
+import sys
+from datetime import date, datetime
+
+import pytest
+
+# The app modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sales_ledger import SalesLedger  # noqa: E402
+
+
+@pytest.fixture
+def book():
+    """A recipe book with one ingredient and one dish: 500 ml of milk, 200 ml per Lassi."""
+    return {
+        "ingredients": {"milk": {"unit": "ml", "opening_stock": 500, "reorder_level": 100}},
+        "recipes": {"Lassi": {"milk": 200}},
+    }
+
+
+@pytest.fixture
+def lassi_bill():
+    """Makes bill data for ``quantity`` Lassis, dated now, optionally for a customer's ``phone``."""
+    def make(quantity=1, phone=""):
+        return {
+            "date": str(date.today()), "time": datetime.now().strftime("%H:%M:%S"),
+            "customer": {"name": "Asha", "table": 1, "phone": phone},
+            "orders": [{"item": "Lassi", "category": "🥤 Beverages", "quantity": quantity, "price": 60.0}],
+            "payment_mode": "💵 Cash", "subtotal": 60.0 * quantity, "total_amount": 70.8 * quantity,
+        }
+    return make
+
+
+@pytest.fixture
+def failing_store():
+    """A ledger store factory whose ``record`` fails, rolling back the bill being appended."""
+    class FailingStore:
+        def __init__(self, conn, lock, after_commit):
+            pass
+
+        def record(self, bill_data):
+            raise RuntimeError("disk full")
+
+    return FailingStore
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = SalesLedger(str(tmp_path / "sales.db"))
+    yield ledger
+    ledger.close()
@@ -0,0 +1,102 @@
+import copy
+
+import pytest
+
+from billing import Bill
+from catalog import MenuCatalog, _MenuIndex, load_menu
+
+QUERIES = ["naan", "pan", "chicken", "butter n", "chiken", "lasi", "soup"]
+
+
+def edits():
+    """Successive menus: a price edit, a removal, a category move, then the removed item back."""
+    menu = load_menu()
+    yield "original", copy.deepcopy(menu)
+    menu["🥘 Main Course"]["Butter Chicken"]["price"] = 340
+    menu["🫓 Breads"]["Garlic Naan"]["spicy"] = True
+    yield "price edit", copy.deepcopy(menu)
+    removed = menu["🥗 Starters"].pop("Paneer Chilly")
+    yield "removal", copy.deepcopy(menu)
+    menu["🥗 Starters"]["Masala Tea"] = menu["🥤 Beverages"].pop("Masala Tea")
+    yield "category move", copy.deepcopy(menu)
+    menu["🥗 Starters"]["Paneer Chilly"] = removed
+    yield "re-add", copy.deepcopy(menu)
+
+
+def fields(items):
+    # Ids depend on the order items were first seen, so compare what the items are
+    return sorted(item[1:] for item in items)
+
+
+def view(index):
+    filter_keys = [(category, veg, spicy) for category in [None] + index.categories
+                   for veg in (False, True) for spicy in (False, True)]
+    return {
+        "categories": index.categories,
+        "by_name": {name: item[1:] for name, item in index.by_name.items()},
+        "names_lower": {name: item[1:] for name, item in index.names_lower.items()},
+        "category_masks": {category: fields(index.items_in(mask)) for category, mask in index.category_masks.items()
+                           if mask},
+        "veg_mask": fields(index.items_in(index.veg_mask)),
+        "spicy_mask": fields(index.items_in(index.spicy_mask)),
+        "all_mask": fields(index.items_in(index.all_mask)),
+        "masks": {key: fields(index.items_in(index.mask(*key))) for key in filter_keys},
+        "filter_sets": {key: fields(items) for key, items in index.filter_sets.items()},
+        "word_masks": {word: fields(index.items_in(mask)) for word, mask in index.word_masks.items()},
+        "prefix_index": sorted((word, index.items[item_id].name) for word, item_id in index.prefix_index),
+    }
+
+
+def test_patched_index_matches_a_fresh_build():
+    patched = None
+    for step, menu in edits():
+        if patched is None:
+            patched = MenuCatalog(menu)
+        else:
+            assert patched.apply(menu), step
+        fresh = MenuCatalog(menu)
+        assert fresh._index.version == 1
+
+        assert view(patched._index) == view(fresh._index), step
+        for query in QUERIES:
+            assert fields(patched.search(query, limit=50)) == fields(fresh.search(query, limit=50)), (step, query)
+        for category, items in menu.items():
+            for name in items:
+                assert patched.by_id(patched.id_for(name, category))[1:] == \
+                    fresh.by_id(fresh.id_for(name, category))[1:], (step, name)
+
+
+def test_unchanged_menu_keeps_the_version():
+    menu = load_menu()
+    catalog = MenuCatalog(menu)
+    index = catalog._index
+    assert catalog.apply(copy.deepcopy(menu)) == 0
+    assert catalog._index is index and _MenuIndex().patched({})[1] == 0
+
+
+def test_retired_items_still_resolve_for_open_tabs():
+    steps = dict(edits())
+    catalog = MenuCatalog(steps["original"])
+    bill = Bill(catalog)
+    bill.add(catalog["Paneer Chilly"], 2)
+    bill.add(catalog["Masala Tea"])
+    paneer_id = catalog.id_for("Paneer Chilly", "🥗 Starters")
+    tea_id = catalog.id_for("Masala Tea", "🥤 Beverages")
+
+    catalog.apply(steps["removal"])
+    catalog.apply(steps["category move"])
+    assert "Paneer Chilly" not in catalog
+    assert catalog.id_for("Paneer Chilly", "🥗 Starters") == paneer_id
+    assert catalog.id_for("Masala Tea", "🥤 Beverages") == tea_id
+    # The tab still bills the items as ordered, under the category they were ordered from
+    assert [(line["item"], line["category"], line["quantity"]) for line in bill.line_dicts()] == [
+        ("Paneer Chilly", "🥗 Starters", 2), ("Masala Tea", "🥤 Beverages", 1)]
+    assert "🥤 Beverages" in bill.category_quantities
+    assert not any(item.name == "Paneer Chilly" for item in catalog.filter())
+    assert catalog.search("paneer chilly") == ()
+
+    # Back on the menu under the same category, it gets its old id back
+    catalog.apply(steps["re-add"])
+    assert catalog["Paneer Chilly"].id == paneer_id
+    with pytest.raises(KeyError):
+        catalog.id_for("Paneer Chilly", "🍲 Soups")
@@ -0,0 +1,46 @@
+import pytest
+
+from customers import CustomerStore, normalize_phone, points_for, tier_for
+
+
+@pytest.mark.parametrize("points, tier", [
+    (0, "🥉 Bronze"), (499, "🥉 Bronze"), (500, "🥈 Silver"), (1999, "🥈 Silver"),
+    (2000, "🥇 Gold"), (10 ** 6, "🥇 Gold"),
+])
+def test_tier_boundaries(points, tier):
+    assert tier_for(points).name == tier
+
+
+def test_points_round_down_to_whole_tens_of_rupees():
+    assert [points_for(total) for total in (0, 9.99, 10, 19.99, 70.8, 1234.5)] == [0, 0, 1, 1, 7, 123]
+
+
+def test_one_profile_per_number_however_it_was_typed(ledger, lassi_bill):
+    customers = ledger.attach(CustomerStore)
+    for phone in ("+91 98765 43210", "098765-43210", "9876543210"):
+        ledger.append(lassi_bill(10, phone=phone))
+    ledger.append(lassi_bill(phone="12345"))
+
+    assert [row[0] for row in ledger._conn.execute("SELECT phone FROM customers")] == ["9876543210"]
+    profile = customers.lookup("(987) 654-3210")
+    assert (profile.visits, profile.points) == (3, 3 * points_for(708))
+    assert customers.lookup("+919876543210") == profile
+    assert customers.tier("98765 43210").name == "🥉 Bronze"
+    assert normalize_phone("12345") is None and customers.lookup("12345") is None
+
+
+def test_profiles_are_built_from_a_ledger_that_already_has_bills(ledger, lassi_bill):
+    ledger.append(lassi_bill(100, phone="98765 43210"))
+    ledger.append(lassi_bill(1, phone=""))
+    ledger.append(lassi_bill(50, phone="+91 98765 43210"))
+    ledger.append(lassi_bill(1, phone="91234 56789"))
+    ledger.flush()
+
+    customers = ledger.attach(CustomerStore)
+    profile = customers.lookup("9876543210")
+    assert profile.visits == 2 and profile.name == "Asha"
+    assert profile.spend == pytest.approx(70.8 * 150)
+    assert profile.points == points_for(7080) + points_for(3540)
+    assert customers.tier("9876543210").name == "🥈 Silver"
+    assert customers.lookup("9123456789").visits == 1
+    assert ledger._conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0] == 2
@@ -0,0 +1,37 @@
+from functools import partial
+
+import pytest
+
+from inventory import InventoryStore
+from sales_ledger import SalesLedger
+
+
+def test_rolled_back_bill_leaves_stock_and_menu_alone(ledger, book, lassi_bill, failing_store):
+    inventory = ledger.attach(partial(InventoryStore, book=book))
+    changes = []
+    inventory.subscribe(changes.append)
+    ledger.attach(failing_store)
+
+    with pytest.raises(RuntimeError):
+        ledger.append(lassi_bill(3))
+
+    assert inventory.level("milk") == 500
+    assert inventory.unavailable == frozenset() and changes == []
+    stored = ledger._conn.execute("SELECT quantity FROM stock_levels WHERE ingredient = 'milk'").fetchone()[0]
+    assert stored == 500
+
+
+def test_stock_changes_when_the_batch_commits(tmp_path, book, lassi_bill):
+    ledger = SalesLedger(str(tmp_path / "sales.db"), batch_size=2, max_delay=60)
+    inventory = ledger.attach(partial(InventoryStore, book=book))
+    changes = []
+    inventory.subscribe(changes.append)
+
+    ledger.append(lassi_bill(1))
+    assert inventory.level("milk") == 500
+    ledger.append(lassi_bill(1))
+    ledger.flush()
+
+    assert inventory.level("milk") == 100
+    assert changes == [frozenset({"Lassi"})]
+    ledger.close()
@@ -0,0 +1,61 @@
+import os
+
+from kitchen import KitchenDispatcher, SpoolPrinter
+
+LINES = [{"item": "Butter Chicken", "category": "🥘 Main Course", "quantity": 1}]
+
+
+def spooled(directory):
+    return sorted(os.listdir(os.path.join(directory, "kitchen")))
+
+
+def test_numbering_carries_on_after_restart(tmp_path):
+    first = KitchenDispatcher({"kitchen": SpoolPrinter(str(tmp_path))})
+    first.submit(1, LINES)
+    first.shutdown()
+
+    second = KitchenDispatcher({"kitchen": SpoolPrinter(str(tmp_path))})
+    (ticket,) = second.submit(2, LINES)
+    second.shutdown()
+
+    assert ticket.number == 2
+    assert spooled(tmp_path) == ["kot_000001.txt", "kot_000002.txt"]
+
+
+def test_dispatchers_sharing_a_spool_keep_both_tickets(tmp_path):
+    # As two app processes started together would, both number from #1
+    dispatchers = [KitchenDispatcher({"kitchen": SpoolPrinter(str(tmp_path))}) for _ in range(2)]
+    for table, dispatcher in enumerate(dispatchers, 1):
+        dispatcher.submit(table, LINES)
+    for dispatcher in dispatchers:
+        dispatcher.shutdown()
+
+    names = spooled(tmp_path)
+    assert names == ["kot_000001-2.txt", "kot_000001.txt"]
+    tables = set()
+    for name in names:
+        with open(os.path.join(tmp_path, "kitchen", name), encoding="utf-8") as ticket_file:
+            tables.add(ticket_file.read().splitlines()[1].split()[1])
+    assert tables == {"1", "2"}
+
+
+def test_processes_sharing_a_table_store_share_ticket_numbers(tmp_path):
+    from functools import partial
+
+    from catalog import MenuCatalog
+    from table_store import SqliteTableStore
+
+    os.makedirs(tmp_path / "spool" / "kitchen")
+    (tmp_path / "spool" / "kitchen" / "kot_000005.txt").write_text("from before the restart\n")
+    dispatchers = []
+    for _ in range(2):
+        tables = SqliteTableStore(MenuCatalog({}), str(tmp_path / "tables.db"))
+        dispatchers.append(KitchenDispatcher({"kitchen": SpoolPrinter(str(tmp_path / "spool"))},
+                                             numbers=partial(tables.reserve_numbers, "kot")))
+    numbers = [ticket.number for table, dispatcher in enumerate(dispatchers, 1)
+               for ticket in dispatcher.submit(table, LINES)]
+    for dispatcher in dispatchers:
+        dispatcher.shutdown()
+
+    assert numbers == [6, 7]
+    assert spooled(tmp_path / "spool") == ["kot_000005.txt", "kot_000006.txt", "kot_000007.txt"]
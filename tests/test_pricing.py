@@ -0,0 +1,73 @@
+import random
+
+import pricing
+from pricing import DEFAULT_GST_BP, discount_rules, quote, quote_lines, quote_many, to_bp, to_paise
+from reports import reconcile_range
+from sales_ledger import SalesLedger
+
+
+def test_discounts_stack_then_gst_on_the_net():
+    bill_quote = quote({DEFAULT_GST_BP: 100000}, discount_rules({"percentage": 10, "loyalty": 5, "fixed": 50}))
+    # 10% off ₹1000, then 5% off ₹900, then ₹50 off
+    assert bill_quote.discount == 10000 + 4500 + 5000
+    assert bill_quote.tax == (80500 * DEFAULT_GST_BP + 5000) // 10000
+    assert bill_quote.total == 80500 + bill_quote.tax
+
+
+def test_fixed_discount_never_goes_below_zero():
+    assert quote({DEFAULT_GST_BP: 3000}, discount_rules({"fixed": 100})).total == 0
+
+
+def test_items_are_taxed_at_their_slab():
+    lines = [
+        {"item": "Butter Chicken", "category": "🥘 Main Course", "price": 320, "quantity": 1},
+        {"item": "Lassi", "category": "🥤 Beverages", "price": 60, "quantity": 2},
+        {"item": "Masala Tea", "category": "🥤 Beverages", "price": 25, "quantity": 1},
+    ]
+    bill_quote = quote_lines(lines, {})
+    # The item's own slab wins over its category's
+    assert bill_quote.tax_by_rate == {1800: 5760, 1200: 1440, 500: 125}
+    assert pricing.tax_label(bill_quote) == "5%/12%/18% GST"
+
+
+def test_quote_many_matches_quote_on_mixed_slab_bills():
+    rng = random.Random(7)
+    rates = [500, 1200, 1800]
+    slabs, discounts = [], []
+    for _ in range(500):
+        # Some slabs left empty, so the discount split has to skip them
+        slabs.append({rate: rng.choice([0, rng.randrange(1, 200000)]) for rate in rates})
+        discounts.append({"percentage": rng.choice([0, 5, 12.5]), "loyalty": rng.choice([0, 5, 7.5, 10]),
+                          "fixed": rng.choice([0, 25, 99.99])})
+
+    figures = quote_many(
+        [[bill_slabs[rate] for rate in rates] for bill_slabs in slabs],
+        rates,
+        [to_bp(d["percentage"]) for d in discounts],
+        [to_bp(d["loyalty"]) for d in discounts],
+        [to_paise(d["fixed"]) for d in discounts],
+    )
+    for i, (bill_slabs, d) in enumerate(zip(slabs, discounts)):
+        expected = quote(bill_slabs, discount_rules(d))
+        assert [int(column[i]) for column in figures] == list(expected[:4])
+        assert sum(expected.tax_by_rate.values()) == expected.tax
+
+
+def test_reconciliation_reprices_at_the_rate_each_line_was_charged(tmp_path, monkeypatch):
+    ledger = SalesLedger(str(tmp_path / "sales.db"))
+    lines = [
+        {"item": "Lassi", "category": "🥤 Beverages", "item_type": "veg", "price": 60.0, "quantity": 2},
+        {"item": "Veg Handi", "category": "🥘 Main Course", "item_type": "veg", "price": 220.0, "quantity": 1},
+    ]
+    totals = quote_lines(lines, {"percentage": 10})
+    ledger.append({"date": "2026-10-01", "time": "13:00:00", "orders": lines, "payment_mode": "📱 UPI",
+                   "subtotal": totals.subtotal / 100, "total_amount": totals.total / 100,
+                   "discount": {"percentage": 10}})
+    ledger.close()
+
+    # Beverages move slab after the bill was recorded
+    monkeypatch.setitem(pricing.GST_SLABS, "🥤 Beverages", 1800)
+    reconciliation = reconcile_range(str(tmp_path / "sales.db"), "2026-10-01", "2026-10-01")
+    day, _ = reconciliation.summary()
+    assert day["mismatched_bills"] == 0
+    assert day["tax"] == totals.tax / 100
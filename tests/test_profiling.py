@@ -0,0 +1,13 @@
+from profiling import MetricsRegistry
+
+
+def test_run_cut_short_by_a_rerun_is_recorded():
+    registry = MetricsRegistry(enabled=True, export=False)
+    interrupted = registry.start()
+    interrupted.section("order_summary")
+    # st.rerun() raised before finish(); the next run starts on the same thread
+    registry.start().finish()
+
+    summary = registry.summary()
+    assert summary["rerun"]["runs"] == 2
+    assert summary["order_summary"]["runs"] == 1
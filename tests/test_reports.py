@@ -0,0 +1,72 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from catalog import load_catalog
+from pricing import quote_lines, to_rupees
+from reports import reconcile_range
+from sales_ledger import SalesLedger
+
+FIRST_DAY = date(2026, 10, 1)
+DAYS = 10
+
+
+@pytest.fixture(scope="module")
+def ledger_path(tmp_path_factory):
+    """A ledger of 300 bills over ten days, priced like the app prices them, with mixed discounts."""
+    path = str(tmp_path_factory.mktemp("reports") / "sales.db")
+    rng = random.Random(14)
+    menu = load_catalog().filter()
+    ledger = SalesLedger(path, batch_size=100)
+    for _ in range(300):
+        orders = []
+        for item in rng.sample(menu, rng.randint(1, 5)):
+            quantity = rng.randint(1, 3)
+            orders.append({"item": item.name, "category": item.category, "item_type": item.item_type,
+                           "price": item.price, "quantity": quantity, "total": item.price * quantity})
+        discount = {"percentage": rng.choice([0, 0, 10]), "loyalty": rng.choice([0, 5, 7.5]),
+                    "fixed": rng.choice([0, 0, 25])}
+        totals = quote_lines(orders, discount)
+        ledger.append({
+            "date": str(FIRST_DAY + timedelta(days=rng.randrange(DAYS))), "time": f"{rng.randint(11, 22):02d}:15:00",
+            "customer": {"name": "", "table": rng.randint(1, 8), "phone": ""}, "orders": orders,
+            "payment_mode": rng.choice(["💵 Cash", "📱 UPI"]), "discount": discount,
+            "subtotal": to_rupees(totals.subtotal), "total_amount": to_rupees(totals.total),
+        })
+    ledger.close()
+    return path
+
+
+def reconcile_all(path, workers=1):
+    return reconcile_range(path, FIRST_DAY, FIRST_DAY + timedelta(days=DAYS - 1), workers, chunk_size=64)
+
+
+def test_process_pool_run_matches_a_single_process_run(ledger_path):
+    single = reconcile_all(ledger_path)
+    pooled = reconcile_all(ledger_path, workers=3)
+
+    assert vars(pooled) == vars(single)
+    assert pooled.reports() == single.reports()
+    total = single.summary()[-1]
+    assert total["bills"] == 300 and total["mismatched_bills"] == 0
+
+
+def test_tampered_bill_is_reported_as_a_mismatch(ledger_path, tmp_path):
+    path = str(tmp_path / "tampered.db")
+    source = SalesLedger(ledger_path)
+    source._conn.execute("VACUUM INTO ?", (path,))
+    source.close()
+    ledger = SalesLedger(path)
+    day, before = ledger._conn.execute("SELECT date, total_amount FROM bills WHERE id = 42").fetchone()
+    # Quietly knock ₹50 off a recorded bill
+    ledger._conn.execute("UPDATE bills SET total_amount = total_amount - 50 WHERE id = 42")
+    ledger.close()
+
+    for workers in (1, 3):
+        rows = {row["date"]: row for row in reconcile_all(path, workers).summary()}
+        assert rows[day]["mismatched_bills"] == 1
+        assert rows[day]["mismatch_amount"] == pytest.approx(-50)
+        assert rows["TOTAL"]["mismatched_bills"] == 1
+        assert sum(row["mismatched_bills"] for key, row in rows.items() if key != "TOTAL") == 1
+    assert before > 50
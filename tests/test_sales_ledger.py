@@ -0,0 +1,141 @@
+import random
+from functools import partial
+
+import pytest
+
+from billing import PAYMENT_MODES
+from sales_ledger import BILL_SORTS, BillFilter, SalesLedger, filter_clauses
+
+
+class Recorder:
+    """A ledger store that records, after commit, the key of every bill it saw; can be made to fail."""
+
+    def __init__(self, conn, lock, after_commit):
+        self.after_commit = after_commit
+        self.committed = []
+        self.fail = False
+
+    def record(self, bill_data):
+        self.after_commit(partial(self.committed.append, bill_data["bill_key"]))
+        if self.fail:
+            raise RuntimeError("disk full")
+
+
+def keyed(bill_data, key):
+    return dict(bill_data, bill_key=key)
+
+
+def test_same_bill_twice_is_recorded_once(tmp_path, lassi_bill):
+    path = str(tmp_path / "sales.db")
+    ledger, other = SalesLedger(path), SalesLedger(path)
+    bill_data = keyed(lassi_bill(2), "table-1")
+
+    bill_id = ledger.append(bill_data)
+    assert ledger.append(dict(bill_data)) == bill_id
+    # Another process that has never seen the key hits the unique index instead
+    assert other.append(dict(bill_data)) == bill_id
+    assert other.bill_id_for("table-1") == bill_id
+    assert ledger._conn.execute("SELECT COUNT(*) FROM bills").fetchone()[0] == 1
+    assert ledger._conn.execute("SELECT COUNT(*) FROM bill_lines").fetchone()[0] == 1
+    ledger.close()
+    other.close()
+
+
+def test_rolled_back_bill_is_not_remembered_by_key(tmp_path, lassi_bill, failing_store):
+    path = str(tmp_path / "sales.db")
+    ledger = SalesLedger(path)
+    ledger.attach(failing_store)
+
+    with pytest.raises(RuntimeError):
+        ledger.append(keyed(lassi_bill(), "table-1"))
+    assert ledger.bill_id_for("table-1") is None
+    ledger.close()
+
+    # The retry, without the failure, records the bill
+    ledger = SalesLedger(path)
+    bill_id = ledger.append(keyed(lassi_bill(), "table-1"))
+    assert ledger.bill_id_for("table-1") == bill_id
+    ledger.close()
+
+
+def test_after_commit_callbacks_of_a_rolled_back_bill_never_run(tmp_path, lassi_bill):
+    ledger = SalesLedger(str(tmp_path / "sales.db"), batch_size=2, max_delay=60)
+    recorder = ledger.attach(Recorder)
+
+    ledger.append(keyed(lassi_bill(), "first"))
+    recorder.fail = True
+    with pytest.raises(RuntimeError):
+        ledger.append(keyed(lassi_bill(), "second"))
+    assert recorder.committed == []
+
+    # The batch still commits the bill before the failed one, and only its callback runs
+    ledger.flush()
+    assert recorder.committed == ["first"]
+    assert ledger.bill_id_for("second") is None
+    ledger.close()
+
+
+@pytest.fixture
+def history(tmp_path):
+    """A ledger of 120 bills over a week with repeated totals, tables and customers' phones."""
+    rng = random.Random(20)
+    phones = ["+91 98765 43210", "9876543210", "098765-43210", "91234 56789", ""]
+    ledger = SalesLedger(str(tmp_path / "sales.db"), batch_size=50)
+    for _ in range(120):
+        quantity = rng.randint(1, 4)
+        ledger.append({
+            "date": f"2026-10-{rng.randint(10, 16)}", "time": f"{rng.randint(11, 22):02d}:00:00",
+            "customer": {"name": "", "table": rng.randint(1, 3), "phone": rng.choice(phones)},
+            "orders": [{"item": "Lassi", "category": "🥤 Beverages", "quantity": quantity, "price": 60.0}],
+            "payment_mode": rng.choice(PAYMENT_MODES[:2]), "total_amount": 70.8 * quantity,
+        })
+    ledger.flush()
+    yield ledger
+    ledger.close()
+
+
+def all_pages(ledger, filters, sort, limit):
+    rows, cursor = [], None
+    while True:
+        page, cursor = ledger.bill_page(filters, sort, cursor, limit)
+        assert len(page) <= limit
+        rows.extend(page)
+        if cursor is None:
+            return rows
+
+
+@pytest.mark.parametrize("sort", list(BILL_SORTS))
+@pytest.mark.parametrize("filters", [
+    BillFilter(),
+    BillFilter(start="2026-10-12", end="2026-10-14"),
+    BillFilter(table=2, payment_mode=PAYMENT_MODES[1]),
+    BillFilter(phone="98765 43210"),
+])
+def test_paging_through_the_history_returns_every_bill_once(history, filters, sort):
+    columns, descending = BILL_SORTS[sort]
+    clauses, params = filter_clauses(filters)
+    expected = [tuple(row) for row in history._conn.execute(
+        "SELECT id FROM bills" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+        + " ORDER BY " + ", ".join(column + (" DESC" if descending else "") for column in columns), params,
+    )]
+
+    for limit in (7, 25, 1000):
+        assert [(row["id"],) for row in all_pages(history, filters, sort, limit)] == expected
+    assert history.count_bills(filters) == len(expected)
+
+
+def test_phone_filter_matches_however_the_number_was_typed(history):
+    typed = [history.count_bills(BillFilter(phone=phone)) for phone in ("9876543210", "+91-98765-43210")]
+    stored = history._conn.execute("SELECT COUNT(*) FROM bills WHERE phone LIKE '%98765%43210'").fetchone()[0]
+    assert typed == [stored, stored] and stored > 0
+
+
+def test_count_follows_appended_bills(history, lassi_bill):
+    filters = BillFilter(phone="9876543210")
+    before, everything = history.count_bills(filters), history.count_bills()
+
+    history.append(lassi_bill(phone="+91 98765 43210"))
+    assert history.count_bills(filters) == before + 1
+    history.append(lassi_bill(phone="91234 56789"))
+    assert history.count_bills(filters) == before + 1
+    assert history.count_bills() == everything + 2
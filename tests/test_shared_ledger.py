@@ -0,0 +1,52 @@
+"""Two ledgers on one database file stand in for two app processes."""
+from functools import partial
+
+import pytest
+
+from customers import CustomerStore
+from forecasting import DemandForecaster
+from inventory import InventoryStore
+from sales_ledger import SalesLedger
+
+
+@pytest.fixture
+def ledgers(tmp_path):
+    path = str(tmp_path / "sales.db")
+    pair = [SalesLedger(path), SalesLedger(path)]
+    yield pair
+    for ledger in pair:
+        ledger.close()
+
+
+def test_customer_billed_elsewhere_is_found(ledgers, lassi_bill):
+    here, there = [ledger.attach(CustomerStore) for ledger in ledgers]
+    assert here.lookup("98765 43210") is None
+
+    ledgers[1].append(lassi_bill(phone="9876543210"))
+    assert here.lookup("9876543210").visits == 1
+    ledgers[1].append(lassi_bill(phone="9876543210"))
+    assert here.lookup("9876543210").visits == 2
+    assert there.lookup("9876543210").visits == 2
+
+
+def test_stock_used_elsewhere_is_seen(ledgers, book, lassi_bill):
+    here, _ = [ledger.attach(partial(InventoryStore, book=book)) for ledger in ledgers]
+    changes = []
+    here.subscribe(changes.append)
+
+    ledgers[1].append(lassi_bill(2))
+    assert here.level("milk") == 100
+    assert here.unavailable == frozenset({"Lassi"}) and changes == [frozenset({"Lassi"})]
+
+
+def test_sales_elsewhere_reach_the_forecaster(ledgers, lassi_bill):
+    forecaster = DemandForecaster(ledgers[0].analytics)
+    ledgers[0].subscribe(forecaster.record)
+    assert forecaster.sold() == {}
+
+    ledgers[1].append(lassi_bill(2))
+    assert forecaster.sold() == {"Lassi": 2}
+    # This process's own bill after the reload is added exactly once
+    ledgers[0].append(lassi_bill(1))
+    ledgers[1].append(lassi_bill(1))
+    assert forecaster.sold() == {"Lassi": 4}
@@ -0,0 +1,115 @@
+import pytest
+
+from catalog import MenuCatalog
+from table_store import ConflictError, SqliteTableStore, open_table_store
+
+MENU = {
+    "🥘 Main Course": {"Veg Handi": {"price": 220, "category": "veg"}},
+    "🍰 Desserts": {"Rasgulla": {"price": 80, "description": "Spongy", "category": "veg"}},
+}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "tables.db")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, path):
+    return open_table_store(MenuCatalog(MENU), request.param, path)
+
+
+def test_tab_opens_in_a_process_whose_menu_dropped_an_item(path):
+    catalog = MenuCatalog(MENU)
+    store = SqliteTableStore(catalog, path)
+    store.update(1, lambda tab: tab.bill.add(catalog["Rasgulla"], 2))
+    store.update(2, lambda tab: tab.bill.add(catalog["Veg Handi"]))
+    bill, _, opened_at, _ = store.snapshot(1)
+
+    # A worker started after Rasgulla was taken off menu.json
+    other_catalog = MenuCatalog({"🥘 Main Course": MENU["🥘 Main Course"]})
+    other = SqliteTableStore(other_catalog, path)
+    other_bill, _, other_opened_at, _ = other.snapshot(1)
+
+    assert [tab.table for tab in other.open_tables()] == [1, 2]
+    (line,) = other_bill.line_dicts()
+    assert (line["item"], line["category"], line["price"], line["quantity"]) == ("Rasgulla", "🍰 Desserts", 80, 2)
+    assert other_bill.totals({}).total == bill.totals({}).total
+    assert other_bill.content_key(1, other_opened_at) == bill.content_key(1, opened_at)
+    # Resolvable for the open order, but not back on the menu
+    assert "Rasgulla" not in other_catalog
+    assert other_catalog.filter() == (other_catalog["Veg Handi"],)
+
+
+def test_edit_based_on_an_old_version_conflicts(store):
+    catalog = store.catalog
+    store.update(1, lambda tab: tab.bill.add(catalog["Veg Handi"]))
+    version = store.snapshot(1)[3]
+    store.update(1, lambda tab: tab.bill.add(catalog["Rasgulla"]))
+
+    with pytest.raises(ConflictError):
+        with store.edit(1, expected_version=version) as tab:
+            tab.bill.pop()
+    assert len(store.snapshot(1)[0]) == 2
+
+    with store.edit(1, expected_version=store.snapshot(1)[3]) as tab:
+        tab.bill.pop()
+    assert len(store.snapshot(1)[0]) == 1
+
+
+def test_changes_since_returns_only_newer_tabs(store):
+    catalog = store.catalog
+    store.update(1, lambda tab: tab.bill.add(catalog["Veg Handi"]))
+    sequence = store.sequence
+    store.update(2, lambda tab: tab.bill.add(catalog["Rasgulla"]))
+    store.update(3, lambda tab: tab.bill.add(catalog["Rasgulla"]))
+
+    latest, tables = store.changes_since(sequence)
+    assert tables == {2, 3} and latest == store.sequence
+    assert store.changes_since(latest) == (latest, set())
+
+
+def test_close_after_a_concurrent_edit_leaves_the_tab_open(store):
+    catalog = store.catalog
+    store.update(1, lambda tab: tab.bill.add(catalog["Veg Handi"]))
+    bill, _, opened_at, _ = store.snapshot(1)
+    key = bill.content_key(1, opened_at)
+    # Another terminal adds to the order while the bill is being generated
+    store.update(1, lambda tab: tab.bill.add(catalog["Rasgulla"]))
+
+    billed = []
+    assert store.close(1, key, lambda: billed.append(key)) is None
+    assert billed == [] and len(store.snapshot(1)[0]) == 2
+
+    bill, _, opened_at, _ = store.snapshot(1)
+    assert store.close(1, bill.content_key(1, opened_at), lambda: 42) == 42
+    assert len(store.snapshot(1)[0]) == 0 and store.open_tables() == []
+
+
+def test_edit_in_another_process_conflicts(path):
+    catalog = MenuCatalog(MENU)
+    store = SqliteTableStore(catalog, path)
+    other = SqliteTableStore(MenuCatalog(MENU), path)
+    store.update(1, lambda tab: tab.bill.add(catalog["Veg Handi"]))
+    version = store.snapshot(1)[3]
+    other.update(1, lambda tab: tab.bill.add(other.catalog["Rasgulla"]))
+
+    with pytest.raises(ConflictError):
+        with store.edit(1, expected_version=version) as tab:
+            tab.bill.pop()
+    assert len(store.snapshot(1)[0]) == 2
+
+
+def test_changes_made_in_another_process_reach_the_feed(path):
+    catalog = MenuCatalog(MENU)
+    store = SqliteTableStore(catalog, path)
+    other = SqliteTableStore(MenuCatalog(MENU), path)
+    store.update(1, lambda tab: tab.bill.add(catalog["Veg Handi"]))
+    sequence = store.sequence
+
+    other.update(2, lambda tab: tab.bill.add(other.catalog["Rasgulla"]))
+    other.update(1, lambda tab: tab.bill.add(other.catalog["Rasgulla"]))
+    latest, tables = store.changes_since(sequence)
+
+    assert tables == {1, 2} and latest == sequence + 2
+    assert store.changes_since(latest) == (latest, set())
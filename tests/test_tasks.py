@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from kitchen import KitchenDispatcher
+from tasks import DONE, FAILED, PermanentError, TaskRunner
+
+
+def wait(pool):
+    pool._queue.join()
+    pool.shutdown()
+
+
+def flaky(failures, exc=RuntimeError):
+    calls = []
+
+    def run():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise exc("not yet")
+        return len(calls)
+    return run
+
+
+def test_task_is_retried_until_it_succeeds():
+    runner = TaskRunner(workers=1, backoff=0)
+    task = runner.submit("flaky", flaky(2))
+    wait(runner)
+    assert (task.status, task.result, task.attempts) == (DONE, 3, 3)
+    assert runner.metrics()["retried"] == 2
+
+
+@pytest.mark.parametrize("exc, attempts", [(PermanentError, 1), (RuntimeError, 4)])
+def test_task_fails_when_permanent_or_out_of_retries(exc, attempts):
+    runner = TaskRunner(workers=1, retries=3, backoff=0)
+    task = runner.submit("broken", flaky(10, exc))
+    wait(runner)
+    assert (task.status, task.attempts, task.error) == (FAILED, attempts, "not yet")
+
+
+class FlakyPrinter:
+    def __init__(self, failures, exc):
+        self._send = flaky(failures, exc)
+
+    def send(self, ticket):
+        self._send()
+
+
+@pytest.mark.parametrize("exc, sent, retried, failed", [(OSError, 1, 2, 0), (ValueError, 0, 0, 1)])
+def test_kitchen_retries_only_printer_errors(exc, sent, retried, failed):
+    dispatcher = KitchenDispatcher({"kitchen": FlakyPrinter(2, exc)}, workers=1, backoff=0)
+    dispatcher.submit(1, [{"item": "Veg Handi", "category": "🥘 Main Course", "quantity": 1}])
+    wait(dispatcher)
+    metrics = dispatcher.metrics()
+    assert (metrics["sent"], metrics["retried"], metrics["failed"]) == (sent, retried, failed)
+
+
+def test_stuck_task_does_not_stop_older_finished_tasks_being_dropped():
+    runner = TaskRunner(workers=2, backoff=0, history=3)
+    release = threading.Event()
+    quick = [runner.submit("quick", lambda: None)]
+    stuck = runner.submit("stuck", release.wait)
+    for _ in range(20):
+        quick.append(runner.submit("quick", lambda: None))
+        while not quick[-1].finished:
+            time.sleep(0.001)
+
+    # The stuck task and the newest quick ones fill the history; every older one is dropped
+    assert runner.get(stuck.id) is stuck and not stuck.finished
+    assert [runner.get(task.id) for task in quick] == [None] * 19 + quick[-2:]
+    assert len(runner._tasks) == 3
+    release.set()
+    wait(runner)